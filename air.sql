@@ -1,5 +1,6 @@
 CREATE TABLE `airline` (
   `airline_name` varchar(50) NOT NULL,
+  `commission_rate` decimal(5,4) NOT NULL DEFAULT 0.1000,
   PRIMARY KEY(`airline_name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
@@ -16,6 +17,7 @@ CREATE TABLE `airline_staff` (
   `last_name` varchar(50) NOT NULL,
   `date_of_birth` date NOT NULL,
   `airline_name` varchar(50) NOT NULL,
+  `approved` tinyint(1) NOT NULL DEFAULT 0,
   PRIMARY KEY(`username`),
   FOREIGN KEY(`airline_name`) REFERENCES `airline`(`airline_name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
@@ -63,7 +65,9 @@ CREATE TABLE `booking_agent` (
   `email` varchar(50) NOT NULL,
   `password` varchar(50) NOT NULL,
   `booking_agent_id` int(11) NOT NULL,
-  PRIMARY KEY(`email`)
+  `approved` tinyint(1) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`email`),
+  KEY `idx_booking_agent_approved` (`approved`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
 CREATE TABLE `booking_agent_work_for` (
@@ -112,7 +116,10 @@ CREATE TABLE `flight` (
   `price` decimal(10,0) NOT NULL,
   `status` varchar(50) NOT NULL,
   `airplane_id` int(11) NOT NULL,
+  `remaining_seats` int(11) NOT NULL DEFAULT 0,
   PRIMARY KEY(`airline_name`, `flight_num`),
+  KEY `idx_flight_departure` (`departure_airport`, `departure_time`),
+  KEY `idx_flight_airline_departure` (`airline_name`, `departure_time`),
   FOREIGN KEY(`airline_name`, `airplane_id`) REFERENCES `airplane`(`airline_name`, `airplane_id`),
   FOREIGN KEY(`departure_airport`) REFERENCES `airport`(`airport_name`),
   FOREIGN KEY(`arrival_airport`) REFERENCES `airport`(`airport_name`)
@@ -126,10 +133,11 @@ CREATE TABLE `flight` (
 --
 
 CREATE TABLE `ticket` (
-  `ticket_id` int(11) NOT NULL,
+  `ticket_id` int(11) NOT NULL AUTO_INCREMENT,
   `airline_name` varchar(50) NOT NULL,
   `flight_num` int(11) NOT NULL,
   PRIMARY KEY(`ticket_id`),
+  KEY `idx_ticket_flight` (`airline_name`, `flight_num`),
   FOREIGN KEY(`airline_name`, `flight_num`) REFERENCES `flight`(`airline_name`, `flight_num`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
@@ -146,6 +154,195 @@ CREATE TABLE `purchases` (
   `booking_agent_id` int(11),
   `purchase_date` date NOT NULL,
   PRIMARY KEY(`ticket_id`, `customer_email`),
+  KEY `idx_purchases_customer_date` (`customer_email`, `purchase_date`),
+  KEY `idx_purchases_agent_date` (`booking_agent_id`, `purchase_date`),
   FOREIGN KEY(`ticket_id`) REFERENCES `ticket`(`ticket_id`),
   FOREIGN KEY(`customer_email`) REFERENCES `customer`(`email`)
-) ENGINE=InnoDB DEFAULT CHARSET=latin1;
\ No newline at end of file
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `route_daily_fare`
+--
+
+CREATE TABLE `route_daily_fare` (
+  `departure_airport` varchar(50) NOT NULL,
+  `arrival_airport` varchar(50) NOT NULL,
+  `flight_date` date NOT NULL,
+  `min_price` decimal(10,0),
+  `seats_left` int(11) NOT NULL DEFAULT 0,
+  `flights` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`departure_airport`, `arrival_airport`, `flight_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `sales_daily`
+--
+
+CREATE TABLE `sales_daily` (
+  `airline_name` varchar(50) NOT NULL,
+  `sale_date` date NOT NULL,
+  `channel` varchar(10) NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `revenue` decimal(14,0) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`airline_name`, `sale_date`, `channel`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `agent_commission`
+--
+
+CREATE TABLE `agent_commission` (
+  `ticket_id` int(11) NOT NULL,
+  `booking_agent_id` int(11) NOT NULL,
+  `customer_email` varchar(50) NOT NULL,
+  `airline_name` varchar(50) NOT NULL,
+  `sale_date` date NOT NULL,
+  `price` decimal(10,0) NOT NULL,
+  `rate` decimal(5,4) NOT NULL,
+  `commission` decimal(12,2) NOT NULL,
+  PRIMARY KEY(`ticket_id`),
+  KEY `idx_agent_commission_agent_date` (`booking_agent_id`, `sale_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `agent_commission_daily`
+--
+
+CREATE TABLE `agent_commission_daily` (
+  `booking_agent_id` int(11) NOT NULL,
+  `sale_date` date NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `commission` decimal(14,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`booking_agent_id`, `sale_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `agent_customer_daily`
+--
+
+CREATE TABLE `agent_customer_daily` (
+  `booking_agent_id` int(11) NOT NULL,
+  `customer_email` varchar(50) NOT NULL,
+  `sale_date` date NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `commission` decimal(14,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`booking_agent_id`, `customer_email`, `sale_date`),
+  KEY `idx_agent_customer_daily_date` (`booking_agent_id`, `sale_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `customer_spending_monthly`
+--
+
+CREATE TABLE `customer_spending_monthly` (
+  `customer_email` varchar(50) NOT NULL,
+  `month` date NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `total` decimal(14,0) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`customer_email`, `month`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `flight_template`
+--
+
+CREATE TABLE `flight_template` (
+  `template_id` int(11) NOT NULL AUTO_INCREMENT,
+  `airline_name` varchar(50) NOT NULL,
+  `departure_airport` varchar(50) NOT NULL,
+  `arrival_airport` varchar(50) NOT NULL,
+  `weekdays` tinyint(4) NOT NULL,
+  `departure_clock` time NOT NULL,
+  `duration_minutes` int(11) NOT NULL,
+  `valid_from` date NOT NULL,
+  `valid_until` date NOT NULL,
+  `airplane_id` int(11) NOT NULL,
+  `price` decimal(10,0) NOT NULL,
+  `generated_until` date DEFAULT NULL,
+  PRIMARY KEY(`template_id`),
+  KEY `idx_flight_template_airline` (`airline_name`, `valid_until`),
+  FOREIGN KEY(`airline_name`, `airplane_id`) REFERENCES `airplane`(`airline_name`, `airplane_id`),
+  FOREIGN KEY(`departure_airport`) REFERENCES `airport`(`airport_name`),
+  FOREIGN KEY(`arrival_airport`) REFERENCES `airport`(`airport_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `flight_template_instance`
+--
+
+CREATE TABLE `flight_template_instance` (
+  `template_id` int(11) NOT NULL,
+  `flight_date` date NOT NULL,
+  `airline_name` varchar(50) NOT NULL,
+  `flight_num` int(11) NOT NULL,
+  PRIMARY KEY(`template_id`, `flight_date`),
+  UNIQUE KEY `uq_flight_template_instance_flight` (`airline_name`, `flight_num`),
+  FOREIGN KEY(`template_id`) REFERENCES `flight_template`(`template_id`),
+  FOREIGN KEY(`airline_name`, `flight_num`) REFERENCES `flight`(`airline_name`, `flight_num`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `notification_job`
+--
+
+CREATE TABLE `notification_job` (
+  `job_id` int(11) NOT NULL AUTO_INCREMENT,
+  `airline_name` varchar(50) NOT NULL,
+  `flight_num` int(11) NOT NULL,
+  `flight_status` varchar(50) NOT NULL,
+  `state` varchar(10) NOT NULL DEFAULT 'pending',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `run_after` datetime NOT NULL,
+  `created_at` datetime NOT NULL,
+  `started_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  `last_email` varchar(50) NOT NULL DEFAULT '',
+  `sent` int(11) NOT NULL DEFAULT 0,
+  `last_error` varchar(255) DEFAULT NULL,
+  PRIMARY KEY(`job_id`),
+  KEY `idx_notification_job_state` (`state`, `run_after`),
+  FOREIGN KEY(`airline_name`, `flight_num`) REFERENCES `flight`(`airline_name`, `flight_num`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `schema_migrations`
+-- (migrations/ files already included in this schema)
+--
+
+CREATE TABLE `schema_migrations` (
+  `version` int(11) NOT NULL,
+  `name` varchar(100) NOT NULL,
+  `applied_at` datetime NOT NULL,
+  PRIMARY KEY(`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+INSERT INTO `schema_migrations` (`version`, `name`, `applied_at`) VALUES
+(1, 'flight_remaining_seats', NOW()),
+(2, 'ticket_id_auto_increment', NOW()),
+(3, 'hot_query_indexes', NOW()),
+(4, 'route_daily_fare', NOW()),
+(5, 'sales_daily', NOW()),
+(6, 'agent_commission', NOW()),
+(7, 'customer_spending_monthly', NOW()),
+(8, 'flight_template', NOW()),
+(9, 'notification_job', NOW());
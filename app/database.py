@@ -0,0 +1,100 @@
+"""Request-scoped data access.
+
+Raw pymysql code and Flask-SQLAlchemy share one connection and one
+transaction per request: ``get_db()`` hands out a thin wrapper around the
+DBAPI connection underneath ``db.session``, which is checked out from the
+engine's bounded connection pool (sized by the ``DB_POOL_*`` settings in
+``config.py``).
+
+The transaction is committed once in ``teardown_request``, or rolled back if
+the request raised, so a handler that runs several statements either applies
+all of them or none. ``commit()`` and ``close()`` calls left in handlers are
+harmless no-ops; ``rollback()`` rolls back the whole request transaction.
+Work that must only happen once the data is committed, such as updating an
+in-memory cache, is registered with ``after_commit()``.
+"""
+from flask import g, current_app
+import pymysql.cursors
+
+from app.models import db
+
+
+class RequestConnection:
+    """The request's connection, shared with ``db.session``."""
+
+    @staticmethod
+    def _raw():
+        # 每次都从 session 取: rollback() 之后 session 会重新借出连接
+        return db.session.connection().connection
+
+    def cursor(self, cursor=pymysql.cursors.DictCursor):
+        return self._raw().cursor(cursor)
+
+    def commit(self):
+        # 在 teardown_request 中统一提交
+        pass
+
+    def rollback(self):
+        db.session.rollback()
+        g.pop('_after_commit', None)
+
+    def close(self):
+        # 连接属于整个请求, 在 teardown_request 中归还连接池
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._raw(), name)
+
+
+def get_db():
+    """Return the connection of the current request."""
+    if '_db_connection' not in g:
+        g._db_connection = RequestConnection()
+    return g._db_connection
+
+
+def after_commit(callback):
+    """Run ``callback()`` once the current transaction has committed.
+
+    In-memory caches use this so they only see changes that are durable;
+    the callback is dropped if the transaction rolls back.
+    """
+    g.setdefault('_after_commit', []).append(callback)
+
+
+def _run_after_commit():
+    for callback in g.pop('_after_commit', []):
+        try:
+            callback()
+        except Exception:
+            current_app.logger.exception('after_commit callback failed')
+
+
+def commit():
+    """Commit the current transaction now.
+
+    Request handlers leave this to ``teardown_request``; CLI commands, which
+    have no request, call it themselves.
+    """
+    db.session.commit()
+    _run_after_commit()
+
+
+def finish_request(exc=None):
+    """Commit the request transaction, or roll it back if the request failed."""
+    if exc is not None:
+        db.session.rollback()
+        g.pop('_after_commit', None)
+        return
+    try:
+        db.session.commit()
+    except Exception:
+        current_app.logger.exception('Commit of request transaction failed')
+        db.session.rollback()
+        g.pop('_after_commit', None)
+        return
+    _run_after_commit()
+
+
+def init_app(app):
+    app.teardown_request(finish_request)
@@ -0,0 +1,113 @@
+"""EXPLAIN-based check that the hot route queries are served by an index.
+
+``HOT_QUERIES`` runs EXPLAIN on the SQL the routes and services actually
+execute: each entry imports the query constant (or the builder, for queries
+with a variable number of placeholders) from the module that owns it, so
+the check cannot drift from the code. Listings add the filter the page uses
+most and the keyset ``ORDER BY``. For each query the listed tables (by the
+alias used in the query) must not be read with a full table scan
+(``type = ALL``). Run it with ``flask --app run schema check-indexes``.
+
+On a nearly empty database MySQL may prefer a scan even when an index exists;
+the report shows ``possible_keys`` so that case is easy to tell apart from a
+missing index.
+"""
+from app.pagination import order_by
+from app.routes.agent import AGENT_FLIGHTS_KEYS, AGENT_FLIGHTS_QUERY, flight_search_query
+from app.routes.customer import PURCHASE_FLIGHT_QUERY, UPCOMING_FLIGHTS_QUERY
+from app.routes.staff import PENDING_AGENTS_QUERY, VIEW_FLIGHTS_KEYS, VIEW_FLIGHTS_QUERY
+from app.services import commissions, rankings, sales, spending
+from app.services.agent_auth import AUTH_QUERY
+from app.services.aircraft_schedule import (BATCH_OVERLAP_QUERY, BATCH_ROW, LOAD_QUERY,
+                                            OVERLAP_QUERY)
+from app.services.fares import FARE_CALENDAR_QUERY
+from app.services.flight_status import CHAINS_QUERY
+from app.services.heavy_hitters import STREAMS
+from app.services.notifications import CLAIM_QUERY, HOLDERS_QUERY
+from app.services.permissions import PERMISSIONS_QUERY
+
+SAMPLE_EMAIL = 'customer@example.com'
+SAMPLE_AIRLINE = 'China Eastern'
+SAMPLE_AGENT_ID = 1
+SAMPLE_USERNAME = 'admin'
+
+
+def _keys(keys):
+    return order_by([column for column, _ in keys])
+
+
+_WINDOW_COLUMNS, _WINDOW_PARAMS = rankings.window_columns({12: '2024-01-01'})
+
+# (route, query, params, aliases that must use an index)
+HOT_QUERIES = [
+    ('customer.dashboard', UPCOMING_FLIGHTS_QUERY, (SAMPLE_EMAIL,), ('p', 't', 'f')),
+    ('customer.spending', spending.WHOLE_MONTHS_QUERY,
+     (SAMPLE_EMAIL, '2024-01-01', '2024-12-01'), ('customer_spending_monthly',)),
+    ('customer.spending', spending.PARTIAL_MONTHS_QUERY.format(
+        ranges='p.purchase_date BETWEEN %s AND %s'),
+     (SAMPLE_EMAIL, '2024-01-15', '2024-01-31'), ('p', 't', 'f')),
+    ('customer.purchase_ticket', PURCHASE_FLIGHT_QUERY, (SAMPLE_AIRLINE, 1), ('f',)),
+    # agent_required 和 book_ticket_for_customer 的审批/授权检查
+    ('agent_auth', AUTH_QUERY, (SAMPLE_EMAIL,), ('ba', 'baw')),
+    ('agent.dashboard', commissions.SUMMARY_QUERY,
+     (SAMPLE_AGENT_ID, '2024-01-01', '2024-01-31'), ('agent_commission_daily',)),
+    ('agent.my_flights', AGENT_FLIGHTS_QUERY + " AND f.departure_time >= %s"
+     + _keys(AGENT_FLIGHTS_KEYS), (SAMPLE_AGENT_ID, '2024-01-01'), ('p', 't', 'f', 'c')),
+    ('agent.commission', commissions.DAILY_QUERY,
+     (SAMPLE_AGENT_ID, '2024-01-01', '2024-12-31'), ('agent_commission_daily',)),
+    ('heavy_hitters.agent_tickets', STREAMS['agent_tickets'].query,
+     (SAMPLE_AGENT_ID, '2024-01-01'), ('agent_customer_daily',)),
+    ('agent.search_flights', flight_search_query({'PVG'}, {'JFK'}),
+     ('2024-01-01', '2024-01-08', 'PVG', 'JFK'), ('flight',)),
+    ('public.fare_calendar', FARE_CALENDAR_QUERY.format(sources='%s', destinations='%s'),
+     ('PVG', 'JFK', '2024-01-01', '2024-01-30'), ('route_daily_fare',)),
+    ('staff.permissions', PERMISSIONS_QUERY, (SAMPLE_USERNAME,), ('permission',)),
+    ('staff.dashboard', PENDING_AGENTS_QUERY, (), ('ba',)),
+    ('heavy_hitters.destinations', STREAMS['destinations'].query,
+     (SAMPLE_AIRLINE, '2024-01-01'), ('f', 't', 'p')),
+    ('heavy_hitters.destination_cities', STREAMS['destination_cities'].query,
+     (SAMPLE_AIRLINE, '2024-01-01'), ('t', 'f', 'a')),
+    ('staff.view_flights', VIEW_FLIGHTS_QUERY + " AND f.departure_time >= %s"
+     + _keys(VIEW_FLIGHTS_KEYS), (SAMPLE_AIRLINE, '2024-01-01'), ('f',)),
+    ('aircraft_schedule', LOAD_QUERY, (SAMPLE_AIRLINE,), ('flight',)),
+    ('aircraft_schedule.locked_conflict', OVERLAP_QUERY,
+     (SAMPLE_AIRLINE, 1, '2024-01-02', '2024-01-01'), ('flight',)),
+    ('aircraft_schedule.locked_conflicts', BATCH_OVERLAP_QUERY.format(flights=BATCH_ROW),
+     (1, 1, '2024-01-01', '2024-01-02', SAMPLE_AIRLINE), ('f',)),
+    ('staff.change_status_bulk', CHAINS_QUERY.format(airplanes='%s'),
+     (SAMPLE_AIRLINE, 1, '2024-01-01'), ('flight',)),
+    ('staff.view_reports', sales.MONTHLY_SALES_QUERY,
+     (SAMPLE_AIRLINE, '2024-01-01', '2024-12-31'), ('sales_daily',)),
+    ('staff.dashboard', sales.MONTH_TO_DATE_QUERY, (SAMPLE_AIRLINE,), ('sales_daily',)),
+    ('staff.view_agents', rankings.WINDOW_TOTALS_QUERY.format(columns=_WINDOW_COLUMNS),
+     (*_WINDOW_PARAMS, '2024-01-01', SAMPLE_AIRLINE), ('baw', 'd')),
+    ('heavy_hitters.customers', STREAMS['customers'].query,
+     (SAMPLE_AIRLINE, '2024-01-01'), ('t', 'p')),
+    ('notifications.holders', HOLDERS_QUERY, (SAMPLE_AIRLINE, 1, ''), ('t', 'p', 'c')),
+    ('notifications.claim', CLAIM_QUERY, (10,), ('notification_job',)),
+]
+
+
+def explain(cursor, query, params):
+    cursor.execute('EXPLAIN ' + query, params)
+    return cursor.fetchall()
+
+
+def check_indexes(connection, echo=print):
+    """EXPLAIN every hot query and report full scans. Returns the failure count."""
+    cursor = connection.cursor()
+    failures = 0
+    try:
+        for route, query, params, tables in HOT_QUERIES:
+            scans = [row for row in explain(cursor, query, params)
+                     if row['table'] in tables and row['type'] == 'ALL']
+            if not scans:
+                echo(f'ok    {route}')
+                continue
+            failures += 1
+            for row in scans:
+                echo(f"SCAN  {route}: table {row['table']} "
+                     f"(possible_keys: {row['possible_keys'] or 'none'})")
+    finally:
+        cursor.close()
+    return failures
@@ -0,0 +1,119 @@
+"""Versioned schema migrations.
+
+Each file in ``migrations/`` is named ``<version>_<description>.sql`` and is
+applied once, in version order. Applied versions are recorded in the
+``schema_migrations`` table; a database created from ``air.sql`` already
+lists the versions that file includes.
+
+Usage::
+
+    flask --app run schema status
+    flask --app run schema upgrade
+    flask --app run schema check-indexes
+"""
+import os
+import re
+
+import click
+from flask.cli import AppGroup
+
+from app import database
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'migrations')
+
+schema_cli = AppGroup('schema', help='Database schema migrations.')
+
+
+def available_migrations():
+    """Return ``[(version, name, path)]`` for every migration file, oldest first."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'^(\d+)_(\w+)\.sql$', filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(migrations)
+
+
+def split_statements(sql):
+    """Split a migration file into statements, dropping ``--`` comments."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [stmt.strip() for stmt in '\n'.join(lines).split(';') if stmt.strip()]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version int(11) NOT NULL,
+            name varchar(100) NOT NULL,
+            applied_at datetime NOT NULL,
+            PRIMARY KEY(version)
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def pending_migrations(cursor):
+    applied = applied_versions(cursor)
+    return [m for m in available_migrations() if m[0] not in applied]
+
+
+def upgrade():
+    """Apply every pending migration. Returns the list of applied versions."""
+    cursor = database.get_db().cursor()
+    done = []
+    try:
+        for version, name, path in pending_migrations(cursor):
+            with open(path) as f:
+                statements = split_statements(f.read())
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("""
+                INSERT INTO schema_migrations (version, name, applied_at)
+                VALUES (%s, %s, NOW())
+            """, (version, name))
+            # MySQL 的 DDL 会隐式提交, 每个迁移单独提交记录
+            database.commit()
+            done.append(version)
+    finally:
+        cursor.close()
+    return done
+
+
+@schema_cli.command('status')
+def status_command():
+    """List applied and pending migrations."""
+    cursor = database.get_db().cursor()
+    try:
+        applied = applied_versions(cursor)
+    finally:
+        cursor.close()
+    for version, name, _ in available_migrations():
+        state = 'applied' if version in applied else 'pending'
+        click.echo(f'{version:03d} {name:<40} {state}')
+
+
+@schema_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending migrations."""
+    done = upgrade()
+    if not done:
+        click.echo('Schema is up to date.')
+    for version in done:
+        click.echo(f'Applied migration {version:03d}')
+
+
+@schema_cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN the hot route queries and fail if any of them scans a table."""
+    from app.index_check import check_indexes
+
+    failures = check_indexes(database.get_db(), click.echo)
+    if failures:
+        raise click.ClickException(f'{failures} queries do not use an index.')
+
+
+def init_app(app):
+    app.cli.add_command(schema_cli)
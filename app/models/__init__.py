@@ -5,9 +5,10 @@ db = SQLAlchemy()
 
 class User(UserMixin):
     """Base user model with common authentication methods"""
+    user_type = None  # 'customer' / 'agent' / 'staff', 与 session['user_type'] 一致
+
     def get_id(self):
-        # 对于AirlineStaff,使用username
-        if hasattr(self, 'username'):
-            return self.username
-        # 对于Customer和BookingAgent,使用email
-        return self.email
\ No newline at end of file
+        # 带角色前缀, user_loader 只需查询一张表
+        # 对于AirlineStaff,使用username; 对于Customer和BookingAgent,使用email
+        key = self.username if hasattr(self, 'username') else self.email
+        return f'{self.user_type}:{key}'
\ No newline at end of file
@@ -5,6 +5,7 @@ from datetime import datetime
 class Airline(db.Model):
     __tablename__ = 'airline'
     airline_name = db.Column(db.String(50), primary_key=True)
+    commission_rate = db.Column(db.Numeric(5, 4), nullable=False, default=0.1)  # 代理佣金比例
     airplanes = db.relationship('Airplane', backref='airline')
     flights = db.relationship('Flight', backref='airline', foreign_keys='Flight.airline_name')
 
@@ -54,6 +55,7 @@ class Flight(db.Model):
     price = db.Column(db.Numeric(10, 0), nullable=False)
     status = db.Column(db.String(50), nullable=False)
     airplane_id = db.Column(db.Integer, nullable=False)
+    remaining_seats = db.Column(db.Integer, nullable=False, default=0)
 
     __table_args__ = (
         db.ForeignKeyConstraint(
@@ -70,7 +72,7 @@ class Ticket(db.Model):
     """Ticket model"""
     __tablename__ = 'ticket'
 
-    ticket_id = db.Column(db.Integer, primary_key=True)
+    ticket_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     airline_name = db.Column(db.String(50), nullable=False)
     flight_num = db.Column(db.Integer, nullable=False)
 
@@ -5,6 +5,7 @@ from datetime import date
 class Customer(User, db.Model):
     """Customer model, maps to customer table"""
     __tablename__ = 'customer'
+    user_type = 'customer'
 
     email = db.Column(db.String(50), primary_key=True)
     name = db.Column(db.String(50), nullable=False)
@@ -26,6 +27,7 @@ class Customer(User, db.Model):
 class BookingAgent(User, db.Model):
     """Booking agent model, maps to booking_agent table"""
     __tablename__ = 'booking_agent'
+    user_type = 'agent'
 
     email = db.Column(db.String(50), primary_key=True)
     password = db.Column(db.String(50), nullable=False)
@@ -44,6 +46,7 @@ class BookingAgent(User, db.Model):
 class AirlineStaff(User, db.Model):
     """Airline staff model, maps to airline_staff table"""
     __tablename__ = 'airline_staff'
+    user_type = 'staff'
 
     username = db.Column(db.String(50), primary_key=True)
     password = db.Column(db.String(50), nullable=False)
@@ -0,0 +1,39 @@
+"""Passenger notification jobs (see ``app/services/notifications.py``).
+
+Web processes deliver the jobs in a background thread. With
+``NOTIFICATION_WORKER = False`` (or to catch up after an outage) run::
+
+    flask --app run notifications run
+
+which delivers every due job once and exits.
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import database
+from app.services.notifications import notifier, queue_counts
+
+notifications_cli = AppGroup('notifications', help='Passenger notification jobs.')
+
+
+@notifications_cli.command('run')
+@click.option('--limit', type=int, default=None, help='Process at most this many jobs.')
+def run_command(limit):
+    """Deliver the due notification jobs."""
+    processed = notifier.run_due(limit)
+    cursor = database.get_db().cursor()
+    try:
+        counts = queue_counts(cursor)
+    finally:
+        cursor.close()
+    click.echo(f'{processed} jobs processed; queue: '
+               + ', '.join(f'{state} {jobs}' for state, jobs in sorted(counts.items())))
+    stats = notifier.stats()
+    click.echo(f"{stats['messages_sent']} messages sent, {stats['messages_failed']} failed "
+               f"(sink {current_app.config.get('NOTIFICATION_SINK', 'file')})")
+
+
+def init_app(app):
+    notifier.init_app(app)
+    app.cli.add_command(notifications_cli)
@@ -0,0 +1,149 @@
+"""Keyset (cursor) pagination for raw SQL listings.
+
+Instead of ``OFFSET``, each page remembers the sort key of its first and
+last row in an opaque token, and the next query starts right after it::
+
+    WHERE ... AND (f.departure_time > %s OR (f.departure_time = %s AND ...))
+    ORDER BY f.departure_time, f.airline_name, f.flight_num
+    LIMIT page_size + 1
+
+With an index on the leading key columns every page costs the same, however
+far into the history it is. The key must be unique, so listings append a
+tie-breaker column (such as a ticket id) when needed.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from flask import request, url_for, current_app
+
+
+class Page:
+    def __init__(self, rows, next_token=None, prev_token=None):
+        self.rows = rows
+        self.next_token = next_token
+        self.prev_token = prev_token
+
+    def _url(self, **token):
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+        args.update(request.view_args or {})
+        return url_for(request.endpoint, **args, **token)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_token) if self.next_token else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_token) if self.prev_token else None
+
+
+def _encode(value):
+    # datetime 是 date 的子类, 先判断
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        return (datetime.fromisoformat(value['dt']) if 'dt' in value
+                else date.fromisoformat(value['d']))
+    return value
+
+
+def encode_token(values):
+    payload = [_encode(v) for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_token(token, size):
+    """Return the key values stored in ``token``, or None if it is invalid."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode(v) for v in payload]
+    except (ValueError, TypeError, KeyError):
+        return None
+    return values if len(values) == size else None
+
+
+def page_size():
+    """Page size from ``?per_page=``, bounded by the PAGE_SIZE settings."""
+    default = current_app.config.get('PAGE_SIZE', 50)
+    maximum = current_app.config.get('MAX_PAGE_SIZE', 200)
+    size = request.args.get('per_page', default, type=int)
+    return max(1, min(size, maximum))
+
+
+def _after(columns, descending):
+    """SQL condition "row key comes after (%s, ...)" in the given direction."""
+    op = '<' if descending else '>'
+    condition = f'{columns[-1]} {op} %s'
+    for column in reversed(columns[:-1]):
+        condition = f'{column} {op} %s OR ({column} = %s AND ({condition}))'
+    return condition
+
+
+def _after_params(values):
+    # 与 _after() 展开后的占位符顺序一致: c0, c0, c1, c1, ..., cN
+    params = []
+    for value in values[:-1]:
+        params.extend([value, value])
+    params.append(values[-1])
+    return params
+
+
+def order_by(columns, descending=False):
+    """The ``ORDER BY`` clause of a keyset listing over ``columns``."""
+    direction = 'DESC' if descending else 'ASC'
+    return ' ORDER BY ' + ', '.join(f'{column} {direction}' for column in columns)
+
+
+def keyset_page(cursor, query, params, keys, descending=False):
+    """Run ``query`` one page at a time, driven by ``?after=`` / ``?before=``.
+
+    ``query`` must end with its WHERE clause (no ORDER BY / LIMIT).
+    ``keys`` lists ``(sql_column, row_key)`` pairs forming a unique sort key.
+    """
+    columns = [column for column, _ in keys]
+    size = page_size()
+    after = request.args.get('after')
+    before = request.args.get('before')
+    token, backwards = (before, True) if before else (after, False)
+    values = decode_token(token, len(keys)) if token else None
+    if values is None:
+        backwards = False
+
+    # 翻到上一页时按相反方向查询, 取到后再倒回来
+    reverse = descending != backwards
+    params = list(params)
+    if values is not None:
+        leading = columns[0]
+        query += f" AND {leading} {'<=' if reverse else '>='} %s AND ({_after(columns, reverse)})"
+        params += [values[0]] + _after_params(values)
+    query += order_by(columns, reverse)
+    query += ' LIMIT %s'
+    params.append(size + 1)
+
+    cursor.execute(query, tuple(params))
+    rows = list(cursor.fetchall())
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    def key_of(row):
+        return encode_token([row[key] for _, key in keys])
+
+    if not rows:
+        return Page(rows)
+    if backwards:
+        next_token = key_of(rows[-1])
+        prev_token = key_of(rows[0]) if has_more else None
+    else:
+        next_token = key_of(rows[-1]) if has_more else None
+        prev_token = key_of(rows[0]) if values is not None else None
+    return Page(rows, next_token, prev_token)
@@ -0,0 +1,55 @@
+"""Maintenance commands for the precomputed aggregate tables.
+
+The aggregates are kept current by the code paths that write their source
+rows (flight changes in ``staff``, sales in ``booking.book_ticket``);
+``rebuild`` recomputes them from scratch, e.g. after a bulk load or a manual
+fix made directly in the database.
+
+Usage::
+
+    flask --app run rollups rebuild
+"""
+import click
+from flask.cli import AppGroup
+
+from app import database
+from app.services import commissions, fares, sales, spending
+
+rollups_cli = AppGroup('rollups', help='Precomputed aggregate tables.')
+
+# (table, rebuild(cursor) -> rows written)
+ROLLUPS = [
+    ('route_daily_fare', fares.rebuild),
+    ('sales_daily', sales.rebuild),
+    # 先补齐佣金明细, 再由明细重算两个汇总表
+    ('agent_commission', commissions.backfill_ledger),
+    ('agent_commission_daily', commissions.rebuild_daily),
+    ('agent_customer_daily', commissions.rebuild_customer_daily),
+    ('customer_spending_monthly', spending.rebuild),
+]
+
+
+@rollups_cli.command('rebuild')
+@click.argument('tables', nargs=-1)
+def rebuild_command(tables):
+    """Recompute the aggregate TABLES (all of them by default)."""
+    known = [name for name, _ in ROLLUPS]
+    unknown = set(tables) - set(known)
+    if unknown:
+        raise click.BadParameter(f"unknown table(s): {', '.join(sorted(unknown))}; "
+                                 f"choose from {', '.join(known)}")
+
+    cursor = database.get_db().cursor()
+    try:
+        for name, rebuild in ROLLUPS:
+            if tables and name not in tables:
+                continue
+            rows = rebuild(cursor)
+            database.commit()
+            click.echo(f'{name}: {rows} rows')
+    finally:
+        cursor.close()
+
+
+def init_app(app):
+    app.cli.add_command(rollups_cli)
@@ -2,32 +2,62 @@ from flask import Blueprint, render_template, request, session, redirect, url_fo
 from datetime import datetime, timedelta
 from functools import wraps
 from app.models import db
+from app.pagination import keyset_page
+from app.services import commissions, heavy_hitters
+from app.services.agent_auth import agent_auth
+from app.services.airports import airport_catalog
+from app.services.booking import remaining_seats, sell_ticket
+from app.services.search_cache import search_cache, search_key
 
 agent = Blueprint('agent', __name__)
 
+# 路由用到的查询, app/index_check.py 对同一份 SQL 做 EXPLAIN
+AGENT_FLIGHTS_QUERY = """
+    SELECT DISTINCT
+        f.airline_name,
+        f.flight_num,
+        f.departure_airport,
+        dep.airport_city as departure_city,
+        f.departure_time,
+        f.arrival_airport,
+        arr.airport_city as arrival_city,
+        f.arrival_time,
+        f.price,
+        f.status,
+        c.name as customer_name,
+        c.email as customer_email,
+        p.purchase_date
+    FROM flight f
+    JOIN airport dep ON f.departure_airport = dep.airport_name
+    JOIN airport arr ON f.arrival_airport = arr.airport_name
+    JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
+    JOIN purchases p ON t.ticket_id = p.ticket_id
+    JOIN customer c ON p.customer_email = c.email
+    WHERE p.booking_agent_id = %s
+"""
+
+# 同一航班可能对应多位客户, 同一客户也可能在不同日期购买了同一航班:
+# 加上 customer_email 和 purchase_date 才能保证分页键唯一
+AGENT_FLIGHTS_KEYS = [
+    ('f.departure_time', 'departure_time'),
+    ('f.airline_name', 'airline_name'),
+    ('f.flight_num', 'flight_num'),
+    ('c.email', 'customer_email'),
+    ('p.purchase_date', 'purchase_date'),
+]
+
+
 def agent_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_type' not in session or session['user_type'] != 'agent':
             return redirect(url_for('auth.login'))
 
-        # 检查用户是否已被批准
-        connection = current_app.config['GET_DB']()
-        cursor = connection.cursor()
-
-        try:
-            cursor.execute("""
-                SELECT approved 
-                FROM booking_agent 
-                WHERE email = %s
-            """, (session['user'],))  # 假设 session['user'] 是代理用户的 email
-            result = cursor.fetchone()
-            if not result or not result['approved']:
-                flash('Your account is pending approval. Please contact airline staff.', 'danger')
-                return redirect(url_for('auth.login'))
-        finally:
-            cursor.close()
-            connection.close()
+        # 检查用户是否已被批准 (登录时加载, 审批后失效)
+        auth = agent_auth.get(session['user'])
+        if not auth or not auth.approved:
+            flash('Your account is pending approval. Please contact airline staff.', 'danger')
+            return redirect(url_for('auth.login'))
 
         return f(*args, **kwargs)
 
@@ -43,20 +73,10 @@ def dashboard():
     cursor = connection.cursor()  # No need for 'dictionary=True'
 
     try:
-        # Get 30-day summary data
-        summary_query = """
-            SELECT 
-                COUNT(*) as tickets_sold,
-                SUM(f.price * 0.1) as total_commission,
-                SUM(f.price * 0.1)/COUNT(*) as avg_commission
-            FROM purchases p
-            JOIN ticket t ON p.ticket_id = t.ticket_id
-            JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
-            WHERE p.booking_agent_id = %s 
-            AND p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-        """
-        cursor.execute(summary_query, (session['agent_id'],))
-        summary = cursor.fetchone()
+        # Get 30-day summary data (佣金汇总表)
+        today = datetime.now().date()
+        month_ago = today - timedelta(days=30)
+        summary = commissions.summary(cursor, session['agent_id'], month_ago, today)
 
         # Get recent bookings
         bookings_query = """
@@ -75,19 +95,9 @@ def dashboard():
         cursor.execute(bookings_query, (session['agent_id'],))
         recent_bookings = cursor.fetchall()
 
-        # Get top customer
-        top_customer_query = """
-            SELECT c.name, COUNT(*) as tickets
-            FROM purchases p
-            JOIN customer c ON p.customer_email = c.email
-            WHERE p.booking_agent_id = %s 
-            AND p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)
-            GROUP BY c.email, c.name
-            ORDER BY tickets DESC
-            LIMIT 1
-        """
-        cursor.execute(top_customer_query, (session['agent_id'],))
-        top_customer = cursor.fetchone()
+        # Get top customer (内存 top-K sketch)
+        top = heavy_hitters.agent_top_customers(cursor, session['agent_id'], month_ago, limit=1)
+        top_customer = top[0] if top else None
 
     finally:
         cursor.close()
@@ -96,7 +106,7 @@ def dashboard():
     return render_template('agent/dashboard.html',
                            total_commission=summary['total_commission'] or 0,
                            avg_commission=summary['avg_commission'] or 0,
-                           tickets_sold=summary['tickets_sold'] or 0,
+                           tickets_sold=summary['tickets_count'] or 0,
                            bookings=recent_bookings,
                            top_customer=top_customer or {'name': 'No data', 'tickets': 0})
 
@@ -114,29 +124,7 @@ def view_flights():
         start_date = request.args.get('start_date', datetime.now().strftime('%Y-%m-%d'))
         end_date = request.args.get('end_date', '')
 
-        query = """
-            SELECT DISTINCT
-                f.airline_name,
-                f.flight_num,
-                f.departure_airport,
-                dep.airport_city as departure_city,
-                f.departure_time,
-                f.arrival_airport,
-                arr.airport_city as arrival_city,
-                f.arrival_time,
-                f.price,
-                f.status,
-                c.name as customer_name,
-                c.email as customer_email,
-                p.purchase_date
-            FROM flight f
-            JOIN airport dep ON f.departure_airport = dep.airport_name
-            JOIN airport arr ON f.arrival_airport = arr.airport_name
-            JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
-            JOIN purchases p ON t.ticket_id = p.ticket_id
-            JOIN customer c ON p.customer_email = c.email
-            WHERE p.booking_agent_id = %s
-        """
+        query = AGENT_FLIGHTS_QUERY
         params = [session['agent_id']]
 
         if source:
@@ -155,13 +143,11 @@ def view_flights():
             query += " AND f.departure_time <= %s"
             params.append(end_date)
 
-        query += " ORDER BY f.departure_time ASC"
-
-        cursor.execute(query, tuple(params))
-        flights = cursor.fetchall()
+        page = keyset_page(cursor, query, params, AGENT_FLIGHTS_KEYS)
 
         return render_template('agent/my_flights.html',
-                               flights=flights,
+                               flights=page.rows,
+                               page=page,
                                source=source,
                                destination=destination,
                                start_date=start_date,
@@ -186,35 +172,10 @@ def view_commission():
                                 datetime.now().strftime('%Y-%m-%d'))
 
     # Get summary data for date range
-    summary_query = """
-        SELECT 
-            SUM(f.price * 0.1) as total_commission,
-            COUNT(*) as tickets_count,
-            AVG(f.price * 0.1) as avg_commission
-        FROM purchases p
-        JOIN ticket t ON p.ticket_id = t.ticket_id
-        JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
-        WHERE p.booking_agent_id = %s 
-        AND p.purchase_date BETWEEN %s AND %s
-    """
-    cursor.execute(summary_query, (session['agent_id'], start_date, end_date))
-    summary = cursor.fetchone()
+    summary = commissions.summary(cursor, session['agent_id'], start_date, end_date)
 
     # Get daily commission data for chart
-    daily_query = """
-        SELECT 
-            DATE(p.purchase_date) as date,
-            SUM(f.price * 0.1) as commission
-        FROM purchases p
-        JOIN ticket t ON p.ticket_id = t.ticket_id
-        JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
-        WHERE p.booking_agent_id = %s 
-        AND p.purchase_date BETWEEN %s AND %s
-        GROUP BY DATE(p.purchase_date)
-        ORDER BY date
-    """
-    cursor.execute(daily_query, (session['agent_id'], start_date, end_date))
-    daily_data = cursor.fetchall()
+    daily_data = commissions.daily(cursor, session['agent_id'], start_date, end_date)
 
     cursor.close()
 
@@ -239,47 +200,21 @@ def view_top_customers():
     connection = current_app.config['GET_DB']()
     cursor = connection.cursor()  # No need for 'dictionary=True'
 
+    today = datetime.now().date()
+
     # Top 5 by tickets (6 months)
-    tickets_query = """
-        SELECT 
-            c.email, c.name,
-            COUNT(*) as tickets
-        FROM purchases p
-        JOIN customer c ON p.customer_email = c.email
-        WHERE p.booking_agent_id = %s 
-        AND p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH)
-        GROUP BY c.email, c.name
-        ORDER BY tickets DESC
-        LIMIT 5
-    """
+    top_by_tickets = heavy_hitters.agent_top_customers(
+        cursor, session['agent_id'], commissions.months_ago(today, 6), order_by='tickets')
 
     # Top 5 by commission (1 year)
-    commission_query = """
-        SELECT 
-            c.email, c.name,
-            SUM(f.price * 0.1) as commission
-        FROM purchases p
-        JOIN customer c ON p.customer_email = c.email
-        JOIN ticket t ON p.ticket_id = t.ticket_id
-        JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
-        WHERE p.booking_agent_id = %s 
-        AND p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 1 YEAR)
-        GROUP BY c.email, c.name
-        ORDER BY commission DESC
-        LIMIT 5
-    """
-
-    cursor.execute(tickets_query, (session['agent_id'],))
-    top_by_tickets = cursor.fetchall()
-
-    cursor.execute(commission_query, (session['agent_id'],))
-    top_by_commission = cursor.fetchall()
+    top_by_commission = heavy_hitters.agent_top_customers(
+        cursor, session['agent_id'], commissions.months_ago(today, 12), order_by='commission')
 
     cursor.close()
 
     # Prepare chart data
     ticket_customers = [customer['name'] for customer in top_by_tickets]
-    ticket_counts = [customer['tickets'] for customer in top_by_tickets]
+    ticket_counts = [int(customer['tickets']) for customer in top_by_tickets]
     commission_customers = [customer['name'] for customer in top_by_commission]
     commission_amounts = [float(customer['commission']) for customer in top_by_commission]
 
@@ -291,22 +226,30 @@ def view_top_customers():
                            commission_customers=commission_customers,
                            commission_amounts=commission_amounts)
 
-@agent.route('/search_flights', endpoint='search_flights')
+
+@agent.route('/top_k_audit')
 @agent_required
-def search_flights():
-    """Search flights for agents based on filters"""
-    connection = current_app.config['GET_DB']()
-    cursor = connection.cursor()
+def top_k_audit():
+    """Compare the agent's top customer sketches with an exact recount"""
+    today = datetime.now().date()
+    cursor = current_app.config['GET_DB']().cursor()
+    try:
+        return jsonify([
+            heavy_hitters.audit(cursor, 'agent_tickets', session['agent_id'],
+                                today - timedelta(days=30), 1),
+            heavy_hitters.audit(cursor, 'agent_tickets', session['agent_id'],
+                                commissions.months_ago(today, 6), 5),
+            heavy_hitters.audit(cursor, 'agent_commission', session['agent_id'],
+                                commissions.months_ago(today, 12), 5),
+        ])
+    finally:
+        cursor.close()
 
-    # 获取搜索参数
-    departure_airport = request.args.get('departure_airport', '')
-    arrival_airport = request.args.get('arrival_airport', '')
-    start_date = request.args.get('start_date', (datetime.now()).strftime('%Y-%m-%d'))
-    end_date = request.args.get('end_date', (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d'))
 
-    # 搜索航班的 SQL 查询
+def flight_search_query(departure_names, arrival_names):
+    """SQL of ``find_flights``; parameters are the window, then the sorted names."""
     query = """
-        SELECT 
+        SELECT
             flight.flight_num,
             flight.airline_name,
             flight.departure_airport,
@@ -316,22 +259,71 @@ def search_flights():
             flight.status,
             flight.price
         FROM flight
-        WHERE 
-            flight.departure_airport LIKE %s AND
-            flight.arrival_airport LIKE %s AND
-            flight.departure_time BETWEEN %s AND %s
-        ORDER BY flight.departure_time ASC
+        WHERE flight.departure_time BETWEEN %s AND %s
     """
-    cursor.execute(query, (
-        f"%{departure_airport}%",
-        f"%{arrival_airport}%",
-        start_date,
-        end_date
-    ))
-    flights = cursor.fetchall()
+    for column, names in (('departure_airport', departure_names),
+                          ('arrival_airport', arrival_names)):
+        if names is not None:
+            query += f" AND flight.{column} IN ({', '.join(['%s'] * len(names))})"
+    return query + " ORDER BY flight.departure_time ASC"
 
-    cursor.close()
-    connection.close()
+
+def find_flights(departure_names, arrival_names, window_start, window_end):
+    """Flights on the route departing in the window (None = any airport)."""
+    cursor = current_app.config['GET_DB']().cursor()
+
+    # 搜索航班的 SQL 查询
+    query = flight_search_query(departure_names, arrival_names)
+    params = [window_start, window_end]
+    for names in (departure_names, arrival_names):
+        if names is not None:
+            params.extend(sorted(names))
+
+    try:
+        cursor.execute(query, tuple(params))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+@agent.route('/search_flights', endpoint='search_flights')
+@agent_required
+def search_flights():
+    """Search flights for agents based on filters"""
+    # 获取搜索参数
+    departure_airport = request.args.get('departure_airport', '')
+    arrival_airport = request.args.get('arrival_airport', '')
+    start_date = request.args.get('start_date', (datetime.now()).strftime('%Y-%m-%d'))
+    end_date = request.args.get('end_date', (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d'))
+
+    # 机场代码模糊匹配在内存中完成, 查询只用 IN 条件
+    departure_names = airport_catalog.match(departure_airport, cities=False)
+    arrival_names = airport_catalog.match(arrival_airport, cities=False)
+    try:
+        window_start = datetime.strptime(start_date, '%Y-%m-%d')
+        window_end = datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        flash("Invalid date.", "danger")
+        window_start = window_end = None
+
+    if window_start is None or departure_names == frozenset() or arrival_names == frozenset():
+        flights = []
+    else:
+        key = search_key('agent', departure_names, arrival_names, window_start, window_end)
+        flights = search_cache.get(key)
+        if flights is None:
+            flights = find_flights(departure_names, arrival_names, window_start, window_end)
+            search_cache.set(key, flights)
+
+        # 缓存的结果不含座位数, 按主键批量读取当前库存 (不修改缓存中的行)
+        cursor = current_app.config['GET_DB']().cursor()
+        try:
+            seats = remaining_seats(cursor, [(f['airline_name'], f['flight_num']) for f in flights])
+        finally:
+            cursor.close()
+        flights = [dict(flight, seats_left=seats.get((flight['airline_name'],
+                                                      flight['flight_num']), 0))
+                   for flight in flights]
 
     return render_template('agent/search_flights.html',
                            flights=flights,
@@ -375,31 +367,15 @@ def book_ticket_for_customer():
                 return redirect(url_for('agent.search_flights'))
 
             # 检查代理是否可以为该航空公司订票
-            cursor.execute("""
-                SELECT * FROM booking_agent_work_for 
-                WHERE email = %s AND airline_name = %s
-            """, (session['user'], airline_name))
-            if not cursor.fetchone():
+            if not agent_auth.can_book(session['user'], airline_name):
                 flash("You are not authorized to book tickets for this airline.", "danger")
                 return redirect(url_for('agent.dashboard'))
 
-            # 获取当前最大的 ticket_id
-            cursor.execute("SELECT MAX(ticket_id) as max_id FROM ticket")
-            result = cursor.fetchone()
-            next_ticket_id = 1 if result['max_id'] is None else result['max_id'] + 1
-
-            # 创建票务记录
-            cursor.execute("""
-                INSERT INTO ticket (ticket_id, airline_name, flight_num)
-                VALUES (%s, %s, %s)
-            """, (next_ticket_id, airline_name, flight_num))
-            connection.commit()
-
-            # 创建购买记录
-            cursor.execute("""
-                INSERT INTO purchases (ticket_id, customer_email, booking_agent_id, purchase_date)
-                VALUES (%s, %s, %s, CURDATE())
-            """, (next_ticket_id, customer_email, session['agent_id']))
+            # 原子地占座并写入 ticket / purchases (同一个事务)
+            if sell_ticket(connection, airline_name, flight_num,
+                           customer_email, session['agent_id']) is None:
+                flash("Sorry, this flight is fully booked.", "danger")
+                return redirect(url_for('agent.search_flights'))
             connection.commit()
 
             flash("Ticket successfully booked for the customer!", "success")
@@ -4,6 +4,7 @@ from functools import wraps
 from app.models.user import Customer, BookingAgent, AirlineStaff
 from app.models.flight import Airline
 from app.models import db
+from app.services.agent_auth import agent_auth
 
 import hashlib
 
@@ -45,6 +46,7 @@ def login():
                 session['user'] = user.email
                 session['user_type'] = 'agent'
                 session['agent_id'] = user.booking_agent_id
+                agent_auth.refresh(user.email)
                 flash('Welcome back!', 'success')
                 return redirect(url_for('public.index'))
         elif user_type == 'staff':
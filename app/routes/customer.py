@@ -2,9 +2,28 @@ from flask import Blueprint, render_template, request, session, redirect, url_fo
 from datetime import datetime, timedelta
 from functools import wraps
 from app.models import db
+from app.pagination import keyset_page
+from app.services import spending
+from app.services.booking import sell_ticket
 
 customer = Blueprint('customer', __name__)
 
+# 路由用到的查询, app/index_check.py 对同一份 SQL 做 EXPLAIN
+UPCOMING_FLIGHTS_QUERY = """
+    SELECT f.*
+    FROM flight f
+    JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
+    JOIN purchases p ON t.ticket_id = p.ticket_id
+    WHERE p.customer_email = %s AND f.departure_time > NOW()
+    ORDER BY f.departure_time
+"""
+
+PURCHASE_FLIGHT_QUERY = """
+    SELECT f.*, f.remaining_seats as available_seats
+    FROM flight f
+    WHERE f.airline_name = %s AND f.flight_num = %s
+"""
+
 
 def customer_required(f):
     @wraps(f)
@@ -23,15 +42,7 @@ def home():
     connection = current_app.config['GET_DB']()  # 获取 pymysql 数据库连接
     cursor = connection.cursor()
 
-    query = """
-        SELECT f.* 
-        FROM flight f
-        JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
-        JOIN purchases p ON t.ticket_id = p.ticket_id
-        WHERE p.customer_email = %s AND f.departure_time > NOW()
-        ORDER BY f.departure_time
-    """
-    cursor.execute(query, (session['user'],))
+    cursor.execute(UPCOMING_FLIGHTS_QUERY, (session['user'],))
     upcoming_flights = cursor.fetchall()
     cursor.close()
     connection.close()  # 关闭连接
@@ -49,21 +60,25 @@ def my_flights():
     cursor = connection.cursor()
 
     query = """
-        SELECT f.* 
+        SELECT f.*, t.ticket_id
         FROM flight f
         JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
         JOIN purchases p ON t.ticket_id = p.ticket_id
         WHERE p.customer_email = %s
-        ORDER BY f.departure_time DESC
     """
-    cursor.execute(query, (session['user'],))
-    flights = cursor.fetchall()
+    # 按 (departure_time, airline_name, flight_num) 分页, ticket_id 区分同一航班的多张票
+    page = keyset_page(cursor, query, (session['user'],), [
+        ('f.departure_time', 'departure_time'),
+        ('f.airline_name', 'airline_name'),
+        ('f.flight_num', 'flight_num'),
+        ('t.ticket_id', 'ticket_id'),
+    ], descending=True)
 
     # 关闭游标和连接
     cursor.close()
     connection.close()
 
-    return render_template('customer/view_flights.html', flights=flights)
+    return render_template('customer/view_flights.html', flights=page.rows, page=page)
 
 
 @customer.route('/purchase/<int:flight_num>/<airline_name>', methods=['GET', 'POST'])
@@ -85,57 +100,17 @@ def purchase_ticket(flight_num, airline_name):
                 flash("Flight does not exist.", "danger")
                 return redirect(url_for('customer.search_flights'))
 
-            # Check available seats
-            cursor.execute("""
-                SELECT (a.seats - COUNT(t.ticket_id)) as available_seats
-                FROM flight f 
-                JOIN airplane a ON f.airline_name = a.airline_name 
-                    AND f.airplane_id = a.airplane_id
-                LEFT JOIN ticket t ON f.airline_name = t.airline_name 
-                    AND f.flight_num = t.flight_num
-                WHERE f.airline_name = %s AND f.flight_num = %s
-                GROUP BY a.seats
-            """, (airline_name, flight_num))
-
-            result = cursor.fetchone()
-            if not result or result['available_seats'] <= 0:
+            # 原子地占座并写入 ticket / purchases (同一个事务)
+            if sell_ticket(connection, airline_name, flight_num, session['user']) is None:
                 flash("Sorry, this flight is fully booked.", "danger")
                 return redirect(url_for('customer.search_flights'))
-
-            # Get next ticket_id
-            cursor.execute("SELECT MAX(ticket_id) as max_id FROM ticket")
-            result = cursor.fetchone()
-            next_ticket_id = 1 if result['max_id'] is None else result['max_id'] + 1
-
-            # Create ticket record
-            cursor.execute("""
-                INSERT INTO ticket (ticket_id, airline_name, flight_num)
-                VALUES (%s, %s, %s)
-            """, (next_ticket_id, airline_name, flight_num))
-            connection.commit()
-
-            # Create purchase record
-            cursor.execute("""
-                INSERT INTO purchases (ticket_id, customer_email, purchase_date)
-                VALUES (%s, %s, CURDATE())
-            """, (next_ticket_id, session['user']))
             connection.commit()
 
             flash("Ticket purchased successfully!", "success")
             return redirect(url_for('customer.my_flights'))
 
         # GET request handling
-        cursor.execute("""
-            SELECT f.*, 
-                   (a.seats - COUNT(t.ticket_id)) as available_seats
-            FROM flight f
-            JOIN airplane a ON f.airline_name = a.airline_name 
-                AND f.airplane_id = a.airplane_id
-            LEFT JOIN ticket t ON f.airline_name = t.airline_name 
-                AND f.flight_num = t.flight_num
-            WHERE f.airline_name = %s AND f.flight_num = %s
-            GROUP BY f.airline_name, f.flight_num, a.seats
-        """, (airline_name, flight_num))
+        cursor.execute(PURCHASE_FLIGHT_QUERY, (airline_name, flight_num))
         flight = cursor.fetchone()
 
         if not flight:
@@ -179,20 +154,8 @@ def track_spending():
             end_date = datetime.now().date()
             start_date = end_date - timedelta(days=365)
 
-        # 查询用户消费记录
-        query = """
-    SELECT DATE_FORMAT(p.purchase_date, '%%Y-%%m') as month, 
-           SUM(f.price) as total
-    FROM purchases p
-    JOIN ticket t ON p.ticket_id = t.ticket_id
-    JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
-    WHERE p.customer_email = %s AND p.purchase_date BETWEEN %s AND %s
-    GROUP BY DATE_FORMAT(p.purchase_date, '%%Y-%%m')
-    ORDER BY month ASC
-"""
-
-        cursor.execute(query, (session['user'], start_date, end_date))
-        spending_data = cursor.fetchall()
+        # 查询用户消费记录 (整月来自月度汇总表)
+        spending_data = spending.monthly_spending(cursor, session['user'], start_date, end_date)
 
         # 确保 `spending_data` 中有内容
         months = [row['month'] for row in spending_data]
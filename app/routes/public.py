@@ -1,8 +1,13 @@
 from flask import Blueprint, render_template, request, session, redirect, url_for, jsonify, current_app
-from app.models.flight import Flight, Airport, Airline
-from sqlalchemy import or_
-from datetime import datetime
+from app.models.flight import Flight, Airline
+from datetime import datetime, timedelta
 from app.models import db
+from app.services import fares
+from app.services.airports import airport_catalog
+from app.services.booking import remaining_seats
+from app.services.autocomplete import airport_autocomplete
+from app.services.itineraries import flight_index, itinerary_dict
+from app.services.search_cache import search_cache, search_key
 
 public = Blueprint('public', __name__)
 
@@ -11,12 +16,89 @@ public = Blueprint('public', __name__)
 def index():
     """Homepage route"""
     # Get list of airports for search form autocomplete
-    airports = Airport.query.all()
-    airport_list = [{'name': airport.airport_name,
-                     'city': airport.airport_city}
-                    for airport in airports]
-
-    return render_template('public/index.html', airports=airport_list)
+    return render_template('public/index.html', airports=airport_catalog.airports())
+
+
+def find_flights(source_names, dest_names, start_date, end_date):
+    """Upcoming, not cancelled flights on the route, as plain dicts.
+
+    ``source_names`` / ``dest_names`` are sets of airport names, or None for
+    any airport.
+    """
+    query = db.session.query(
+        Flight.airline_name, Flight.flight_num,
+        Flight.departure_airport, Flight.departure_time,
+        Flight.arrival_airport, Flight.arrival_time,
+        Flight.price, Flight.status
+    )
+    if source_names is not None:
+        query = query.filter(Flight.departure_airport.in_(source_names))
+    if dest_names is not None:
+        query = query.filter(Flight.arrival_airport.in_(dest_names))
+    if start_date:
+        query = query.filter(Flight.departure_time >= start_date)
+    if end_date:
+        query = query.filter(Flight.departure_time <= end_date)
+
+    # Exclude cancelled flights and only show flights in the future
+    query = query.filter(
+        Flight.departure_time >= datetime.now(),
+        Flight.status != 'Cancelled'
+    )
+    return [row._asdict() for row in query.order_by(Flight.departure_time).all()]
+
+
+def warm_search_cache(routes):
+    """Fill the cache for undated searches by airport name on each ``(from, to)`` route."""
+    for departure_airport, arrival_airport in routes:
+        source_names = airport_catalog.match(departure_airport)
+        dest_names = airport_catalog.match(arrival_airport)
+        if not source_names or not dest_names:
+            continue
+        key = search_key('public', source_names, dest_names, None, None)
+        search_cache.set(key, find_flights(source_names, dest_names, None, None))
+
+
+def search_itineraries(source_names, dest_names, start_date, end_date, connecting_only=False):
+    """Connecting itineraries, with options from the query string.
+
+    Without an end date the first leg must leave within a day of the start.
+    """
+    config = current_app.config
+    window_start = max(start_date or datetime.now(), datetime.now())
+    window_end = end_date or window_start + timedelta(days=1)
+    max_legs = min(request.args.get('max_legs', config['ITINERARY_MAX_LEGS'], type=int),
+                   config['ITINERARY_MAX_LEGS'])
+    min_layover = request.args.get('min_layover', config['ITINERARY_MIN_LAYOVER_MINUTES'],
+                                   type=int)
+    max_layover = request.args.get('max_layover', config['ITINERARY_MAX_LAYOVER_MINUTES'],
+                                   type=int)
+    sort = 'duration' if request.args.get('sort') == 'duration' else 'price'
+    return flight_index.search(source_names, dest_names, window_start, window_end,
+                               sort=sort, max_legs=max(1, max_legs),
+                               min_layover=timedelta(minutes=max(0, min_layover)),
+                               max_layover=timedelta(minutes=max(0, max_layover)),
+                               connecting_only=connecting_only)
+
+
+def seats_for(flights, itineraries=()):
+    """Remaining seats for the flights and itinerary legs, in one query.
+
+    Itinerary dicts get ``seats_left`` on each leg and overall (the minimum).
+    """
+    keys = [(flight['airline_name'], flight['flight_num']) for flight in flights]
+    keys += [(leg['airline'], leg['flight_number'])
+             for itinerary in itineraries for leg in itinerary['legs']]
+    cursor = current_app.config['GET_DB']().cursor()
+    try:
+        seats = remaining_seats(cursor, keys)
+    finally:
+        cursor.close()
+    for itinerary in itineraries:
+        for leg in itinerary['legs']:
+            leg['seats_left'] = seats.get((leg['airline'], leg['flight_number']), 0)
+        itinerary['seats_left'] = min(leg['seats_left'] for leg in itinerary['legs'])
+    return seats
 
 
 @public.route('/search_result', methods=['GET'])
@@ -29,73 +111,55 @@ def search_flights():
     end_date_str = request.args.get('end_date')
 
     try:
-        # Start with a base query
-        query = db.session.query(Flight)
-
-        if source:
-            # Find matching source airports by name or city
-            source_airports = db.session.query(Airport.airport_name).filter(
-                or_(
-                    Airport.airport_name.ilike(f'%{source}%'),
-                    Airport.airport_city.ilike(f'%{source}%')
-                )
-            ).all()
-            if source_airports:
-                source_names = [airport[0] for airport in source_airports]
-                query = query.filter(Flight.departure_airport.in_(source_names))
-            else:
-                # If no matching source airport, return empty results
-                return render_template(
-                    'public/search_result.html',
-                    flights=[],
-                    source=source,
-                    destination=destination,
-                    start_date=start_date_str,
-                    end_date=end_date_str,
-                    error="No flights found for the specified source."
-                )
-
-        if destination:
-            # Find matching destination airports by name or city
-            dest_airports = db.session.query(Airport.airport_name).filter(
-                or_(
-                    Airport.airport_name.ilike(f'%{destination}%'),
-                    Airport.airport_city.ilike(f'%{destination}%')
-                )
-            ).all()
-            if dest_airports:
-                dest_names = [airport[0] for airport in dest_airports]
-                query = query.filter(Flight.arrival_airport.in_(dest_names))
-            else:
-                # If no matching destination airport, return empty results
-                return render_template(
-                    'public/search_result.html',
-                    flights=[],
-                    source=source,
-                    destination=destination,
-                    start_date=start_date_str,
-                    end_date=end_date_str,
-                    error="No flights found for the specified destination."
-                )
-
-        if start_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            query = query.filter(Flight.departure_time >= start_date)
-
-        if end_date_str:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-            query = query.filter(Flight.departure_time <= end_date)
-
-        # Exclude cancelled flights and only show flights in the future
-        query = query.filter(
-            Flight.departure_time >= datetime.now(),
-            Flight.status != 'Cancelled'
-        )
+        # Resolve the search terms to airport names (by name or city)
+        source_names = airport_catalog.match(source)
+        if source_names is not None and not source_names:
+            # If no matching source airport, return empty results
+            return render_template(
+                'public/search_result.html',
+                flights=[],
+                source=source,
+                destination=destination,
+                start_date=start_date_str,
+                end_date=end_date_str,
+                error="No flights found for the specified source."
+            )
 
-        # Fetch the results
-        flights = query.all()
+        dest_names = airport_catalog.match(destination)
+        if dest_names is not None and not dest_names:
+            # If no matching destination airport, return empty results
+            return render_template(
+                'public/search_result.html',
+                flights=[],
+                source=source,
+                destination=destination,
+                start_date=start_date_str,
+                end_date=end_date_str,
+                error="No flights found for the specified destination."
+            )
 
-        if not flights:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+
+        key = search_key('public', source_names, dest_names, start_date, end_date)
+        flights = search_cache.get(key)
+        if flights is None:
+            flights = find_flights(source_names, dest_names, start_date, end_date)
+            search_cache.set(key, flights)
+
+        # Only show flights in the future (a cached result may be a minute old)
+        now = datetime.now()
+        flights = [flight for flight in flights if flight['departure_time'] >= now]
+
+        # Connecting itineraries for routes with few or no direct flights
+        itineraries = []
+        if source_names and dest_names:
+            itineraries = [itinerary_dict(legs)
+                           for legs in search_itineraries(source_names, dest_names,
+                                                          start_date, end_date,
+                                                          connecting_only=True)]
+
+        if not flights and not itineraries:
             return render_template(
                 'public/search_result.html',
                 flights=[],
@@ -106,28 +170,30 @@ def search_flights():
                 error="No flights match your search criteria."
             )
 
+        # 座位数不进缓存: 每次按主键批量读取当前库存
+        seats = seats_for(flights, itineraries)
+
         # Prepare flight data for rendering
         flight_list = []
         for flight in flights:
-            dep_airport = Airport.query.get(flight.departure_airport)
-            arr_airport = Airport.query.get(flight.arrival_airport)
-
             flight_list.append({
-                'airline': flight.airline_name,
-                'flight_number': flight.flight_num,
-                'departure_airport': flight.departure_airport,
-                'departure_city': dep_airport.airport_city if dep_airport else '',
-                'departure_time': flight.departure_time.strftime('%Y-%m-%d %H:%M'),
-                'arrival_airport': flight.arrival_airport,
-                'arrival_city': arr_airport.airport_city if arr_airport else '',
-                'arrival_time': flight.arrival_time.strftime('%Y-%m-%d %H:%M'),
-                'price': float(flight.price),
-                'status': flight.status
+                'airline': flight['airline_name'],
+                'flight_number': flight['flight_num'],
+                'departure_airport': flight['departure_airport'],
+                'departure_city': airport_catalog.city(flight['departure_airport']),
+                'departure_time': flight['departure_time'].strftime('%Y-%m-%d %H:%M'),
+                'arrival_airport': flight['arrival_airport'],
+                'arrival_city': airport_catalog.city(flight['arrival_airport']),
+                'arrival_time': flight['arrival_time'].strftime('%Y-%m-%d %H:%M'),
+                'price': float(flight['price']),
+                'status': flight['status'],
+                'seats_left': seats.get((flight['airline_name'], flight['flight_num']), 0)
             })
 
         return render_template(
             'public/search_result.html',
             flights=flight_list,
+            itineraries=itineraries,
             source=source,
             destination=destination,
             start_date=start_date_str,
@@ -147,6 +213,59 @@ def search_flights():
         )
 
 
+@public.route('/itineraries', methods=['GET'])
+def itineraries():
+    """API endpoint for connecting itineraries between two cities or airports"""
+    source_names = airport_catalog.match(request.args.get('source', ''))
+    dest_names = airport_catalog.match(request.args.get('destination', ''))
+    if not source_names or not dest_names:
+        return jsonify({'error': 'source and destination are required'}), 400
+
+    try:
+        start_date_str = request.args.get('start_date')
+        end_date_str = request.args.get('end_date')
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else None
+    except ValueError:
+        return jsonify({'error': 'dates must be YYYY-MM-DD'}), 400
+
+    results = [itinerary_dict(legs)
+               for legs in search_itineraries(source_names, dest_names, start_date, end_date)]
+    seats_for([], results)
+    return jsonify(results)
+
+
+@public.route('/fare_calendar', methods=['GET'])
+def fare_calendar():
+    """API endpoint for the lowest fare and seats left per day on a route"""
+    source_names = airport_catalog.match(request.args.get('source', ''))
+    dest_names = airport_catalog.match(request.args.get('destination', ''))
+    if not source_names or not dest_names:
+        return jsonify({'error': 'source and destination are required'}), 400
+
+    today = datetime.now().date()
+    try:
+        start_date_str = request.args.get('start_date')
+        first_day = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else today
+    except ValueError:
+        return jsonify({'error': 'start_date must be YYYY-MM-DD'}), 400
+    first_day = max(first_day, today)
+    days = request.args.get('days', current_app.config.get('FARE_CALENDAR_DAYS', 30), type=int)
+    days = max(1, min(days, current_app.config.get('FARE_CALENDAR_MAX_DAYS', 90)))
+
+    cursor = current_app.config['GET_DB']().cursor()
+    try:
+        calendar = fares.fare_calendar(cursor, source_names, dest_names, first_day, days)
+    finally:
+        cursor.close()
+    return jsonify({
+        'source': request.args.get('source'),
+        'destination': request.args.get('destination'),
+        'start_date': first_day.strftime('%Y-%m-%d'),
+        'days': calendar,
+    })
+
+
 @public.route('/flight_status', methods=['GET'])
 def flight_status():
     """Check flight status by flight number or route"""
@@ -178,17 +297,14 @@ def flight_status():
         # Format flight status data
         status_list = []
         for flight in flights:
-            dep_airport = Airport.query.get(flight.departure_airport)
-            arr_airport = Airport.query.get(flight.arrival_airport)
-
             status_list.append({
                 'airline': flight.airline_name,
                 'flight_number': flight.flight_num,
                 'departure_airport': flight.departure_airport,
-                'departure_city': dep_airport.airport_city,
+                'departure_city': airport_catalog.city(flight.departure_airport),
                 'scheduled_departure': flight.departure_time.strftime('%Y-%m-%d %H:%M'),
                 'arrival_airport': flight.arrival_airport,
-                'arrival_city': arr_airport.airport_city,
+                'arrival_city': airport_catalog.city(flight.arrival_airport),
                 'scheduled_arrival': flight.arrival_time.strftime('%Y-%m-%d %H:%M'),
                 'status': flight.status,
                 'status_time': datetime.now().strftime('%Y-%m-%d %H:%M')
@@ -214,16 +330,9 @@ def search_airports():
     """API endpoint for airport search autocomplete"""
     search_term = request.args.get('term', '')
 
-    airports = Airport.query.filter(
-        or_(
-            Airport.airport_name.ilike(f'%{search_term}%'),
-            Airport.airport_city.ilike(f'%{search_term}%')
-        )
-    ).limit(10).all()
-
     results = [{
-        'label': f"{airport.airport_city} ({airport.airport_name})",
-        'value': airport.airport_name
-    } for airport in airports]
+        'label': airport_autocomplete.label(name),
+        'value': name
+    } for name in airport_autocomplete.search(search_term, limit=10)]
 
-    return jsonify(results)
\ No newline at end of file
+    return jsonify(results)
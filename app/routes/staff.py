@@ -1,29 +1,51 @@
 from flask import Blueprint, render_template, request, session, redirect, url_for, jsonify, current_app
 from flask import session, flash
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 import json
-from app.models import db
+from app.pagination import keyset_page
+from app.database import after_commit
+from app.routes.public import warm_search_cache
+from app.services import (fares, flight_status, flight_templates, heavy_hitters,
+                          notifications, permissions, sales, schedule_import)
+from app.services.agent_auth import agent_auth
+from app.services.aircraft_schedule import aircraft_schedule, locked_conflict
+from app.services.airports import airport_catalog
+from app.services.commissions import months_ago
+from app.services.itineraries import flight_index
+from app.services.rankings import agent_rankings
+from app.services.search_cache import search_cache, invalidate_flight, invalidate_flights
 from flask_wtf.csrf import CSRFProtect
 
 staff = Blueprint('staff', __name__, url_prefix='/staff')
 
+# 路由用到的查询, app/index_check.py 对同一份 SQL 做 EXPLAIN
+PENDING_AGENTS_QUERY = """
+    SELECT COUNT(*) as count
+    FROM booking_agent ba
+    WHERE ba.approved = FALSE
+"""
+
+VIEW_FLIGHTS_QUERY = """
+    SELECT f.*, a1.airport_city as departure_city,
+           a2.airport_city as arrival_city
+    FROM flight f
+    JOIN airport a1 ON f.departure_airport = a1.airport_name
+    JOIN airport a2 ON f.arrival_airport = a2.airport_name
+    WHERE f.airline_name = %s
+"""
+
+VIEW_FLIGHTS_KEYS = [
+    ('f.departure_time', 'departure_time'),
+    ('f.airline_name', 'airline_name'),
+    ('f.flight_num', 'flight_num'),
+]
+
+
 def get_staff_permissions(username):
-    """获取员工权限"""
-    db = current_app.config['GET_DB']()
-    cursor = db.cursor()
-    try:
-        cursor.execute("""
-            SELECT permission_type 
-            FROM permission 
-            WHERE username = %s
-        """, (username,))
-        permissions = [row['permission_type'] for row in cursor.fetchall()]
-        return permissions
-    finally:
-        cursor.close()
-        db.close()
+    """获取员工权限 (请求内及跨请求缓存)"""
+    return permissions.staff_permissions(username)
 
 
 
@@ -47,11 +69,7 @@ def dashboard():
         airline = session.get('airline_name')
 
         # 添加获取待审批代理的查询
-        cursor.execute("""
-            SELECT COUNT(*) as count
-            FROM booking_agent ba
-            WHERE ba.approved = FALSE
-        """)
+        cursor.execute(PENDING_AGENTS_QUERY)
         pending_agents_result = cursor.fetchone()
         pending_agents = pending_agents_result['count'] if pending_agents_result else 0
 
@@ -86,50 +104,18 @@ def dashboard():
         cursor.execute(flight_query, (airline,))
         recent_flights = cursor.fetchall()
 
-        # Revenue stats
-        revenue_query = """
-           SELECT 
-               SUM(CASE WHEN p.booking_agent_id IS NULL THEN f.price ELSE 0 END) as direct_revenue,
-               SUM(CASE WHEN p.booking_agent_id IS NOT NULL THEN f.price ELSE 0 END) as indirect_revenue,
-               COUNT(DISTINCT p.ticket_id) as tickets_sold
-           FROM flight f
-           JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
-           JOIN purchases p ON t.ticket_id = p.ticket_id
-           WHERE f.airline_name = %s 
-           AND MONTH(p.purchase_date) = MONTH(CURRENT_DATE())
-        """
-        cursor.execute(revenue_query, (airline,))
-        revenue = cursor.fetchone()
-
-        # Top destinations
-        dest_query = """
-           SELECT 
-               f.arrival_airport,
-               a.airport_city,
-               COUNT(*) as frequency
-           FROM flight f
-           JOIN airport a ON f.arrival_airport = a.airport_name
-           JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
-           JOIN purchases p ON t.ticket_id = p.ticket_id  
-           WHERE f.airline_name = %s
-           AND p.purchase_date >= DATE_SUB(NOW(), INTERVAL 3 MONTH)
-           GROUP BY f.arrival_airport
-           ORDER BY frequency DESC
-           LIMIT 3
-        """
-        cursor.execute(dest_query, (airline,))
-        top_destinations = cursor.fetchall()
+        # Revenue stats (本月, 来自 sales_daily 汇总表)
+        revenue = sales.month_to_date(cursor, airline)
 
-        # Staff permissions
-        perm_query = "SELECT permission_type FROM permission WHERE username = %s"
-        cursor.execute(perm_query, (session.get('user'),))
-        permissions = [p['permission_type'] for p in cursor.fetchall()]
+        # Top destinations (最近 3 个月, 来自内存 top-K sketch)
+        top_destinations = heavy_hitters.top_destinations(
+            airline, months_ago(date.today(), 3), 3)
 
         return render_template('staff/dashboard.html',
                           recent_flights=recent_flights,
                           revenue=revenue,
                           top_destinations=top_destinations,
-                          permissions=permissions,
+                          permissions=get_staff_permissions(session.get('user')),
                           pending_agents=pending_agents,  # 添加这个
                           pending_staff=pending_staff)    # 添加这个
     finally:
@@ -164,14 +150,7 @@ def approve_agents():
             return redirect(url_for('staff.dashboard'))
 
         # Check admin permission
-        cursor.execute("""
-            SELECT * FROM permission 
-            WHERE username = %s AND permission_type = 'Admin'
-        """, (session.get('user'),))
-        admin_permission = cursor.fetchone()
-        print("Admin permission query result:", admin_permission)
-
-        if not admin_permission:
+        if 'Admin' not in get_staff_permissions(session.get('user')):
             flash('You do not have permission to approve agents.', 'danger')
             return redirect(url_for('staff.dashboard'))
 
@@ -194,6 +173,8 @@ def approve_agents():
                 """
                 cursor.executemany(insert_query, values)
                 connection.commit()
+                for email in agent_emails:
+                    after_commit(lambda email=email: agent_auth.invalidate(email))
 
                 flash(f'Successfully approved {len(agent_emails)} agents.', 'success')
             else:
@@ -246,13 +227,7 @@ def approve_staff():
             return redirect(url_for('staff.dashboard'))
 
         # 检查当前用户是否有admin权限
-        cursor.execute("""
-            SELECT * FROM permission 
-            WHERE username = %s AND permission_type = 'Admin'
-        """, (session.get('user'),))
-        admin_permission = cursor.fetchone()
-
-        if not admin_permission:
+        if 'Admin' not in get_staff_permissions(session.get('user')):
             flash('You do not have permission to approve staff members.', 'danger')
             return redirect(url_for('staff.dashboard'))
 
@@ -314,14 +289,7 @@ def view_flights():
     cursor = db.cursor()
 
     # Build query based on filters
-    base_query = """
-        SELECT f.*, a1.airport_city as departure_city, 
-               a2.airport_city as arrival_city
-        FROM flight f
-        JOIN airport a1 ON f.departure_airport = a1.airport_name
-        JOIN airport a2 ON f.arrival_airport = a2.airport_name
-        WHERE f.airline_name = %s
-    """
+    base_query = VIEW_FLIGHTS_QUERY
     params = [session['airline_name']]
 
     if request.args.get('start_date'):
@@ -339,10 +307,7 @@ def view_flights():
         search = f"%{request.args.get('destination')}%"
         params.extend([search, search])
 
-    base_query += " ORDER BY f.departure_time"
-
-    cursor.execute(base_query, tuple(params))
-    flights = cursor.fetchall()
+    page = keyset_page(cursor, base_query, params, VIEW_FLIGHTS_KEYS)
 
     # Get staff permissions for template
     staff_permissions = get_staff_permissions(session['user'])
@@ -350,7 +315,8 @@ def view_flights():
     cursor.close()
 
     return render_template('staff/view_flights.html',
-                           flights=flights,
+                           flights=page.rows,
+                           page=page,
                            staff={'permissions': staff_permissions})
 
 
@@ -365,21 +331,161 @@ def change_status(flight_num):
     if not status:
         return jsonify({'error': 'Status required'}), 400
 
-    cursor = db.cursor()
+    connection = current_app.config['GET_DB']()
+    cursor = connection.cursor()
     try:
         cursor.execute("""
-            UPDATE flight 
-            SET status = %s 
+            SELECT airline_name, flight_num, departure_airport,
+                   arrival_airport, departure_time, arrival_time, airplane_id, status
+            FROM flight
+            WHERE airline_name = %s AND flight_num = %s
+        """, (session['airline_name'], flight_num))
+        flight = cursor.fetchone()
+        if not flight:
+            return jsonify({'error': 'Flight not found'}), 404
+
+        cursor.execute("""
+            UPDATE flight
+            SET status = %s
             WHERE airline_name = %s AND flight_num = %s
         """, (status, session['airline_name'], flight_num))
-        db.commit()
+        fares.refresh_route_day(cursor, flight['departure_airport'],
+                                flight['arrival_airport'], flight['departure_time'].date())
+        # 乘客通知在后台发送, 请求不等待
+        if status.lower() != (flight['status'] or '').lower():
+            if notifications.enqueue(cursor, [dict(flight, status=status)]):
+                after_commit(notifications.notifier.wake)
+        connection.commit()
+        after_commit(lambda: invalidate_flight(flight['departure_airport'],
+                                               flight['arrival_airport'],
+                                               flight['departure_time']))
+        after_commit(lambda: flight_index.set_status(flight['airline_name'],
+                                                    flight['flight_num'], status))
+        after_commit(lambda: aircraft_schedule.set_status(flight['airline_name'],
+                                                          flight['flight_num'], status, flight))
         return jsonify({'success': True})
     except Exception as e:
+        connection.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         cursor.close()
 
 
+@staff.route('/change_status_bulk', methods=['POST'])
+@staff_required
+def change_status_bulk():
+    """AJAX endpoint: one status (and optional delay) for many flights, one summary"""
+    if 'Operator' not in get_staff_permissions(session['user']):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    # JSON 或表单: status, flight_nums 或 airport + window_start/window_end, delay_minutes
+    data = request.get_json(silent=True)
+    if data is None:
+        data = request.form.to_dict()
+        data['flight_nums'] = request.form.getlist('flight_num')
+    status = data.get('status')
+    if not status:
+        return jsonify({'error': 'Status required'}), 400
+    try:
+        flight_nums = [int(flight_num) for flight_num in data.get('flight_nums') or []]
+        delay_minutes = int(data.get('delay_minutes') or 0)
+        window_start = window_end = None
+        if not flight_nums:
+            window_start = datetime.strptime(data.get('window_start', ''), '%Y-%m-%dT%H:%M')
+            window_end = datetime.strptime(data.get('window_end', ''), '%Y-%m-%dT%H:%M')
+            if not data.get('airport'):
+                raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Give flight_nums, or airport with window_start and '
+                                 'window_end (YYYY-MM-DDTHH:MM); delay_minutes must be '
+                                 'a whole number'}), 400
+    if delay_minutes < 0:
+        return jsonify({'error': 'delay_minutes must not be negative'}), 400
+
+    airline = session['airline_name']
+    connection = current_app.config['GET_DB']()
+    cursor = connection.cursor()
+    try:
+        flights = flight_status.select_flights(cursor, airline, flight_nums,
+                                               data.get('airport'), window_start, window_end)
+        max_flights = current_app.config.get('FLIGHT_STATUS_BULK_MAX', 500)
+        if len(flights) > max_flights:
+            connection.rollback()
+            return jsonify({'error': f'{len(flights)} flights match; at most {max_flights} '
+                                     f'can be changed at once'}), 400
+        summary, changes = flight_status.apply(
+            cursor, flights, status, delay_minutes,
+            current_app.config.get('AIRCRAFT_MIN_TURNAROUND_MINUTES', 0))
+        # 状态变了或时间推迟了的航班, 每个一个通知任务
+        summary['notifications'] = notifications.enqueue(
+            cursor, [new for old, new in changes
+                     if new['status'].lower() != (old['status'] or '').lower()
+                     or new['departure_time'] != old['departure_time']])
+    except Exception as e:
+        connection.rollback()
+        return jsonify({'error': str(e)}), 500
+    finally:
+        cursor.close()
+
+    # 旧时间和新时间的搜索结果都可能变了; 时间有变动时内存索引整体重载
+    after_commit(lambda: invalidate_flights([flight for change in changes for flight in change]))
+    if summary['notifications']:
+        after_commit(notifications.notifier.wake)
+    if summary['delay_minutes'] and changes:
+        after_commit(flight_index.invalidate)
+        after_commit(lambda: aircraft_schedule.invalidate(airline))
+        after_commit(lambda: heavy_hitters.heavy_hitters.invalidate('destination_cities',
+                                                                    airline))
+    else:
+        for old, new in changes:
+            after_commit(lambda new=new: flight_index.set_status(
+                new['airline_name'], new['flight_num'], new['status']))
+            after_commit(lambda new=new: aircraft_schedule.set_status(
+                new['airline_name'], new['flight_num'], new['status'], new))
+    return jsonify(summary)
+
+
+@staff.route('/cache_stats')
+@staff_required
+def cache_stats():
+    """Hit/miss counters of the in-process caches"""
+    return jsonify({'search': search_cache.stats(),
+                    'permissions': permissions.permission_cache.stats(),
+                    'agent_auth': agent_auth.stats(),
+                    'heavy_hitters': heavy_hitters.heavy_hitters.stats(),
+                    'aircraft_schedule': aircraft_schedule.stats()})
+
+
+@staff.route('/notification_stats')
+@staff_required
+def notification_stats():
+    """Delivery metrics of this process's notification worker and the airline's queue"""
+    cursor = current_app.config['GET_DB']().cursor()
+    try:
+        queue = notifications.queue_counts(cursor, session['airline_name'])
+    finally:
+        cursor.close()
+    return jsonify({'worker': notifications.notifier.stats(), 'queue': queue})
+
+
+@staff.route('/top_k_audit')
+@staff_required
+def top_k_audit():
+    """Compare the top-K sketches of the airline with an exact recount"""
+    airline = session['airline_name']
+    today = date.today()
+    cursor = current_app.config['GET_DB']().cursor()
+    try:
+        return jsonify([
+            heavy_hitters.audit(cursor, 'destinations', airline, months_ago(today, 3), 3),
+            heavy_hitters.audit(cursor, 'destination_cities', airline, months_ago(today, 3), 3),
+            heavy_hitters.audit(cursor, 'destination_cities', airline, months_ago(today, 12), 3),
+            heavy_hitters.audit(cursor, 'customers', airline, months_ago(today, 12), 1),
+        ])
+    finally:
+        cursor.close()
+
+
 @staff.route('/view_reports')
 @staff_required
 def view_reports():
@@ -393,29 +499,8 @@ def view_reports():
                                   (datetime.now() - timedelta(days=30))
                                   .strftime('%Y-%m-%d'))
 
-    # 月度销售查询
-    cursor.execute("""
-        SELECT DATE_FORMAT(p.purchase_date, '%%Y-%%m') as month,
-               COUNT(*) as total,
-               SUM(CASE WHEN booking_agent_id IS NULL THEN 1 ELSE 0 END) 
-                   as direct_sales,
-               SUM(CASE WHEN booking_agent_id IS NOT NULL THEN 1 ELSE 0 END) 
-                   as indirect_sales,
-               SUM(f.price) as revenue,
-               SUM(CASE WHEN booking_agent_id IS NULL THEN f.price ELSE 0 END) 
-                   as direct_revenue,
-               SUM(CASE WHEN booking_agent_id IS NOT NULL THEN f.price ELSE 0 END) 
-                   as indirect_revenue
-        FROM purchases p
-        JOIN ticket t ON p.ticket_id = t.ticket_id
-        JOIN flight f ON t.flight_num = f.flight_num AND t.airline_name = f.airline_name
-        WHERE t.airline_name = %s
-        AND p.purchase_date BETWEEN %s AND %s
-        GROUP BY DATE_FORMAT(p.purchase_date, '%%Y-%%m')
-        ORDER BY month
-    """, (session['airline_name'], start_date, end_date))
-
-    report_data = cursor.fetchall()
+    # 月度销售查询 (按天汇总的 sales_daily, 每天每个渠道一行)
+    report_data = sales.monthly_sales(cursor, session['airline_name'], start_date, end_date)
 
     # 处理数据
     months = []
@@ -433,21 +518,12 @@ def view_reports():
             float(latest_row['indirect_revenue'] or 0)
         ]
 
-    # 热门目的地查询
-    cursor.execute("""
-        SELECT a.airport_city, COUNT(*) as count
-        FROM ticket t
-        JOIN flight f ON t.flight_num = f.flight_num 
-            AND t.airline_name = f.airline_name
-        JOIN airport a ON f.arrival_airport = a.airport_name
-        WHERE t.airline_name = %s
-        AND f.departure_time >= DATE_SUB(NOW(), INTERVAL 3 MONTH)
-        GROUP BY a.airport_city
-        ORDER BY count DESC
-        LIMIT 3
-    """, (session['airline_name'],))
-
-    top_destinations = cursor.fetchall()
+    # 热门目的地 (按起飞日期, 来自内存 top-K sketch)
+    today = date.today()
+    top_destinations_3m = heavy_hitters.top_destination_cities(
+        session['airline_name'], months_ago(today, 3), 3)
+    top_destinations_1y = heavy_hitters.top_destination_cities(
+        session['airline_name'], months_ago(today, 12), 3)
     cursor.close()
     db.close()
 
@@ -455,7 +531,8 @@ def view_reports():
                            months=json.dumps(months),
                            sales_data=json.dumps(sales_data),
                            revenue_data=json.dumps(revenue_data),
-                           top_destinations=top_destinations,
+                           top_destinations_3m=top_destinations_3m,
+                           top_destinations_1y=top_destinations_1y,
                            start_date=start_date,
                            end_date=end_date)
 
@@ -469,25 +546,9 @@ def create_flight():
         return redirect(url_for('staff.dashboard'))
 
     db = current_app.config['GET_DB']()
-    cursor = db.cursor()
-
-    # Get available airplanes and airports
-    cursor.execute("""
-        SELECT airplane_id, seats 
-        FROM airplane 
-        WHERE airline_name = %s
-        ORDER BY airplane_id
-    """, (session['airline_name'],))
-    airplanes = cursor.fetchall()
-
-    cursor.execute("""
-        SELECT airport_name, airport_city 
-        FROM airport 
-        ORDER BY airport_city
-    """)
-    airports = cursor.fetchall()
 
     if request.method == 'POST':
+        cursor = db.cursor()
         try:
             # Validate departure and arrival times
             departure_time = datetime.strptime(
@@ -498,12 +559,27 @@ def create_flight():
             if departure_time >= arrival_time:
                 raise ValueError("Departure time must be before arrival time")
 
+            airplane_id = int(request.form.get('airplane_id'))
+            # 内存索引先快速排除, 再在事务里锁住飞机行用数据库确认
+            clash = aircraft_schedule.conflict(session['airline_name'], airplane_id,
+                                               departure_time, arrival_time)
+            if clash is None:
+                clash = locked_conflict(cursor, session['airline_name'], airplane_id,
+                                        departure_time, arrival_time)
+            if clash is not None:
+                raise ValueError(f"Airplane {airplane_id} is already flying flight {clash} "
+                                 f"at that time")
+
+            # 座位库存从飞机座位数初始化
             cursor.execute("""
                 INSERT INTO flight (
                     airline_name, flight_num, departure_airport,
                     departure_time, arrival_airport, arrival_time,
-                    price, status, airplane_id
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    price, status, airplane_id, remaining_seats
+                )
+                SELECT %s, %s, %s, %s, %s, %s, %s, %s, a.airplane_id, a.seats
+                FROM airplane a
+                WHERE a.airline_name = %s AND a.airplane_id = %s
             """, (
                 session['airline_name'],
                 request.form.get('flight_num'),
@@ -513,22 +589,188 @@ def create_flight():
                 arrival_time,
                 request.form.get('price'),
                 'Upcoming',
-                request.form.get('airplane_id')
+                session['airline_name'],
+                airplane_id
             ))
+            if cursor.rowcount == 0:
+                raise ValueError("Airplane not found")
+            fares.refresh_route_day(cursor, request.form.get('departure_airport'),
+                                    request.form.get('arrival_airport'), departure_time.date())
             db.commit()
+            new_flight = {
+                'airline_name': session['airline_name'],
+                'flight_num': request.form.get('flight_num'),
+                'departure_airport': request.form.get('departure_airport'),
+                'departure_time': departure_time,
+                'arrival_airport': request.form.get('arrival_airport'),
+                'arrival_time': arrival_time,
+                'price': request.form.get('price'),
+                'status': 'Upcoming',
+                'airplane_id': airplane_id,
+            }
+            after_commit(lambda: invalidate_flight(new_flight['departure_airport'],
+                                                   new_flight['arrival_airport'],
+                                                   departure_time))
+            after_commit(lambda: flight_index.add_flight(new_flight))
+            after_commit(lambda: aircraft_schedule.add_flight(new_flight))
             flash('Flight created successfully', 'success')
             return redirect(url_for('staff.view_flights'))
 
         except ValueError as e:
             flash(str(e), 'danger')
         except Exception as e:
+            db.rollback()
             flash('Error creating flight', 'danger')
         finally:
             cursor.close()
 
+    # 表单选项只在显示表单时读取; 机场来自内存目录
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT airplane_id, seats 
+        FROM airplane 
+        WHERE airline_name = %s
+        ORDER BY airplane_id
+    """, (session['airline_name'],))
+    airplanes = cursor.fetchall()
+    cursor.close()
+
     return render_template('staff/create_flights.html',
                            airplanes=airplanes,
-                           airports=airports)
+                           airports=airport_catalog.airports())
+
+
+@staff.route('/free_airplanes')
+@staff_required
+def free_airplanes():
+    """Airplanes of the airline that are not flying between the two times (JSON)"""
+    try:
+        departure_time = datetime.strptime(request.args.get('departure_time', ''),
+                                           '%Y-%m-%dT%H:%M')
+        arrival_time = datetime.strptime(request.args.get('arrival_time', ''),
+                                         '%Y-%m-%dT%H:%M')
+    except ValueError:
+        return jsonify({'error': 'departure_time and arrival_time required'}), 400
+
+    cursor = current_app.config['GET_DB']().cursor()
+    try:
+        fleet = schedule_import.fleet(cursor, session['airline_name'])
+    finally:
+        cursor.close()
+    free = aircraft_schedule.free_airplanes(session['airline_name'], sorted(fleet),
+                                            departure_time, arrival_time)
+    return jsonify({'airplanes': [{'airplane_id': airplane_id, 'seats': fleet[airplane_id]}
+                                  for airplane_id in free]})
+
+
+@staff.route('/import_schedule', methods=['GET', 'POST'])
+@staff_required
+def import_schedule():
+    """Import many flights from a CSV or JSON schedule file"""
+    if 'Admin' not in get_staff_permissions(session['user']):
+        flash('Permission denied', 'danger')
+        return redirect(url_for('staff.dashboard'))
+
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('schedule')
+        if upload is None or not upload.filename:
+            flash('Choose a schedule file to upload', 'danger')
+        else:
+            try:
+                result = schedule_import.import_schedule(upload.filename, upload.read(),
+                                                         session['airline_name'])
+            except ValueError as e:
+                flash(str(e), 'danger')
+            else:
+                if result.imported:
+                    # 导入完成后预热: 转机索引整体重载, 导入最多的航线预先查询
+                    flight_index.reload()
+                    warm_search_cache(
+                        result.routes[:current_app.config.get('SCHEDULE_IMPORT_WARM_ROUTES', 20)])
+                    flash(f'Imported {result.imported} flights', 'success')
+                if result.errors:
+                    flash(f'{len(result.errors)} row(s) could not be imported', 'danger')
+
+    return render_template('staff/import_schedule.html', result=result)
+
+
+@staff.route('/flight_templates', methods=['GET', 'POST'], endpoint='flight_templates')
+@staff_required
+def view_flight_templates():
+    """Recurring flight templates of the airline (create one and generate its flights)"""
+    if 'Admin' not in get_staff_permissions(session['user']):
+        flash('Permission denied', 'danger')
+        return redirect(url_for('staff.dashboard'))
+
+    airline = session['airline_name']
+    db = current_app.config['GET_DB']()
+    cursor = db.cursor()
+    try:
+        airplanes = schedule_import.fleet(cursor, airline)
+        if request.method == 'POST':
+            try:
+                form = request.form
+                template = {
+                    'airline_name': airline,
+                    'departure_airport': form.get('departure_airport'),
+                    'arrival_airport': form.get('arrival_airport'),
+                    'weekdays': flight_templates.weekday_mask(form.getlist('weekdays')),
+                    'departure_clock': datetime.strptime(form.get('departure_clock'),
+                                                         '%H:%M').time(),
+                    'duration_minutes': int(form.get('duration_minutes')),
+                    'valid_from': datetime.strptime(form.get('valid_from'), '%Y-%m-%d').date(),
+                    'valid_until': datetime.strptime(form.get('valid_until'), '%Y-%m-%d').date(),
+                    'airplane_id': int(form.get('airplane_id')),
+                    'price': Decimal(form.get('price')),
+                }
+            except (TypeError, ValueError, ArithmeticError):
+                flash('Please fill in every field with a valid value', 'danger')
+            else:
+                cities = airport_catalog.cities()
+                if (template['departure_airport'] not in cities
+                        or template['arrival_airport'] not in cities
+                        or template['departure_airport'] == template['arrival_airport']):
+                    flash('Choose two different airports', 'danger')
+                elif not template['weekdays']:
+                    flash('Choose at least one weekday', 'danger')
+                elif template['valid_from'] > template['valid_until']:
+                    flash('The date range is empty', 'danger')
+                elif template['duration_minutes'] <= 0 or template['price'] <= 0:
+                    flash('Duration and price must be positive', 'danger')
+                elif template['airplane_id'] not in airplanes:
+                    flash('Airplane not found', 'danger')
+                else:
+                    template_id = flight_templates.create_template(cursor, template)
+                    horizon = current_app.config.get('FLIGHT_TEMPLATE_HORIZON_DAYS', 60)
+                    try:
+                        flights = flight_templates.extend(
+                            cursor, template_id, date.today() + timedelta(days=horizon),
+                            check=aircraft_schedule.batch(airline).check)
+                    except ValueError as e:
+                        # 回滚后连接会重新借出, 换一个新游标
+                        cursor.close()
+                        db.rollback()
+                        cursor = db.cursor()
+                        flash(str(e), 'danger')
+                    else:
+                        after_commit(lambda: invalidate_flights(flights))
+                        after_commit(flight_index.invalidate)
+                        after_commit(lambda: aircraft_schedule.add_flights(flights))
+                        flash(f'Template created, {len(flights)} flights generated', 'success')
+                        return redirect(url_for('staff.flight_templates'))
+
+        rows = flight_templates.templates(cursor, airline)
+    finally:
+        cursor.close()
+
+    for row in rows:
+        row['weekday_names'] = flight_templates.weekday_names(row['weekdays'])
+    return render_template('staff/flight_templates.html',
+                           templates=rows,
+                           airplanes=sorted(airplanes.items()),
+                           airports=airport_catalog.airports(),
+                           weekday_names=flight_templates.WEEKDAY_NAMES)
 
 
 @staff.route('/add_airplane', methods=['GET', 'POST'])
@@ -606,6 +848,7 @@ def add_airport():
                 VALUES (%s, %s)
             """, (airport_name, airport_city))
             db.commit()
+            after_commit(lambda: airport_catalog.add(airport_name, airport_city))
 
             flash('Airport added successfully!', 'success')
             return redirect(url_for('staff.dashboard'))
@@ -628,128 +871,18 @@ def view_agents():
     """View booking agents performance including zero sales"""
     db = current_app.config['GET_DB']()
     cursor = db.cursor()
-
-    # First get all booking agents that work for this airline
-    cursor.execute("""
-        SELECT ba.email, ba.booking_agent_id 
-        FROM booking_agent ba
-        JOIN booking_agent_work_for baw ON ba.email = baw.email
-        WHERE airline_name = %s
-    """, (session['airline_name'],))
-
-    all_agents = cursor.fetchall()
-
-    # Get monthly ticket sales rankings
-    cursor.execute("""
-        WITH agent_monthly_sales AS (
-            SELECT 
-                ba.email,
-                ba.booking_agent_id,
-                COUNT(p.ticket_id) as ticket_count
-            FROM booking_agent ba
-            JOIN booking_agent_work_for baw ON ba.email = baw.email
-            LEFT JOIN purchases p ON ba.booking_agent_id = p.booking_agent_id
-            LEFT JOIN ticket t ON p.ticket_id = t.ticket_id
-            WHERE baw.airline_name = %s
-            AND (p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 1 MONTH) OR p.purchase_date IS NULL)
-            GROUP BY ba.email, ba.booking_agent_id
-            ORDER BY ticket_count DESC
-            LIMIT 5
-        )
-        SELECT 
-            email,
-            booking_agent_id,
-            ticket_count,
-            RANK() OVER (ORDER BY ticket_count DESC) as rank_num
-        FROM agent_monthly_sales
-    """, (session['airline_name'],))
-
-    top_monthly_sales = cursor.fetchall()
-
-    # Get yearly ticket sales rankings
-    cursor.execute("""
-        WITH agent_yearly_sales AS (
-            SELECT 
-                ba.email,
-                ba.booking_agent_id,
-                COUNT(p.ticket_id) as ticket_count
-            FROM booking_agent ba
-            JOIN booking_agent_work_for baw ON ba.email = baw.email
-            LEFT JOIN purchases p ON ba.booking_agent_id = p.booking_agent_id
-            LEFT JOIN ticket t ON p.ticket_id = t.ticket_id
-            WHERE baw.airline_name = %s
-            AND (p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 1 YEAR) OR p.purchase_date IS NULL)
-            GROUP BY ba.email, ba.booking_agent_id
-            ORDER BY ticket_count DESC
-            LIMIT 5
-        )
-        SELECT 
-            email,
-            booking_agent_id,
-            ticket_count,
-            RANK() OVER (ORDER BY ticket_count DESC) as rank_num
-        FROM agent_yearly_sales
-    """, (session['airline_name'],))
-
-    top_yearly_sales = cursor.fetchall()
-
-    # Get yearly commission rankings
-    cursor.execute("""
-        WITH agent_yearly_commission AS (
-            SELECT 
-                ba.email,
-                ba.booking_agent_id,
-                COALESCE(SUM(f.price * 0.1), 0) as commission
-            FROM booking_agent ba
-            JOIN booking_agent_work_for baw ON ba.email = baw.email
-            LEFT JOIN purchases p ON ba.booking_agent_id = p.booking_agent_id
-            LEFT JOIN ticket t ON p.ticket_id = t.ticket_id
-            LEFT JOIN flight f ON t.flight_num = f.flight_num AND t.airline_name = f.airline_name
-            WHERE baw.airline_name = %s
-            AND (p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 1 YEAR) OR p.purchase_date IS NULL)
-            GROUP BY ba.email, ba.booking_agent_id
-            ORDER BY commission DESC
-            LIMIT 5
-        )
-        SELECT 
-            email,
-            booking_agent_id,
-            commission,
-            RANK() OVER (ORDER BY commission DESC) as rank_num
-        FROM agent_yearly_commission
-    """, (session['airline_name'],))
-
-    top_yearly_commission = cursor.fetchall()
-
-    # If we have less than 5 agents in any category, fill with remaining agents (with 0 values)
-    def fill_to_five(rankings, all_agents):
-        if len(rankings) < 5:
-            used_ids = {r['booking_agent_id'] for r in rankings}
-            extras = [
-                         {
-                             'email': agent['email'],
-                             'booking_agent_id': agent['booking_agent_id'],
-                             'ticket_count': 0 if 'ticket_count' in rankings[0] else None,
-                             'commission': 0 if 'commission' in rankings[0] else None,
-                             'rank_num': len(rankings) + i + 1
-                         }
-                         for i, agent in enumerate(all_agents)
-                         if agent['booking_agent_id'] not in used_ids
-                     ][:5 - len(rankings)]
-            rankings.extend(extras)
-        return rankings
-
-    top_monthly_sales = fill_to_five(list(top_monthly_sales), all_agents)
-    top_yearly_sales = fill_to_five(list(top_yearly_sales), all_agents)
-    top_yearly_commission = fill_to_five(list(top_yearly_commission), all_agents)
-
-    cursor.close()
-    db.close()
+    try:
+        # 所有时间窗口和指标一次查询算出 (agent_commission_daily)
+        rankings = agent_rankings(cursor, session['airline_name'],
+                                  current_app.config['AGENT_RANKINGS'],
+                                  current_app.config['AGENT_RANKING_TOP_K'],
+                                  datetime.now().date())
+    finally:
+        cursor.close()
 
     return render_template('staff/view_agents.html',
-                           top_monthly_sales=top_monthly_sales,
-                           top_yearly_sales=top_yearly_sales,
-                           top_yearly_commission=top_yearly_commission)
+                           top_k=current_app.config['AGENT_RANKING_TOP_K'],
+                           **rankings)
 
 @staff.route('/view_customers')
 @staff_required
@@ -758,20 +891,10 @@ def view_customers():
     db = current_app.config['GET_DB']()
     cursor = db.cursor()
 
-    # Get most frequent customer
-    cursor.execute("""
-        SELECT c.email, c.name, COUNT(*) as flights_count
-        FROM purchases p
-        JOIN customer c ON p.customer_email = c.email
-        JOIN ticket t ON p.ticket_id = t.ticket_id
-        WHERE t.airline_name = %s
-        AND p.purchase_date >= DATE_SUB(CURDATE(), INTERVAL 1 YEAR)
-        GROUP BY c.email, c.name
-        ORDER BY flights_count DESC
-        LIMIT 1
-    """, (session['airline_name'],))
-
-    frequent_customer = cursor.fetchone()
+    # Get most frequent customer (最近一年, 来自内存 top-K sketch)
+    top = heavy_hitters.top_customers(cursor, session['airline_name'],
+                                      months_ago(date.today(), 12), 1)
+    frequent_customer = top[0] if top else None
 
     # Get specific customer's flights if requested
     customer_flights = None
@@ -803,20 +926,13 @@ def view_customers():
 @staff_required
 def view_staff():
     """View all staff from the same airline (admin only)"""
-    db = current_app.config['GET_DB']()
-    cursor = db.cursor()
-
     # Check admin permission
-    cursor.execute("""
-        SELECT * FROM permission 
-        WHERE username = %s AND permission_type = 'Admin'
-    """, (session['user'],))
-
-    is_admin = cursor.fetchone() is not None
-
-    if not is_admin:
+    if 'Admin' not in get_staff_permissions(session['user']):
         return jsonify({'error': 'You do not have permission to view this page.'})
 
+    db = current_app.config['GET_DB']()
+    cursor = db.cursor()
+
     # Get all staff from the same airline with their permissions
     cursor.execute("""
         SELECT 
@@ -870,6 +986,8 @@ def grant_permission():
                 request.form.get('permission_type')
             ))
             db.commit()
+            grantee = request.form.get('username')
+            after_commit(lambda: permissions.invalidate(grantee))
             flash('Permission granted successfully', 'success')
             return redirect(url_for('staff.dashboard'))
 
@@ -935,6 +1053,8 @@ def add_booking_agent():
             """, (request.form.get('email'), session['airline_name']))
 
             db.commit()
+            agent_email = request.form.get('email')
+            after_commit(lambda: agent_auth.invalidate(agent_email))
             flash('Booking agent added successfully', 'success')
             return redirect(url_for('staff.view_agents'))
 
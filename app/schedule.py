@@ -0,0 +1,71 @@
+"""Scheduled job that extends the recurring flight templates.
+
+Run it once a day (e.g. from cron) so every template always has dated
+flights ``FLIGHT_TEMPLATE_HORIZON_DAYS`` ahead::
+
+    flask --app run schedule extend
+
+Each template is extended in its own transaction; a template that fails is
+rolled back and reported, and the others are still extended. Web workers
+see the new flights in searches when their caches expire.
+"""
+from datetime import date, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import database
+from app.services import flight_templates
+from app.services.aircraft_schedule import aircraft_schedule
+
+schedule_cli = AppGroup('schedule', help='Recurring flight templates.')
+
+
+@schedule_cli.command('extend')
+@click.option('--days', type=int, default=None,
+              help='Horizon in days from today (default FLIGHT_TEMPLATE_HORIZON_DAYS).')
+@click.option('--airline', default=None, help='Only this airline\'s templates.')
+def extend_command(days, airline):
+    """Generate the flights of every template up to the horizon."""
+    if days is None:
+        days = current_app.config.get('FLIGHT_TEMPLATE_HORIZON_DAYS', 60)
+    through = date.today() + timedelta(days=days)
+
+    cursor = database.get_db().cursor()
+    try:
+        due = flight_templates.due_templates(cursor, through, airline)
+    finally:
+        cursor.close()
+
+    total = 0
+    for template in due:
+        template_id = template['template_id']
+        cursor = database.get_db().cursor()
+        try:
+            flights = flight_templates.extend(
+                cursor, template_id, through,
+                check=aircraft_schedule.batch(template['airline_name']).check)
+            database.commit()
+        except ValueError as e:
+            # 飞机冲突: 不生成, generated_until 不变, 修好后下次运行再试
+            database.get_db().rollback()
+            click.echo(f'template {template_id}: skipped, {e}')
+            continue
+        except Exception as e:
+            # 其他错误 (例如与并发导入争用航班号) 只影响这一个模板
+            database.get_db().rollback()
+            current_app.logger.exception('Extending template %s failed', template_id)
+            click.echo(f'template {template_id}: failed, {e}')
+            continue
+        finally:
+            cursor.close()
+        # 本次运行后面的模板也要看到这些航班
+        aircraft_schedule.add_flights(flights)
+        total += len(flights)
+        click.echo(f'template {template_id}: {len(flights)} flights')
+    click.echo(f'{total} flights generated through {through.isoformat()}')
+
+
+def init_app(app):
+    app.cli.add_command(schedule_cli)
@@ -0,0 +1,88 @@
+"""Cached booking agent authorization.
+
+For each agent this keeps whether the account is approved and the set of
+airlines it may book for (``booking_agent_work_for``). The entry is loaded at
+login, and again only after it expires (``AGENT_AUTH_TTL``) or is invalidated,
+so ``agent_required`` and ``book_ticket_for_customer`` do not query either
+table per request.
+
+Every agent has a version number that ``invalidate`` bumps. An entry is only
+stored if the version did not change while it was being loaded, so a load
+that raced with ``staff.approve_agents`` or ``staff.add_booking_agent`` can
+not put the old state back in the cache.
+"""
+import threading
+from collections import namedtuple
+
+from config import Config
+from app.cache import TTLCache
+from app.database import get_db
+
+AgentAuth = namedtuple('AgentAuth', ['approved', 'airlines'])
+
+AUTH_QUERY = """
+    SELECT ba.approved, baw.airline_name
+    FROM booking_agent ba
+    LEFT JOIN booking_agent_work_for baw ON baw.email = ba.email
+    WHERE ba.email = %s
+"""
+
+
+class AgentAuthCache:
+    def __init__(self, maxsize=4096, ttl=60):
+        self._entries = TTLCache(maxsize, ttl)  # email -> (version, AgentAuth)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _version(self, email):
+        with self._lock:
+            return self._versions.get(email, 0)
+
+    def _load(self, email):
+        cursor = get_db().cursor()
+        try:
+            cursor.execute(AUTH_QUERY, (email,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        if not rows:
+            return None
+        return AgentAuth(bool(rows[0]['approved']),
+                         frozenset(row['airline_name'].lower() for row in rows
+                                   if row['airline_name']))
+
+    def get(self, email):
+        """The agent's ``AgentAuth``, or None if there is no such agent."""
+        key = email.lower()
+        version = self._version(key)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        auth = self._load(email)
+        if auth is not None:
+            with self._lock:
+                if self._versions.get(key, 0) == version:
+                    self._entries.set(key, (version, auth))
+        return auth
+
+    def refresh(self, email):
+        """Reload the agent's entry (at login)."""
+        self.invalidate(email)
+        return self.get(email)
+
+    def can_book(self, email, airline_name):
+        auth = self.get(email)
+        return (auth is not None and auth.approved
+                and (airline_name or '').lower() in auth.airlines)
+
+    def invalidate(self, email):
+        key = email.lower()
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+        self._entries.pop(key)
+
+    def stats(self):
+        return self._entries.stats()
+
+
+agent_auth = AgentAuthCache(Config.AGENT_AUTH_CACHE_SIZE, Config.AGENT_AUTH_TTL)
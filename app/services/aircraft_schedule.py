@@ -0,0 +1,352 @@
+"""In-memory occupancy index of every aircraft, for double-booking checks.
+
+For each aircraft ``(airline_name, airplane_id)`` the index keeps the
+not-cancelled flights that have not landed yet in an interval tree: a
+treap ordered by departure time in which every node also holds the latest
+arrival in its subtree. A time window ``[start, end)`` overlaps a flight
+in a subtree only if that latest arrival is after ``start``, and only
+flights departing before ``end`` can overlap it, so a check walks one
+path down the tree: O(log n), like adding or removing a flight (expected;
+the treap's priorities are random).
+
+An airline's aircraft are loaded on first use and reloaded every
+``AIRCRAFT_INDEX_TTL`` seconds, which also picks up other worker
+processes' changes. ``staff.create_flight``, the schedule import, the
+recurring flight templates and ``staff.change_status`` update it after
+their transactions commit.
+
+The index can therefore be up to ``AIRCRAFT_INDEX_TTL`` behind flights
+created by other processes, so it only rules out clashes quickly. Every
+writer confirms in its own transaction before inserting: ``create_flight``
+with ``locked_conflict``, and each chunk of the schedule import and each
+template expansion with ``locked_conflicts``, which lock the airplane rows
+and query the database for overlapping flights.
+"""
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from app.database import get_db
+
+
+LOAD_QUERY = """
+    SELECT flight_num, airplane_id, departure_time, arrival_time
+    FROM flight
+    WHERE airline_name = %s
+    AND departure_time >= DATE_SUB(NOW(), INTERVAL 1 DAY)
+    AND arrival_time >= NOW()
+    AND status <> 'cancelled'
+"""
+
+OVERLAP_QUERY = """
+    SELECT flight_num
+    FROM flight
+    WHERE airline_name = %s AND airplane_id = %s
+    AND departure_time < %s AND arrival_time > %s
+    AND status <> 'cancelled'
+    LIMIT 1
+"""
+
+# {airplanes}: 每架飞机一个 %s
+LOCK_AIRPLANES_QUERY = """
+    SELECT airplane_id FROM airplane
+    WHERE airline_name = %s AND airplane_id IN ({airplanes})
+    ORDER BY airplane_id
+    FOR UPDATE
+"""
+
+# {flights}: 每个新航班一行 BATCH_ROW, 用 BATCH_ROW_UNION 连接
+BATCH_ROW = ("SELECT %s AS flight_num, %s AS airplane_id, "
+             "%s AS departure_time, %s AS arrival_time")
+BATCH_ROW_UNION = " UNION ALL "
+BATCH_OVERLAP_QUERY = """
+    SELECT n.flight_num AS new_flight, f.flight_num
+    FROM ({flights}) n
+    JOIN flight f ON f.airplane_id = n.airplane_id
+    AND f.departure_time < n.arrival_time AND f.arrival_time > n.departure_time
+    WHERE f.airline_name = %s
+    AND f.status <> 'cancelled'
+    ORDER BY n.flight_num, f.departure_time
+"""
+
+
+def is_cancelled(status):
+    return (status or '').lower() == 'cancelled'
+
+
+def locked_conflict(cursor, airline_name, airplane_id, start, end):
+    """flight_num the aircraft flies during ``[start, end)`` according to the database.
+
+    Locks the airplane row until the transaction ends, so two flights
+    created for the same aircraft at once are checked one after the other.
+    """
+    cursor.execute("SELECT airplane_id FROM airplane "
+                   "WHERE airline_name = %s AND airplane_id = %s FOR UPDATE",
+                   (airline_name, airplane_id))
+    if cursor.fetchone() is None:
+        return None
+    cursor.execute(OVERLAP_QUERY, (airline_name, airplane_id, end, start))
+    row = cursor.fetchone()
+    return row['flight_num'] if row else None
+
+
+def locked_conflicts(cursor, airline_name, flights):
+    """``{new flight_num: clashing flight_num}`` for flights not written yet.
+
+    The set-based form of ``locked_conflict`` for a batch of flight dicts:
+    locks all their airplane rows (in primary key order), then finds every
+    overlapping flight in the database with one query.
+    """
+    if not flights:
+        return {}
+    airplane_ids = sorted({int(flight['airplane_id']) for flight in flights})
+    query = LOCK_AIRPLANES_QUERY.format(airplanes=', '.join(['%s'] * len(airplane_ids)))
+    cursor.execute(query, (airline_name, *airplane_ids))
+    cursor.fetchall()
+    query = BATCH_OVERLAP_QUERY.format(flights=BATCH_ROW_UNION.join([BATCH_ROW] * len(flights)))
+    params = tuple(value for flight in flights
+                   for value in (flight['flight_num'], int(flight['airplane_id']),
+                                 flight['departure_time'], flight['arrival_time']))
+    cursor.execute(query, params + (airline_name,))
+    clashes = {}
+    for row in cursor.fetchall():
+        clashes.setdefault(row['new_flight'], row['flight_num'])
+    return clashes
+
+
+class _Node:
+    __slots__ = ('start', 'end', 'flight_num', 'priority', 'max_end', 'left', 'right')
+
+    def __init__(self, start, end, flight_num):
+        self.start, self.end, self.flight_num = start, end, flight_num
+        self.priority = random.random()
+        self.max_end = end
+        self.left = self.right = None
+
+    @property
+    def key(self):
+        return (self.start, self.flight_num)
+
+    def update(self):
+        self.max_end = self.end
+        for child in (self.left, self.right):
+            if child is not None and child.max_end > self.max_end:
+                self.max_end = child.max_end
+
+
+def _rotate_right(node):
+    top = node.left
+    node.left, top.right = top.right, node
+    node.update()
+    top.update()
+    return top
+
+
+def _rotate_left(node):
+    top = node.right
+    node.right, top.left = top.left, node
+    node.update()
+    top.update()
+    return top
+
+
+def _insert(node, new):
+    if node is None:
+        return new
+    if new.key < node.key:
+        node.left = _insert(node.left, new)
+        if node.left.priority > node.priority:
+            return _rotate_right(node)
+    else:
+        node.right = _insert(node.right, new)
+        if node.right.priority > node.priority:
+            return _rotate_left(node)
+    node.update()
+    return node
+
+
+def _delete(node, key):
+    if node is None:
+        return None
+    if key < node.key:
+        node.left = _delete(node.left, key)
+    elif key > node.key:
+        node.right = _delete(node.right, key)
+    elif node.left is None:
+        return node.right
+    elif node.right is None:
+        return node.left
+    elif node.left.priority > node.right.priority:
+        node = _rotate_right(node)
+        node.right = _delete(node.right, key)
+    else:
+        node = _rotate_left(node)
+        node.left = _delete(node.left, key)
+    node.update()
+    return node
+
+
+def _overlapping(node, start, end):
+    """Nodes overlapping ``[start, end)``, by departure."""
+    # 子树里最晚的落地时间不晚于 start 时整棵子树都可以跳过
+    while node is not None and node.max_end > start:
+        yield from _overlapping(node.left, start, end)
+        if node.start >= end:
+            return
+        if node.end > start:
+            yield node
+        node = node.right
+
+
+class Timeline:
+    """Flights of one aircraft in an interval tree keyed by departure."""
+
+    def __init__(self):
+        self.root = None
+        self.starts = {}  # flight_num -> departure, to find a flight's node
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, flight_num):
+        self.remove(flight_num)
+        self.starts[flight_num] = start
+        self.root = _insert(self.root, _Node(start, end, flight_num))
+
+    def remove(self, flight_num):
+        start = self.starts.pop(flight_num, None)
+        if start is None:
+            return None
+        self.root = _delete(self.root, (start, flight_num))
+        return flight_num
+
+    def conflict(self, start, end, ignore=None):
+        """flight_num of a flight overlapping ``[start, end)``, or None."""
+        for node in _overlapping(self.root, start, end):
+            if node.flight_num != ignore:
+                return node.flight_num
+        return None
+
+
+class AircraftSchedule:
+    def __init__(self):
+        self._airlines = {}  # airline_name -> (loaded_at, {airplane_id: Timeline})
+        self._lock = threading.Lock()
+
+    def _load(self, airline_name):
+        cursor = get_db().cursor()
+        try:
+            cursor.execute(LOAD_QUERY, (airline_name,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        planes = {}
+        for row in rows:
+            planes.setdefault(row['airplane_id'], Timeline()).add(
+                row['departure_time'], row['arrival_time'], row['flight_num'])
+        return planes
+
+    def _planes(self, airline_name):
+        ttl = current_app.config.get('AIRCRAFT_INDEX_TTL', 600)
+        with self._lock:
+            entry = self._airlines.get(airline_name)
+        if entry is not None and time.monotonic() - entry[0] <= ttl:
+            return entry[1]
+        planes = self._load(airline_name)
+        with self._lock:
+            self._airlines[airline_name] = (time.monotonic(), planes)
+        return planes
+
+    # ---- 查询 ----
+
+    def conflict(self, airline_name, airplane_id, start, end, ignore=None):
+        """flight_num of a flight the aircraft flies during ``[start, end)``, or None."""
+        planes = self._planes(airline_name)
+        with self._lock:
+            timeline = planes.get(int(airplane_id))
+            return timeline.conflict(start, end, ignore) if timeline else None
+
+    def free_airplanes(self, airline_name, airplane_ids, start, end):
+        """The given aircraft that are not flying during ``[start, end)``."""
+        planes = self._planes(airline_name)
+        with self._lock:
+            return [airplane_id for airplane_id in airplane_ids
+                    if airplane_id not in planes
+                    or planes[airplane_id].conflict(start, end) is None]
+
+    def batch(self, airline_name):
+        """A ``BatchCheck`` for many new flights of the airline."""
+        return BatchCheck(self, airline_name)
+
+    # ---- 维护 ----
+
+    def add_flight(self, flight):
+        """Add a committed flight; airlines not loaded yet will read it when loaded."""
+        if is_cancelled(flight.get('status')) or flight['arrival_time'] < datetime.now():
+            return
+        with self._lock:
+            entry = self._airlines.get(flight['airline_name'])
+            if entry is not None:
+                entry[1].setdefault(int(flight['airplane_id']), Timeline()).add(
+                    flight['departure_time'], flight['arrival_time'], int(flight['flight_num']))
+
+    def add_flights(self, flights):
+        for flight in flights:
+            self.add_flight(flight)
+
+    def remove_flight(self, airline_name, flight_num):
+        with self._lock:
+            entry = self._airlines.get(airline_name)
+            if entry is not None:
+                for timeline in entry[1].values():
+                    if timeline.remove(int(flight_num)) is not None:
+                        return
+
+    def set_status(self, airline_name, flight_num, status, flight=None):
+        """Cancelled flights free their aircraft; ``flight`` re-adds one that is not."""
+        if is_cancelled(status):
+            self.remove_flight(airline_name, flight_num)
+        elif flight is not None:
+            self.remove_flight(airline_name, flight_num)
+            self.add_flight(dict(flight, status=status))
+
+    def invalidate(self, airline_name=None):
+        with self._lock:
+            if airline_name is None:
+                self._airlines.clear()
+            else:
+                self._airlines.pop(airline_name, None)
+
+    def stats(self):
+        with self._lock:
+            return {'airlines': len(self._airlines),
+                    'aircraft': sum(len(planes) for _, planes in self._airlines.values()),
+                    'flights': sum(len(timeline) for _, planes in self._airlines.values()
+                                   for timeline in planes.values())}
+
+
+class BatchCheck:
+    """Conflict checks for a batch of new flights, against the index and each other."""
+
+    def __init__(self, schedule, airline_name):
+        self.schedule = schedule
+        self.airline_name = airline_name
+        self.pending = {}  # airplane_id -> Timeline of accepted flights in this batch
+
+    def check(self, flight):
+        """flight_num the new flight collides with, or None (then it is accepted)."""
+        airplane_id = int(flight['airplane_id'])
+        start, end = flight['departure_time'], flight['arrival_time']
+        clash = self.schedule.conflict(self.airline_name, airplane_id, start, end)
+        if clash is None and airplane_id in self.pending:
+            clash = self.pending[airplane_id].conflict(start, end)
+        if clash is None:
+            self.pending.setdefault(airplane_id, Timeline()).add(start, end,
+                                                                 flight['flight_num'])
+        return clash
+
+
+aircraft_schedule = AircraftSchedule()
@@ -0,0 +1,80 @@
+"""In-memory airport catalog.
+
+The airport table is small and changes rarely, so it is loaded once into an
+``airport_name -> airport_city`` dict and every route resolves city names
+from it instead of querying ``airport`` per flight. ``staff.add_airport``
+adds new airports after its transaction commits; other worker processes
+pick them up when their copy expires (``AIRPORT_CACHE_TTL`` seconds).
+"""
+import threading
+import time
+
+from flask import current_app
+
+from app.database import get_db
+
+
+class AirportCatalog:
+    def __init__(self):
+        self._cities = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _expired(self):
+        ttl = current_app.config.get('AIRPORT_CACHE_TTL', 300)
+        return time.monotonic() - self._loaded_at > ttl
+
+    def _load(self):
+        cursor = get_db().cursor()
+        try:
+            cursor.execute("SELECT airport_name, airport_city FROM airport")
+            return {row['airport_name']: row['airport_city'] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def cities(self):
+        """Return the ``airport_name -> airport_city`` dict (do not modify it)."""
+        cities = self._cities
+        if cities is None or self._expired():
+            with self._lock:
+                if self._cities is None or self._expired():
+                    self._cities = self._load()
+                    self._loaded_at = time.monotonic()
+                # 在锁内取出: 之后并发的 invalidate() 只会清空字段, 不影响这次的结果
+                cities = self._cities
+        return cities
+
+    def city(self, airport_name):
+        return self.cities().get(airport_name, '')
+
+    def match(self, term, cities=True):
+        """Airports whose name (or city) contains ``term``, case-insensitively.
+
+        Returns a frozenset of airport names, or None when ``term`` is empty,
+        meaning any airport.
+        """
+        term = term.strip().lower()
+        if not term:
+            return None
+        return frozenset(name for name, city in self.cities().items()
+                         if term in name.lower() or (cities and term in city.lower()))
+
+    def airports(self):
+        """All airports as ``[{'name': ..., 'city': ...}]``, sorted by city."""
+        return [{'name': name, 'city': city}
+                for name, city in sorted(self.cities().items(), key=lambda item: item[1])]
+
+    def add(self, airport_name, airport_city):
+        with self._lock:
+            if self._cities is not None:
+                # 复制后替换, 读取方无需加锁
+                cities = dict(self._cities)
+                cities[airport_name] = airport_city
+                self._cities = cities
+
+    def invalidate(self):
+        with self._lock:
+            self._cities = None
+
+
+airport_catalog = AirportCatalog()
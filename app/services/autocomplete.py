@@ -0,0 +1,138 @@
+"""Airport autocomplete served from memory.
+
+``/airports/search`` is hit on every keystroke. Instead of running
+``ILIKE '%term%'`` against the airport table, the airports in the catalog
+(see ``services.airports``) are indexed twice:
+
+* a prefix trie over the airport name, the city and each word of the city,
+  which answers the common "start typing" case;
+* a trigram index (``pg_trgm`` style), which finds infix matches and
+  near misses such as typos once the term has three or more characters.
+
+Shorter terms that are not a prefix (``"ng"`` in ``"Shanghai"``) are found
+by scanning the catalog for the substring, as the old ``ILIKE`` did; the
+catalog only holds a few hundred airports.
+
+The index follows the catalog: when the catalog gains an airport (for
+example after ``staff.add_airport``) only the new airports are inserted.
+"""
+import threading
+from collections import defaultdict
+
+from app.services.airports import airport_catalog
+
+# 排名: 数值越小越靠前
+EXACT, NAME_PREFIX, CITY_PREFIX, INFIX, FUZZY = range(5)
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(text):
+    """Trigrams of each word, padded like pg_trgm (two spaces before, one after)."""
+    grams = set()
+    for word in text.lower().split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class AirportAutocomplete:
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._indexed_source = None
+        self._cities = {}
+        self._trie = {}
+        self._trigrams = defaultdict(set)
+        self._gram_counts = {}
+        self._lock = threading.Lock()
+
+    def _keys(self, name, city):
+        keys = {name.lower(), city.lower()}
+        keys.update(city.lower().split())
+        return keys
+
+    def _add(self, name, city):
+        self._cities[name] = city
+        for key in self._keys(name, city):
+            node = self._trie
+            for char in key:
+                node = node.setdefault(char, {})
+                node.setdefault('', set()).add(name)
+        grams = trigrams(name) | trigrams(city)
+        self._gram_counts[name] = len(grams)
+        for gram in grams:
+            self._trigrams[gram].add(name)
+
+    def _sync(self):
+        """Bring the index in line with the catalog (called with the lock held)."""
+        source = self._catalog.cities()
+        if source is self._indexed_source:
+            return
+        changed = any(source.get(name) != city for name, city in self._cities.items())
+        if changed:
+            # 机场被删除或城市被修改: 整体重建
+            self._cities, self._trie = {}, {}
+            self._trigrams, self._gram_counts = defaultdict(set), {}
+        for name, city in source.items():
+            if name not in self._cities:
+                self._add(name, city)
+        self._indexed_source = source
+
+    def _prefix_matches(self, term):
+        node = self._trie
+        for char in term:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get('', set())
+
+    def _rank(self, name, term, similarity):
+        lowered_name = name.lower()
+        city = self._cities[name].lower()
+        if term in (lowered_name, city):
+            return EXACT, 0.0
+        if lowered_name.startswith(term):
+            return NAME_PREFIX, 0.0
+        if city.startswith(term) or any(word.startswith(term) for word in city.split()):
+            return CITY_PREFIX, 0.0
+        if term in lowered_name or term in city:
+            return INFIX, -similarity
+        return FUZZY, -similarity
+
+    def search(self, term, limit=10):
+        """Return up to ``limit`` airport names matching ``term``, best first."""
+        term = ' '.join(term.lower().split())
+        with self._lock:
+            self._sync()
+            if not term:
+                names = sorted(self._cities, key=lambda n: (self._cities[n], n))
+                return names[:limit]
+
+            candidates = dict.fromkeys(self._prefix_matches(term), 0.0)
+            term_grams = trigrams(term)
+            if len(term) >= 3 and term_grams:
+                shared = defaultdict(int)
+                for gram in term_grams:
+                    for name in self._trigrams.get(gram, ()):
+                        shared[name] += 1
+                for name, count in shared.items():
+                    # Jaccard 相似度
+                    similarity = count / (len(term_grams) + self._gram_counts[name] - count)
+                    infix = term in name.lower() or term in self._cities[name].lower()
+                    if infix or similarity >= MIN_SIMILARITY or name in candidates:
+                        candidates[name] = similarity
+            else:
+                # 一两个字符的中间匹配: trie 只管前缀, 直接扫描整个目录
+                for name, city in self._cities.items():
+                    if name not in candidates and (term in name.lower() or term in city.lower()):
+                        candidates[name] = 0.0
+
+            ranked = sorted(candidates,
+                            key=lambda n: (*self._rank(n, term, candidates[n]),
+                                           self._cities[n], n))
+            return ranked[:limit]
+
+    def label(self, name):
+        return f"{self._cities.get(name, '')} ({name})"
+
+
+airport_autocomplete = AirportAutocomplete(airport_catalog)
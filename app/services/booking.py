@@ -0,0 +1,116 @@
+"""Ticket sales shared by the customer and booking agent purchase pages.
+
+Seat availability lives in ``flight.remaining_seats``. A sale decrements it
+with a single conditional UPDATE, which locks the flight row until the
+request transaction commits, so two buyers can never take the last seat and
+no sale needs to count the ``ticket`` table. Search pages read the same
+counter for whole result sets with ``remaining_seats``.
+
+The purchase pages call ``sell_ticket``, which runs ``book_ticket`` again
+once if InnoDB picks the sale as a deadlock victim (two flights of the same
+route and day selling out at the same moment, see ``fares.seat_taken``).
+"""
+import pymysql
+
+from app.database import after_commit
+from app.services import commissions, fares, sales, spending
+from app.services.heavy_hitters import heavy_hitters
+
+ER_LOCK_DEADLOCK = 1213
+
+
+def remaining_seats(cursor, flights):
+    """Seats left on many flights, read in one primary key lookup.
+
+    ``flights`` is an iterable of ``(airline_name, flight_num)``; returns a
+    dict keyed the same way (flights that no longer exist are missing).
+    """
+    keys = sorted({(airline_name, int(flight_num)) for airline_name, flight_num in flights})
+    if not keys:
+        return {}
+    cursor.execute(f"""
+        SELECT airline_name, flight_num, remaining_seats
+        FROM flight
+        WHERE (airline_name, flight_num) IN ({', '.join(['(%s, %s)'] * len(keys))})
+    """, tuple(value for key in keys for value in key))
+    return {(row['airline_name'], row['flight_num']): row['remaining_seats']
+            for row in cursor.fetchall()}
+
+
+def reserve_seat(cursor, airline_name, flight_num):
+    """Take one seat on the flight. Returns False if it is sold out."""
+    cursor.execute("""
+        UPDATE flight
+        SET remaining_seats = remaining_seats - 1
+        WHERE airline_name = %s AND flight_num = %s AND remaining_seats > 0
+    """, (airline_name, flight_num))
+    return cursor.rowcount == 1
+
+
+def book_ticket(cursor, airline_name, flight_num, customer_email, booking_agent_id=None):
+    """Sell one ticket on the flight to ``customer_email``.
+
+    The seat, the ticket, the purchase and the rollup rows are written in
+    the caller's transaction; the top-K sketches count the sale once it
+    commits. Returns the new ticket_id, or None if the
+    flight is full.
+    """
+    if not reserve_seat(cursor, airline_name, flight_num):
+        return None
+
+    # 航班行已被上面的 UPDATE 锁住; 一次读出各汇总表需要的字段和购买日期
+    cursor.execute("""
+        SELECT f.airline_name, f.flight_num, f.departure_airport, f.arrival_airport,
+               arr.airport_city AS arrival_city,
+               DATE(f.departure_time) AS flight_date, f.price, f.remaining_seats,
+               a.commission_rate, CURDATE() AS today
+        FROM flight f
+        JOIN airline a ON a.airline_name = f.airline_name
+        JOIN airport arr ON arr.airport_name = f.arrival_airport
+        WHERE f.airline_name = %s AND f.flight_num = %s
+    """, (airline_name, flight_num))
+    flight = cursor.fetchone()
+    fares.seat_taken(cursor, flight)
+
+    # ticket_id 由 AUTO_INCREMENT 分配, 并发售票不会争用同一个编号
+    cursor.execute("""
+        INSERT INTO ticket (airline_name, flight_num)
+        VALUES (%s, %s)
+    """, (airline_name, flight_num))
+    ticket_id = cursor.lastrowid
+
+    cursor.execute("""
+        INSERT INTO purchases (ticket_id, customer_email, booking_agent_id, purchase_date)
+        VALUES (%s, %s, %s, %s)
+    """, (ticket_id, customer_email, booking_agent_id, flight['today']))
+
+    sales.record_sale(cursor, flight, flight['today'], booking_agent_id)
+    spending.record_spending(cursor, customer_email, flight['today'], flight['price'])
+    commission = None
+    if booking_agent_id is not None:
+        commission = commissions.record_commission(cursor, flight, ticket_id, customer_email,
+                                                   booking_agent_id, flight['today'])
+    after_commit(lambda: heavy_hitters.record_sale(flight, customer_email,
+                                                   booking_agent_id, commission))
+    return ticket_id
+
+
+def sell_ticket(connection, airline_name, flight_num, customer_email, booking_agent_id=None):
+    """``book_ticket`` in the request transaction, retried once after a deadlock.
+
+    InnoDB rolls back the whole transaction of a deadlock victim, so the sale
+    must be the first write of the request; the second attempt waits for the
+    other sale to commit and then goes through.
+    """
+    for attempt in range(2):
+        # rollback() 之后要用新的游标
+        cursor = connection.cursor()
+        try:
+            return book_ticket(cursor, airline_name, flight_num, customer_email,
+                               booking_agent_id)
+        except pymysql.err.OperationalError as e:
+            if e.args[0] != ER_LOCK_DEADLOCK or attempt:
+                raise
+            connection.rollback()
+        finally:
+            cursor.close()
@@ -0,0 +1,133 @@
+"""Booking agent commission ledger and its pre-summed views.
+
+Every ticket sold by an agent gets an ``agent_commission`` row holding the
+price and the airline's ``commission_rate`` at booking time, so later rate
+changes do not rewrite past earnings. Two aggregates are kept next to it in
+the same transaction:
+
+* ``agent_commission_daily`` -- tickets and commission per agent and day,
+  for the agent dashboard and commission report;
+* ``agent_customer_daily`` -- the same per agent, customer and day, which
+  seeds the agents' top customer sketches (``heavy_hitters``).
+
+``flask --app run rollups rebuild`` adds ledger rows for agent purchases
+that have none (at the airline's current rate) and recomputes both
+aggregates from the ledger.
+"""
+import calendar
+from decimal import Decimal, ROUND_HALF_UP
+
+SUMMARY_QUERY = """
+    SELECT COALESCE(SUM(tickets), 0) as tickets_count,
+           COALESCE(SUM(commission), 0) as total_commission,
+           ROUND(SUM(commission) / SUM(tickets), 2) as avg_commission
+    FROM agent_commission_daily
+    WHERE booking_agent_id = %s AND sale_date BETWEEN %s AND %s
+"""
+
+DAILY_QUERY = """
+    SELECT sale_date as date, tickets, commission
+    FROM agent_commission_daily
+    WHERE booking_agent_id = %s AND sale_date BETWEEN %s AND %s
+    ORDER BY sale_date
+"""
+
+
+def months_ago(day, months):
+    """``day`` minus whole months, like MySQL ``DATE_SUB(day, INTERVAL n MONTH)``."""
+    month = day.month - months - 1
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return day.replace(year=year, month=month,
+                       day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def record_commission(cursor, flight, ticket_id, customer_email, booking_agent_id, sale_date):
+    """Record the commission on one agent sale.
+
+    ``flight`` is the booked flight row with ``price`` and ``commission_rate``.
+    Returns the commission.
+    """
+    # 与 backfill 的 MySQL ROUND() 一致: 四舍五入, 不是 round() 的银行家舍入
+    commission = (Decimal(flight['price']) * Decimal(flight['commission_rate'])).quantize(
+        Decimal('0.01'), rounding=ROUND_HALF_UP)
+    cursor.execute("""
+        INSERT INTO agent_commission
+            (ticket_id, booking_agent_id, customer_email, airline_name,
+             sale_date, price, rate, commission)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (ticket_id, booking_agent_id, customer_email, flight['airline_name'],
+          sale_date, flight['price'], flight['commission_rate'], commission))
+    cursor.execute("""
+        INSERT INTO agent_commission_daily (booking_agent_id, sale_date, tickets, commission)
+        VALUES (%s, %s, 1, %s)
+        ON DUPLICATE KEY UPDATE
+            tickets = tickets + 1,
+            commission = commission + VALUES(commission)
+    """, (booking_agent_id, sale_date, commission))
+    cursor.execute("""
+        INSERT INTO agent_customer_daily
+            (booking_agent_id, customer_email, sale_date, tickets, commission)
+        VALUES (%s, %s, %s, 1, %s)
+        ON DUPLICATE KEY UPDATE
+            tickets = tickets + 1,
+            commission = commission + VALUES(commission)
+    """, (booking_agent_id, customer_email, sale_date, commission))
+    return commission
+
+
+def backfill_ledger(cursor):
+    """Add ledger rows for agent purchases that have none."""
+    cursor.execute("""
+        INSERT INTO agent_commission
+            (ticket_id, booking_agent_id, customer_email, airline_name,
+             sale_date, price, rate, commission)
+        SELECT p.ticket_id, p.booking_agent_id, p.customer_email, t.airline_name,
+               p.purchase_date, f.price, a.commission_rate,
+               ROUND(f.price * a.commission_rate, 2)
+        FROM purchases p
+        JOIN ticket t ON p.ticket_id = t.ticket_id
+        JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
+        JOIN airline a ON a.airline_name = t.airline_name
+        LEFT JOIN agent_commission ac ON ac.ticket_id = p.ticket_id
+        WHERE p.booking_agent_id IS NOT NULL AND ac.ticket_id IS NULL
+    """)
+    return cursor.rowcount
+
+
+def rebuild_daily(cursor):
+    """Recompute ``agent_commission_daily`` from the ledger."""
+    cursor.execute("DELETE FROM agent_commission_daily")
+    cursor.execute("""
+        INSERT INTO agent_commission_daily (booking_agent_id, sale_date, tickets, commission)
+        SELECT booking_agent_id, sale_date, COUNT(*), SUM(commission)
+        FROM agent_commission
+        GROUP BY booking_agent_id, sale_date
+    """)
+    return cursor.rowcount
+
+
+def rebuild_customer_daily(cursor):
+    """Recompute ``agent_customer_daily`` from the ledger."""
+    cursor.execute("DELETE FROM agent_customer_daily")
+    cursor.execute("""
+        INSERT INTO agent_customer_daily
+            (booking_agent_id, customer_email, sale_date, tickets, commission)
+        SELECT booking_agent_id, customer_email, sale_date, COUNT(*), SUM(commission)
+        FROM agent_commission
+        GROUP BY booking_agent_id, customer_email, sale_date
+    """)
+    return cursor.rowcount
+
+
+def summary(cursor, booking_agent_id, start_date, end_date):
+    """Tickets, total and average commission between two dates (inclusive)."""
+    cursor.execute(SUMMARY_QUERY, (booking_agent_id, start_date, end_date))
+    return cursor.fetchone()
+
+
+def daily(cursor, booking_agent_id, start_date, end_date):
+    """``[{date, tickets, commission}]`` for each day with sales, in order."""
+    cursor.execute(DAILY_QUERY, (booking_agent_id, start_date, end_date))
+    return cursor.fetchall()
+
@@ -0,0 +1,164 @@
+"""Per-route daily fare aggregate behind the low-fare calendar.
+
+``route_daily_fare`` has one row per (departure airport, arrival airport,
+departure date) with the lowest price among flights that still have seats,
+the seats left across all of them and the number of flights. Cancelled
+flights are left out.
+
+The row is kept current in the writer's transaction:
+
+* ``staff.create_flight`` / ``staff.change_status`` recompute the day with
+  ``refresh_route_day``;
+* the schedule import adds whole batches of new flights with
+  ``flights_added``;
+* every sale (``booking.book_ticket``) calls ``seat_taken``, which
+  decrements ``seats_left``, or recomputes the day under the flight row
+  locks when the flight sells out (``booking.sell_ticket`` retries a sale
+  that loses a deadlock to another sell-out).
+
+``flask --app run rollups rebuild`` recomputes the whole table.
+"""
+from datetime import timedelta
+
+_DAY_TOTALS = """
+    SELECT MIN(CASE WHEN remaining_seats > 0 THEN price END) AS min_price,
+           COALESCE(SUM(remaining_seats), 0) AS seats_left,
+           COUNT(*) AS flights
+    FROM flight
+    WHERE departure_airport = %s AND arrival_airport = %s
+    AND departure_time >= %s AND departure_time < %s
+    AND status <> 'cancelled'
+"""
+
+
+# {sources} / {destinations}: 每个机场一个 %s
+FARE_CALENDAR_QUERY = """
+    SELECT flight_date, MIN(min_price) AS min_price,
+           SUM(seats_left) AS seats_left, SUM(flights) AS flights
+    FROM route_daily_fare
+    WHERE departure_airport IN ({sources})
+    AND arrival_airport IN ({destinations})
+    AND flight_date BETWEEN %s AND %s
+    GROUP BY flight_date
+"""
+
+
+def refresh_route_day(cursor, departure_airport, arrival_airport, day):
+    """Recompute the aggregate row for one route and departure date."""
+    # 先锁 flight 行, 再写 route_daily_fare 行, 与售票的加锁顺序一致
+    cursor.execute(_DAY_TOTALS + " FOR UPDATE",
+                   (departure_airport, arrival_airport, day, day + timedelta(days=1)))
+    totals = cursor.fetchone()
+    if not totals['flights']:
+        cursor.execute("""
+            DELETE FROM route_daily_fare
+            WHERE departure_airport = %s AND arrival_airport = %s AND flight_date = %s
+        """, (departure_airport, arrival_airport, day))
+        return
+    cursor.execute("""
+        INSERT INTO route_daily_fare
+            (departure_airport, arrival_airport, flight_date, min_price, seats_left, flights)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            min_price = VALUES(min_price),
+            seats_left = VALUES(seats_left),
+            flights = VALUES(flights)
+    """, (departure_airport, arrival_airport, day,
+          totals['min_price'], totals['seats_left'], totals['flights']))
+
+
+def flights_added(cursor, flights):
+    """Add newly inserted flights to their days, one upsert per route and day.
+
+    ``flights`` are dicts with the airports, ``departure_time``, ``price``,
+    ``remaining_seats`` and ``status``.
+    """
+    days = {}
+    for flight in flights:
+        if flight['status'].lower() == 'cancelled':
+            continue
+        key = (flight['departure_airport'], flight['arrival_airport'],
+               flight['departure_time'].date())
+        price = flight['price'] if flight['remaining_seats'] > 0 else None
+        min_price, seats_left, count = days.get(key, (None, 0, 0))
+        if price is not None and (min_price is None or price < min_price):
+            min_price = price
+        days[key] = (min_price, seats_left + flight['remaining_seats'], count + 1)
+    if not days:
+        return
+    # LEAST() 遇到 NULL 返回 NULL, 所以用 COALESCE 兜底
+    cursor.executemany("""
+        INSERT INTO route_daily_fare
+            (departure_airport, arrival_airport, flight_date, min_price, seats_left, flights)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            min_price = COALESCE(LEAST(min_price, VALUES(min_price)),
+                                 min_price, VALUES(min_price)),
+            seats_left = seats_left + VALUES(seats_left),
+            flights = flights + VALUES(flights)
+    """, [key + totals for key, totals in sorted(days.items())])
+
+
+def seat_taken(cursor, flight):
+    """Account for one seat sold on the flight (after ``reserve_seat``).
+
+    ``flight`` has the departure/arrival airports, ``flight_date`` and the
+    ``remaining_seats`` left after the sale.
+    """
+    if flight['remaining_seats'] > 0:
+        cursor.execute("""
+            UPDATE route_daily_fare
+            SET seats_left = GREATEST(seats_left - 1, 0)
+            WHERE departure_airport = %s AND arrival_airport = %s AND flight_date = %s
+        """, (flight['departure_airport'], flight['arrival_airport'], flight['flight_date']))
+        return
+
+    # 航班售罄: 最低价换成当天其它仍有座位的航班. 非锁定读用的是本事务
+    # 较早的快照, 可能看不到刚提交的其它售罄, 所以像 refresh_route_day 一样
+    # 先锁当天的 flight 行再写 route_daily_fare 行 (与售票的加锁顺序一致).
+    # 两个售罄互相等待对方的航班行时, 被 InnoDB 回滚的那笔由
+    # booking.sell_ticket 重新执行一次.
+    refresh_route_day(cursor, flight['departure_airport'], flight['arrival_airport'],
+                      flight['flight_date'])
+
+
+def rebuild(cursor):
+    """Recompute ``route_daily_fare`` from the flight table."""
+    cursor.execute("DELETE FROM route_daily_fare")
+    cursor.execute("""
+        INSERT INTO route_daily_fare
+            (departure_airport, arrival_airport, flight_date, min_price, seats_left, flights)
+        SELECT departure_airport, arrival_airport, DATE(departure_time),
+               MIN(CASE WHEN remaining_seats > 0 THEN price END),
+               SUM(remaining_seats), COUNT(*)
+        FROM flight
+        WHERE status <> 'cancelled'
+        GROUP BY departure_airport, arrival_airport, DATE(departure_time)
+    """)
+    return cursor.rowcount
+
+
+def fare_calendar(cursor, sources, destinations, first_day, days):
+    """Lowest fare and seats left for each of ``days`` days from ``first_day``.
+
+    ``sources`` / ``destinations`` are sets of airport names; days without
+    flights are included with ``min_price`` None.
+    """
+    last_day = first_day + timedelta(days=days - 1)
+    sources, destinations = sorted(sources), sorted(destinations)
+    query = FARE_CALENDAR_QUERY.format(sources=', '.join(['%s'] * len(sources)),
+                                       destinations=', '.join(['%s'] * len(destinations)))
+    cursor.execute(query, tuple(sources) + tuple(destinations) + (first_day, last_day))
+    by_day = {row['flight_date']: row for row in cursor.fetchall()}
+
+    calendar = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        row = by_day.get(day)
+        calendar.append({
+            'date': day.strftime('%Y-%m-%d'),
+            'min_price': float(row['min_price']) if row and row['min_price'] is not None else None,
+            'seats_left': int(row['seats_left']) if row else 0,
+            'flights': int(row['flights']) if row else 0,
+        })
+    return calendar
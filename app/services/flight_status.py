@@ -0,0 +1,167 @@
+"""Bulk flight status changes with delay propagation (``staff.change_status_bulk``).
+
+The flights to change are picked by number or by an airport and a time
+window (flights departing from or arriving at the airport in the window;
+cancelled flights are left out, only picking one by number changes it).
+All of them get the new status in one transaction. With a delay, their
+departure and arrival move later by that many minutes, and the delay is
+passed down each airplane's schedule: a later flight of the same airplane
+that would now leave before the previous flight has landed (plus
+``AIRCRAFT_MIN_TURNAROUND_MINUTES``) is moved just enough to fit and
+marked ``Delayed``. The chain stops at the first flight with enough slack.
+"""
+from datetime import timedelta
+
+from app.services import fares
+from app.services.aircraft_schedule import is_cancelled
+
+DELAYED = 'Delayed'
+
+_COLUMNS = """airline_name, flight_num, departure_airport, arrival_airport,
+              departure_time, arrival_time, airplane_id, status"""
+
+# {airplanes}: 每架飞机一个 %s
+CHAINS_QUERY = f"""
+    SELECT {_COLUMNS}
+    FROM flight
+    WHERE airline_name = %s
+    AND airplane_id IN ({{airplanes}})
+    AND departure_time >= %s
+    AND status <> 'cancelled'
+    ORDER BY airplane_id, departure_time
+    FOR UPDATE
+"""
+
+
+def select_flights(cursor, airline_name, flight_nums=None, airport=None,
+                   window_start=None, window_end=None):
+    """Lock and return the flights to change, by number or by airport and window.
+
+    The window skips cancelled flights: a hub-wide delay must not un-cancel
+    them.
+    """
+    if flight_nums:
+        flight_nums = sorted({int(flight_num) for flight_num in flight_nums})
+        cursor.execute(f"""
+            SELECT {_COLUMNS}
+            FROM flight
+            WHERE airline_name = %s
+            AND flight_num IN ({', '.join(['%s'] * len(flight_nums))})
+            ORDER BY departure_time
+            FOR UPDATE
+        """, (airline_name, *flight_nums))
+    else:
+        cursor.execute(f"""
+            SELECT {_COLUMNS}
+            FROM flight
+            WHERE airline_name = %s
+            AND ((departure_airport = %s AND departure_time BETWEEN %s AND %s)
+                 OR (arrival_airport = %s AND arrival_time BETWEEN %s AND %s))
+            AND status <> 'cancelled'
+            ORDER BY departure_time
+            FOR UPDATE
+        """, (airline_name, airport, window_start, window_end,
+              airport, window_start, window_end))
+    return cursor.fetchall()
+
+
+def propagate(chain, delayed, delay, turnaround):
+    """New times for one airplane's flights (sorted by departure).
+
+    ``delayed`` is the set of flight_nums moved by ``delay``. Returns
+    ``{flight_num: (departure_time, arrival_time, propagated)}`` for every
+    flight that moves.
+    """
+    moved = {}
+    ready_at = None  # 上一个航班落地 (加最短过站时间) 的时刻
+    for flight in chain:
+        departure, arrival = flight['departure_time'], flight['arrival_time']
+        shift = delay if flight['flight_num'] in delayed else timedelta(0)
+        if ready_at is not None and departure + shift < ready_at:
+            shift = ready_at - departure
+        if shift:
+            departure, arrival = departure + shift, arrival + shift
+            moved[flight['flight_num']] = (departure, arrival,
+                                           flight['flight_num'] not in delayed)
+        ready_at = arrival + turnaround
+    return moved
+
+
+def _airplane_chains(cursor, airline_name, airplane_ids, since):
+    """Not cancelled flights of the airplanes departing from ``since`` on, locked."""
+    airplane_ids = sorted(airplane_ids)
+    cursor.execute(CHAINS_QUERY.format(airplanes=', '.join(['%s'] * len(airplane_ids))),
+                   (airline_name, *airplane_ids, since))
+    chains = {}
+    for row in cursor.fetchall():
+        chains.setdefault(row['airplane_id'], []).append(row)
+    return chains
+
+
+def apply(cursor, flights, status, delay_minutes=0, turnaround_minutes=0):
+    """Set ``status`` on the locked ``flights`` and move delayed schedules.
+
+    Returns ``(summary, changes)``; ``changes`` is a list of
+    ``(old flight row, new flight dict)`` for every row written.
+    """
+    changes = {}
+    for flight in flights:
+        changes[flight['flight_num']] = (flight, dict(flight, status=status))
+
+    propagated = []
+    if flights and delay_minutes > 0 and not is_cancelled(status):
+        airline_name = flights[0]['airline_name']
+        delayed = {flight['flight_num'] for flight in flights
+                   if not is_cancelled(flight['status'])}
+        since = min(flight['departure_time'] for flight in flights)
+        chains = _airplane_chains(cursor, airline_name,
+                                  {flight['airplane_id'] for flight in flights}, since)
+        for chain in chains.values():
+            moved = propagate(chain, delayed, timedelta(minutes=delay_minutes),
+                              timedelta(minutes=turnaround_minutes))
+            for flight in chain:
+                if flight['flight_num'] not in moved:
+                    continue
+                departure, arrival, downstream = moved[flight['flight_num']]
+                old, new = changes.get(flight['flight_num'], (flight, dict(flight)))
+                new.update(departure_time=departure, arrival_time=arrival)
+                if downstream:
+                    new['status'] = DELAYED
+                    propagated.append({
+                        'flight_num': flight['flight_num'],
+                        'airplane_id': flight['airplane_id'],
+                        'shift_minutes': int((departure - flight['departure_time'])
+                                             .total_seconds() // 60),
+                        'departure_time': departure.isoformat(),
+                    })
+                changes[flight['flight_num']] = (old, new)
+
+    if changes:
+        cursor.executemany("""
+            UPDATE flight
+            SET status = %s, departure_time = %s, arrival_time = %s
+            WHERE airline_name = %s AND flight_num = %s
+        """, [(new['status'], new['departure_time'], new['arrival_time'],
+               new['airline_name'], new['flight_num'])
+              for _, new in (changes[flight_num] for flight_num in sorted(changes))])
+
+    # 航班改时间可能换了日期, 新旧两天都要重算
+    route_days = set()
+    for old, new in changes.values():
+        route_days.add((old['departure_airport'], old['arrival_airport'],
+                        old['departure_time'].date()))
+        route_days.add((new['departure_airport'], new['arrival_airport'],
+                        new['departure_time'].date()))
+    for departure_airport, arrival_airport, day in sorted(route_days):
+        fares.refresh_route_day(cursor, departure_airport, arrival_airport, day)
+
+    summary = {
+        'status': status,
+        'updated': len(flights),
+        'delay_minutes': delay_minutes,
+        'flights': [flight['flight_num'] for flight in flights],
+        'propagated': propagated,
+        'airplanes': len({flight['airplane_id'] for flight in flights}),
+        'route_days_refreshed': len(route_days),
+    }
+    return summary, list(changes.values())
@@ -0,0 +1,172 @@
+"""Recurring flight templates expanded into dated ``flight`` rows.
+
+A ``flight_template`` row describes a flight that operates on some weekdays
+(``weekdays`` is a bit mask, bit 0 = Monday) between ``valid_from`` and
+``valid_until``: route, departure time of day, duration, airplane and price.
+Each dated flight it generates gets its own ``flight_num`` (the flight
+table's key) and a ``flight_template_instance`` row linking it back.
+
+``generated_until`` is the last date already expanded. ``extend`` only
+generates the dates after it, up to the horizon, and moves it forward in
+the same transaction, so materialized flights are never generated again.
+``flask --app run schedule extend`` extends every template to
+``FLIGHT_TEMPLATE_HORIZON_DAYS`` from today and is meant to run daily.
+"""
+from datetime import date, datetime, timedelta
+
+from app.services.aircraft_schedule import locked_conflicts
+from app.services.schedule_import import insert_flights
+
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def weekday_mask(weekdays):
+    """Bit mask from weekday numbers (0 = Monday)."""
+    mask = 0
+    for weekday in weekdays:
+        mask |= 1 << int(weekday)
+    return mask
+
+
+def weekday_names(mask):
+    return ', '.join(name for bit, name in enumerate(WEEKDAY_NAMES) if mask & (1 << bit))
+
+
+def occurrence_dates(template, first_day, last_day):
+    """Dates between the two days (inclusive) on which the template operates."""
+    first_day = max(first_day, template['valid_from'])
+    last_day = min(last_day, template['valid_until'])
+    days = []
+    day = first_day
+    while day <= last_day:
+        if template['weekdays'] & (1 << day.weekday()):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def create_template(cursor, template):
+    """Insert a template (a dict of the table's columns). Returns its id."""
+    cursor.execute("""
+        INSERT INTO flight_template (
+            airline_name, departure_airport, arrival_airport, weekdays,
+            departure_clock, duration_minutes, valid_from, valid_until,
+            airplane_id, price
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (template['airline_name'], template['departure_airport'],
+          template['arrival_airport'], template['weekdays'], template['departure_clock'],
+          template['duration_minutes'], template['valid_from'], template['valid_until'],
+          template['airplane_id'], template['price']))
+    return cursor.lastrowid
+
+
+def _next_flight_num(cursor, airline_name):
+    # 锁住航空公司行, 同时扩展的模板依次分配航班号
+    cursor.execute("SELECT airline_name FROM airline WHERE airline_name = %s FOR UPDATE",
+                   (airline_name,))
+    cursor.execute("SELECT COALESCE(MAX(flight_num), 0) + 1 AS next_num "
+                   "FROM flight WHERE airline_name = %s", (airline_name,))
+    return cursor.fetchone()['next_num']
+
+
+def extend(cursor, template_id, through, today=None, check=None):
+    """Generate the template's flights after ``generated_until`` up to ``through``.
+
+    Dates before today are skipped. ``check(flight)`` (see
+    ``aircraft_schedule.BatchCheck``) returns the flight_num an airplane
+    would be double-booked with; if it finds none, the flights are also
+    checked against the database with the airplane row locked. Any clash
+    raises ValueError before anything is written. Returns the new flight
+    dicts.
+    """
+    cursor.execute("""
+        SELECT t.*, a.seats
+        FROM flight_template t
+        JOIN airplane a ON a.airline_name = t.airline_name AND a.airplane_id = t.airplane_id
+        WHERE t.template_id = %s
+        FOR UPDATE
+    """, (template_id,))
+    template = cursor.fetchone()
+    if template is None:
+        return []
+    through = min(through, template['valid_until'])
+    if template['generated_until'] is not None and template['generated_until'] >= through:
+        return []
+
+    first_day = today or date.today()
+    if template['generated_until'] is not None:
+        first_day = max(first_day, template['generated_until'] + timedelta(days=1))
+    days = occurrence_dates(template, first_day, through)
+
+    flights = []
+    if days:
+        flight_num = _next_flight_num(cursor, template['airline_name'])
+        # TIME 列读出来是 timedelta (自零点起)
+        duration = timedelta(minutes=template['duration_minutes'])
+        for offset, day in enumerate(days):
+            departure_time = datetime.combine(day, datetime.min.time()) + template['departure_clock']
+            flights.append({
+                'airline_name': template['airline_name'], 'flight_num': flight_num + offset,
+                'departure_airport': template['departure_airport'],
+                'departure_time': departure_time,
+                'arrival_airport': template['arrival_airport'],
+                'arrival_time': departure_time + duration,
+                'price': template['price'], 'status': 'Upcoming',
+                'airplane_id': template['airplane_id'], 'remaining_seats': template['seats'],
+            })
+        clashes = []
+        if check is not None:
+            for flight in flights:
+                clash = check(flight)
+                if clash is not None:
+                    clashes.append((flight['departure_time'], clash))
+        if not clashes:
+            # 内存索引可能还没看到其他进程的航班, 锁住飞机行后用数据库确认
+            in_db = locked_conflicts(cursor, template['airline_name'], flights)
+            clashes = [(flight['departure_time'], in_db[flight['flight_num']])
+                       for flight in flights if flight['flight_num'] in in_db]
+        if clashes:
+            raise ValueError(f"Airplane {template['airplane_id']} is already flying "
+                             + ', '.join(f'flight {clash} on {start:%Y-%m-%d}'
+                                         for start, clash in clashes[:5])
+                             + (' ...' if len(clashes) > 5 else ''))
+        insert_flights(cursor, flights)
+        cursor.executemany("""
+            INSERT INTO flight_template_instance (template_id, flight_date, airline_name, flight_num)
+            VALUES (%s, %s, %s, %s)
+        """, [(template_id, flight['departure_time'].date(), flight['airline_name'],
+               flight['flight_num']) for flight in flights])
+
+    cursor.execute("UPDATE flight_template SET generated_until = %s WHERE template_id = %s",
+                   (through, template_id))
+    return flights
+
+
+def due_templates(cursor, through, airline_name=None):
+    """Templates (id, airline) that still have dates to generate up to ``through``."""
+    query = """
+        SELECT template_id, airline_name
+        FROM flight_template
+        WHERE valid_until >= CURDATE()
+        AND (generated_until IS NULL OR generated_until < LEAST(valid_until, %s))
+    """
+    params = [through]
+    if airline_name is not None:
+        query += " AND airline_name = %s"
+        params.append(airline_name)
+    cursor.execute(query + " ORDER BY template_id", tuple(params))
+    return cursor.fetchall()
+
+
+def templates(cursor, airline_name):
+    """The airline's templates with the number of flights generated so far."""
+    cursor.execute("""
+        SELECT t.*, COUNT(i.flight_num) AS flights
+        FROM flight_template t
+        LEFT JOIN flight_template_instance i ON i.template_id = t.template_id
+        WHERE t.airline_name = %s
+        GROUP BY t.template_id
+        ORDER BY t.valid_from, t.template_id
+    """, (airline_name,))
+    return cursor.fetchall()
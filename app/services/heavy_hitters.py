@@ -0,0 +1,351 @@
+"""Streaming top-K ("heavy hitter") counters for the top destinations and
+top customers widgets.
+
+Each stream counts items (an arrival airport, a customer email, ...) per
+key (an airline or a booking agent) in Space-Saving sketches of at most
+``HEAVY_HITTER_CAPACITY`` items. A sketch's counts are exact while it has
+seen no more distinct items than that, otherwise every count is an
+over-estimate by at most the reported ``error``.
+
+For every (stream, key) there is one sketch per day and one per window
+start date that has been read (e.g. "3 months ago"). ``add`` updates the
+day and every window that covers the day, so a widget reads one sketch
+of ``HEAVY_HITTER_CAPACITY`` items. A window sketch is merged from the day
+sketches when a start date is first read, which is once a day per widget
+as the window slides.
+
+The sketches of a key are seeded from the database on first use (one
+GROUP BY over the last ``HEAVY_HITTER_WINDOW_MONTHS`` months) and from
+then on only follow ``add``: ``booking.book_ticket`` adds each sale after
+its transaction commits. Sales added while a key is being seeded are
+dropped, since the seeding query may already have counted them. With
+several worker processes, set ``HEAVY_HITTER_TTL`` to reseed every so
+many seconds and pick up the other processes' sales.
+
+``exact_top`` runs the same seeding query and counts exactly; ``audit``
+compares it with the sketch (``/staff/top_k_audit``).
+"""
+import threading
+import time
+from collections import namedtuple
+from datetime import date
+
+from flask import current_app
+
+from app.database import get_db
+from app.services.airports import airport_catalog
+from app.services.commissions import months_ago
+
+Stream = namedtuple('Stream', ['key', 'query'])
+
+# 每个查询返回 (day, item, weight) 行, 参数为 (key, 起始日期)
+STREAMS = {
+    # 航空公司: 按购买日期统计到达机场 (staff.dashboard)
+    'destinations': Stream('airline', """
+        SELECT p.purchase_date as day, f.arrival_airport as item, COUNT(*) as weight
+        FROM flight f
+        JOIN ticket t ON f.airline_name = t.airline_name AND f.flight_num = t.flight_num
+        JOIN purchases p ON t.ticket_id = p.ticket_id
+        WHERE f.airline_name = %s AND p.purchase_date >= %s
+        GROUP BY p.purchase_date, f.arrival_airport
+    """),
+    # 航空公司: 按起飞日期统计到达城市 (staff.view_reports)
+    'destination_cities': Stream('airline', """
+        SELECT DATE(f.departure_time) as day, a.airport_city as item, COUNT(*) as weight
+        FROM ticket t
+        JOIN flight f ON t.flight_num = f.flight_num AND t.airline_name = f.airline_name
+        JOIN airport a ON f.arrival_airport = a.airport_name
+        WHERE t.airline_name = %s AND f.departure_time >= %s
+        GROUP BY DATE(f.departure_time), a.airport_city
+    """),
+    # 航空公司: 按购买日期统计客户 (staff.view_customers)
+    'customers': Stream('airline', """
+        SELECT p.purchase_date as day, p.customer_email as item, COUNT(*) as weight
+        FROM purchases p
+        JOIN ticket t ON p.ticket_id = t.ticket_id
+        WHERE t.airline_name = %s AND p.purchase_date >= %s
+        GROUP BY p.purchase_date, p.customer_email
+    """),
+    # 代理: 客户的票数和佣金 (agent.dashboard, agent.top_customers)
+    'agent_tickets': Stream('agent', """
+        SELECT sale_date as day, customer_email as item, tickets as weight
+        FROM agent_customer_daily
+        WHERE booking_agent_id = %s AND sale_date >= %s
+    """),
+    'agent_commission': Stream('agent', """
+        SELECT sale_date as day, customer_email as item, commission as weight
+        FROM agent_customer_daily
+        WHERE booking_agent_id = %s AND sale_date >= %s
+    """),
+}
+
+
+class SpaceSaving:
+    """Space-Saving summary of at most ``capacity`` items.
+
+    A new item arriving when the summary is full replaces the item with the
+    smallest count and inherits that count as its error.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}  # item -> count (never below the true count)
+        self.errors = {}  # item -> how much of count may be over-estimated
+
+    @classmethod
+    def merged(cls, capacity, counts, errors):
+        """A summary of the ``capacity`` largest of already merged counts."""
+        summary = cls(capacity)
+        for item in sorted(counts, key=lambda item: (-counts[item], item))[:capacity]:
+            summary.counts[item] = counts[item]
+            summary.errors[item] = errors[item]
+        return summary
+
+    @property
+    def full(self):
+        return len(self.counts) >= self.capacity
+
+    def min_count(self):
+        return min(self.counts.values()) if self.full else 0
+
+    def add(self, item, weight=1):
+        if item in self.counts:
+            self.counts[item] += weight
+            return
+        if not self.full:
+            self.counts[item] = weight
+            self.errors[item] = 0
+            return
+        victim = min(self.counts, key=self.counts.get)
+        floor = self.counts.pop(victim)
+        del self.errors[victim]
+        self.counts[item] = floor + weight
+        self.errors[item] = floor
+
+    def top(self, k):
+        ordered = sorted(self.counts, key=lambda item: (-self.counts[item], item))[:k]
+        return [(item, self.counts[item], self.errors[item]) for item in ordered]
+
+
+class WindowedTopK:
+    """Day sketches, and a sketch per window start date kept current by ``add``."""
+
+    def __init__(self, capacity, months):
+        self.capacity = capacity
+        self.months = months
+        self.days = {}     # day -> SpaceSaving
+        self.windows = {}  # since -> (built_on, SpaceSaving)
+
+    def add(self, day, item, weight=1):
+        sketch = self.days.get(day)
+        if sketch is None:
+            sketch = self.days[day] = SpaceSaving(self.capacity)
+        sketch.add(item, weight)
+        for since, (_, window) in self.windows.items():
+            if day >= since:
+                window.add(item, weight)
+
+    def _build(self, since):
+        """Merge the day sketches on or after ``since`` into a window sketch."""
+        today = date.today()
+        # 窗口随日期滑动: 前一天建的窗口不会再被读到
+        self.windows = {start: entry for start, entry in self.windows.items()
+                        if entry[0] == today}
+        retention = months_ago(today, self.months)
+        self.days = {day: sketch for day, sketch in self.days.items() if day >= retention}
+
+        counts, errors, floors = {}, {}, []
+        for day, sketch in self.days.items():
+            if day < since:
+                continue
+            for item, count in sketch.counts.items():
+                counts[item] = counts.get(item, 0) + count
+                errors[item] = errors.get(item, 0) + sketch.errors[item]
+            if sketch.full:
+                floors.append((sketch.min_count(), sketch.counts))
+        # 已满的某天 sketch 里没有的项, 当天的真实计数最多是该 sketch 的最小计数
+        for floor, day_counts in floors:
+            for item in counts:
+                if item not in day_counts:
+                    errors[item] += floor
+        window = SpaceSaving.merged(self.capacity, counts, errors)
+        self.windows[since] = (today, window)
+        return window
+
+    def top(self, since, k):
+        """``[(item, count, error)]`` for the ``k`` largest counts on or after ``since``."""
+        entry = self.windows.get(since)
+        window = entry[1] if entry is not None else self._build(since)
+        return window.top(k)
+
+
+class HeavyHitters:
+    def __init__(self):
+        self._windows = {}  # (stream, key) -> (loaded_at, WindowedTopK)
+        self._loading = {}  # (stream, key) -> 正在加载的线程数
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.loads = 0
+        self.updates = 0
+        self.dropped = 0
+
+    @staticmethod
+    def retention_start(today=None):
+        months = current_app.config.get('HEAVY_HITTER_WINDOW_MONTHS', 12)
+        return months_ago(today or date.today(), months)
+
+    def _load(self, stream, key):
+        window = WindowedTopK(current_app.config.get('HEAVY_HITTER_CAPACITY', 64),
+                              current_app.config.get('HEAVY_HITTER_WINDOW_MONTHS', 12))
+        cursor = get_db().cursor()
+        try:
+            cursor.execute(STREAMS[stream].query, (key, self.retention_start()))
+            for row in cursor.fetchall():
+                window.add(row['day'], row['item'], row['weight'])
+        finally:
+            cursor.close()
+        return window
+
+    def _window(self, stream, key):
+        ttl = current_app.config.get('HEAVY_HITTER_TTL')
+        stream_key = (stream, key)
+        with self._lock:
+            entry = self._windows.get(stream_key)
+            if entry is not None and (ttl is None or time.monotonic() - entry[0] <= ttl):
+                return entry[1]
+            # 加载期间到达的 add 会被丢弃, 避免与加载查询重复计数
+            self._loading[stream_key] = self._loading.get(stream_key, 0) + 1
+            generation = self._generation
+        try:
+            window = self._load(stream, key)
+        finally:
+            with self._lock:
+                self._loading[stream_key] -= 1
+                if not self._loading[stream_key]:
+                    del self._loading[stream_key]
+        with self._lock:
+            # 加载期间被 invalidate 的结果不保存, 下次读取重新加载
+            if generation == self._generation:
+                self._windows[stream_key] = (time.monotonic(), window)
+            self.loads += 1
+        return window
+
+    def top(self, stream, key, since, k):
+        """``[(item, count, error)]`` of the stream for ``key`` since a date."""
+        window = self._window(stream, key)
+        with self._lock:
+            self.reads += 1
+            return window.top(since, k)
+
+    def add(self, stream, key, day, item, weight=1):
+        """Count a committed event; keys not loaded yet will read it when seeded."""
+        with self._lock:
+            if (stream, key) in self._loading:
+                self.dropped += 1
+                return
+            entry = self._windows.get((stream, key))
+            if entry is not None:
+                entry[1].add(day, item, weight)
+                self.updates += 1
+
+    def record_sale(self, flight, customer_email, booking_agent_id=None, commission=None):
+        """Count one sold ticket. ``flight`` is the row read by ``book_ticket``."""
+        airline = flight['airline_name']
+        self.add('destinations', airline, flight['today'], flight['arrival_airport'])
+        self.add('destination_cities', airline, flight['flight_date'], flight['arrival_city'])
+        self.add('customers', airline, flight['today'], customer_email)
+        if booking_agent_id is not None:
+            self.add('agent_tickets', booking_agent_id, flight['today'], customer_email)
+            self.add('agent_commission', booking_agent_id, flight['today'], customer_email,
+                     commission)
+
+    def invalidate(self, stream=None, key=None):
+        """Drop sketches so they are reloaded (all of them by default)."""
+        with self._lock:
+            self._generation += 1
+            for stream_key in list(self._windows):
+                if stream in (None, stream_key[0]) and key in (None, stream_key[1]):
+                    del self._windows[stream_key]
+
+    def stats(self):
+        with self._lock:
+            return {'sketches': len(self._windows),
+                    'days': sum(len(window.days) for _, window in self._windows.values()),
+                    'windows': sum(len(window.windows) for _, window in self._windows.values()),
+                    'reads': self.reads, 'loads': self.loads, 'updates': self.updates,
+                    'dropped': self.dropped}
+
+
+heavy_hitters = HeavyHitters()
+
+
+def exact_top(cursor, stream, key, since, k):
+    """Exact ``[(item, count, 0)]``, recomputed from the source tables."""
+    cursor.execute(STREAMS[stream].query, (key, since))
+    counts = {}
+    for row in cursor.fetchall():
+        counts[row['item']] = counts.get(row['item'], 0) + row['weight']
+    ordered = sorted(counts, key=lambda item: (-counts[item], item))[:k]
+    return [(item, counts[item], 0) for item in ordered]
+
+
+def audit(cursor, stream, key, since, k):
+    """Sketch and exact top-``k`` side by side."""
+    sketch = heavy_hitters.top(stream, key, since, k)
+    exact = exact_top(cursor, stream, key, since, k)
+    return {'stream': stream, 'key': key, 'since': since.isoformat(),
+            'sketch': [{'item': item, 'count': count, 'error': error}
+                       for item, count, error in sketch],
+            'exact': [{'item': item, 'count': count} for item, count, _ in exact],
+            'match': [item for item, _, _ in sketch] == [item for item, _, _ in exact]}
+
+
+# ---- 页面使用的形状 ----
+
+def top_destinations(airline_name, since, k):
+    """``[{arrival_airport, airport_city, frequency}]`` by tickets bought since a date."""
+    return [{'arrival_airport': airport, 'airport_city': airport_catalog.city(airport),
+             'frequency': count}
+            for airport, count, _ in heavy_hitters.top('destinations', airline_name, since, k)]
+
+
+def top_destination_cities(airline_name, since, k):
+    """``[{airport_city, count}]`` by tickets on flights departing since a date."""
+    return [{'airport_city': city, 'count': count}
+            for city, count, _ in heavy_hitters.top('destination_cities', airline_name, since, k)]
+
+
+def with_customer_names(cursor, rows):
+    """Add ``name`` to rows keyed by ``email`` with one primary key lookup."""
+    if not rows:
+        return rows
+    emails = [row['email'] for row in rows]
+    cursor.execute(f"""
+        SELECT email, name FROM customer
+        WHERE email IN ({', '.join(['%s'] * len(emails))})
+    """, tuple(emails))
+    names = {row['email']: row['name'] for row in cursor.fetchall()}
+    for row in rows:
+        row['name'] = names.get(row['email'], row['email'])
+    return rows
+
+
+def top_customers(cursor, airline_name, since, k):
+    """``[{email, name, flights_count}]`` by tickets bought from the airline."""
+    rows = [{'email': email, 'flights_count': count}
+            for email, count, _ in heavy_hitters.top('customers', airline_name, since, k)]
+    return with_customer_names(cursor, rows)
+
+
+def agent_top_customers(cursor, booking_agent_id, since, order_by='tickets', limit=5):
+    """The agent's top customers since ``since``, best first.
+
+    Returns up to ``limit`` dicts ``{email, name, tickets}``, or
+    ``{email, name, commission}`` when ``order_by`` is ``'commission'``.
+    """
+    stream, column = (('agent_commission', 'commission') if order_by == 'commission'
+                      else ('agent_tickets', 'tickets'))
+    rows = [{'email': email, column: count}
+            for email, count, _ in heavy_hitters.top(stream, booking_agent_id, since, limit)]
+    return with_customer_names(cursor, rows)
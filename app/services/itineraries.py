@@ -0,0 +1,223 @@
+"""Connecting itinerary search over an in-memory flight index.
+
+The index holds every upcoming, not cancelled flight within
+``ITINERARY_HORIZON_DAYS``, grouped by departure airport and sorted by
+departure time. Together with the layover rules this is a time-expanded
+route graph: a flight arriving at X at time t connects to every flight
+leaving X between ``t + min_layover`` and ``t + max_layover``, which is a
+bisect on X's departure list.
+
+``search`` runs a best-first search over partial itineraries ordered by
+total price (or total travel time). Both only grow as legs are added, so
+the first ``limit`` itineraries that reach the destination are the
+cheapest (or fastest) ones.
+
+``staff.create_flight`` and ``staff.change_status`` update the index after
+commit by swapping in updated copies, so a search reads one consistent
+version without holding the lock. The whole index is reloaded every ``ITINERARY_INDEX_TTL`` seconds
+so other worker processes' changes are picked up too.
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from flask import current_app
+
+from app.database import get_db
+
+Leg = namedtuple('Leg', ['airline_name', 'flight_num', 'departure_airport', 'departure_time',
+                         'arrival_airport', 'arrival_time', 'price'])
+
+
+def is_cancelled(status):
+    return (status or '').lower() == 'cancelled'
+
+
+def _insert(legs, departures, flight):
+    leg = Leg(flight['airline_name'], int(flight['flight_num']),
+              flight['departure_airport'], flight['departure_time'],
+              flight['arrival_airport'], flight['arrival_time'], float(flight['price']))
+    key = (leg.airline_name, leg.flight_num)
+    legs[key] = leg
+    bisect.insort(departures.setdefault(leg.departure_airport, []), (leg.departure_time, *key))
+
+
+class FlightIndex:
+    def __init__(self):
+        # 写时复制: 更新时换成新的 dict / list, 不修改已有的,
+        # 这样搜索拿到引用后可以在锁外进行
+        self._legs = {}        # (airline_name, flight_num) -> Leg
+        self._departures = {}  # airport -> sorted [(departure_time, airline_name, flight_num)]
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    # ---- 维护 ----
+
+    def _load(self):
+        horizon = current_app.config.get('ITINERARY_HORIZON_DAYS', 60)
+        cursor = get_db().cursor()
+        try:
+            cursor.execute("""
+                SELECT airline_name, flight_num, departure_airport, departure_time,
+                       arrival_airport, arrival_time, price, status
+                FROM flight
+                WHERE departure_time >= NOW()
+                AND departure_time < DATE_ADD(NOW(), INTERVAL %s DAY)
+            """, (horizon,))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        legs, departures = {}, {}
+        for row in rows:
+            if not is_cancelled(row['status']):
+                _insert(legs, departures, row)
+        self._legs, self._departures = legs, departures
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        ttl = current_app.config.get('ITINERARY_INDEX_TTL', 600)
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > ttl:
+            self._load()
+
+    def _replace(self, airline_name, flight_num, flight=None):
+        """Swap in copies without the flight, plus ``flight`` if given."""
+        legs, departures = dict(self._legs), dict(self._departures)
+        old = legs.pop((airline_name, int(flight_num)), None)
+        if old is not None:
+            entry = (old.departure_time, old.airline_name, old.flight_num)
+            departures[old.departure_airport] = [
+                departure for departure in departures[old.departure_airport]
+                if departure != entry]
+        if flight is not None:
+            airport = flight['departure_airport']
+            departures[airport] = list(departures.get(airport, ()))
+            _insert(legs, departures, flight)
+        self._legs, self._departures = legs, departures
+
+    def add_flight(self, flight):
+        """Add (or replace) a flight given as a dict of flight columns."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._replace(flight['airline_name'], flight['flight_num'],
+                          None if is_cancelled(flight.get('status')) else flight)
+
+    def set_status(self, airline_name, flight_num, status):
+        """Drop a flight that was cancelled; other statuses keep it bookable.
+
+        A flight that is not indexed and is no longer cancelled may have
+        been un-cancelled, so the index is reloaded on the next search.
+        """
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if is_cancelled(status):
+                if (airline_name, int(flight_num)) in self._legs:
+                    self._replace(airline_name, flight_num)
+            elif (airline_name, int(flight_num)) not in self._legs:
+                self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def reload(self):
+        """Reload now, e.g. after a bulk change, so no search pays for it."""
+        with self._lock:
+            self._load()
+
+    # ---- 查询 ----
+
+    def search(self, sources, destinations, window_start, window_end, sort='price',
+               max_legs=3, min_layover=timedelta(minutes=45),
+               max_layover=timedelta(hours=12), limit=5, connecting_only=False):
+        """Cheapest (``sort='price'``) or fastest (``sort='duration'``) itineraries.
+
+        The first leg leaves one of ``sources`` between ``window_start`` and
+        ``window_end``; the last arrives at one of ``destinations``. With
+        ``connecting_only`` direct flights are skipped and do not count
+        towards ``limit``. Returns lists of ``Leg``.
+        """
+        def cost(legs):
+            if sort == 'duration':
+                return (legs[-1].arrival_time - legs[0].departure_time).total_seconds()
+            return sum(leg.price for leg in legs)
+
+        def connections(leg):
+            departures = by_airport.get(leg.arrival_airport, ())
+            earliest = leg.arrival_time + min_layover
+            latest = leg.arrival_time + max_layover
+            start = bisect.bisect_left(departures, (earliest,))
+            for departure_time, airline_name, flight_num in departures[start:]:
+                if departure_time > latest:
+                    break
+                yield by_key[(airline_name, flight_num)]
+
+        # 只在锁内取当前版本的引用, 搜索本身不持锁
+        with self._lock:
+            self._ensure_loaded()
+            by_key, by_airport = self._legs, self._departures
+
+        heap = []
+        counter = 0
+        for source in sources:
+            departures = by_airport.get(source, ())
+            start = bisect.bisect_left(departures, (window_start,))
+            for departure_time, airline_name, flight_num in departures[start:]:
+                if departure_time > window_end:
+                    break
+                leg = by_key[(airline_name, flight_num)]
+                if connecting_only and leg.arrival_airport in destinations:
+                    continue
+                legs = (leg,)
+                heapq.heappush(heap, (cost(legs), counter, legs))
+                counter += 1
+
+        results = []
+        expanded = {}
+        while heap and len(results) < limit:
+            _, _, legs = heapq.heappop(heap)
+            last = legs[-1]
+            if last.arrival_airport in destinations:
+                results.append(list(legs))
+                continue
+            # 同一航班最多展开 limit 次 (第 k 短路径)
+            key = (last.airline_name, last.flight_num)
+            if len(legs) >= max_legs or expanded.get(key, 0) >= limit:
+                continue
+            expanded[key] = expanded.get(key, 0) + 1
+            visited = {leg.departure_airport for leg in legs}
+            for leg in connections(last):
+                if leg.arrival_airport in visited:
+                    continue
+                extended = legs + (leg,)
+                heapq.heappush(heap, (cost(extended), counter, extended))
+                counter += 1
+        return results
+
+
+flight_index = FlightIndex()
+
+
+def itinerary_dict(legs):
+    """JSON/template friendly form of an itinerary."""
+    departure, arrival = legs[0].departure_time, legs[-1].arrival_time
+    return {
+        'legs': [{
+            'airline': leg.airline_name,
+            'flight_number': leg.flight_num,
+            'departure_airport': leg.departure_airport,
+            'departure_time': leg.departure_time.strftime('%Y-%m-%d %H:%M'),
+            'arrival_airport': leg.arrival_airport,
+            'arrival_time': leg.arrival_time.strftime('%Y-%m-%d %H:%M'),
+            'price': leg.price,
+        } for leg in legs],
+        'stops': len(legs) - 1,
+        'total_price': sum(leg.price for leg in legs),
+        'departure_time': departure.strftime('%Y-%m-%d %H:%M'),
+        'arrival_time': arrival.strftime('%Y-%m-%d %H:%M'),
+        'duration_minutes': int((arrival - departure).total_seconds() // 60),
+    }
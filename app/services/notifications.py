@@ -0,0 +1,410 @@
+"""Passenger notifications when a flight is delayed or cancelled.
+
+``staff.change_status`` and ``staff.change_status_bulk`` call ``enqueue``
+in their own transaction, so a ``notification_job`` row exists exactly when
+the status change is committed, and wake the worker after the commit. The
+AJAX request never waits for the sends.
+
+The worker is a daemon thread per web process (started on the first
+request, see ``init_app``). It claims one job at a time, streams the
+flight's ticket holders (``purchases`` joined with ``ticket``, one message
+per customer) with a server-side cursor on a connection of its own, renders
+them ``NOTIFICATION_BATCH_SIZE`` at a time and hands each batch to the sink
+under a token bucket (``NOTIFICATION_RATE_PER_SECOND``). A batch that fails
+is retried with exponential backoff; after each delivered batch the job
+records the last customer email, so a job that fails or whose process dies
+continues after that customer. Failed jobs run again later, up to
+``NOTIFICATION_MAX_ATTEMPTS`` times; a ``running`` job that has not
+recorded progress for ``NOTIFICATION_STALE_MINUTES`` is claimed again. A
+message may be sent twice when a batch fails half way, never skipped.
+
+The sink is picked by ``NOTIFICATION_SINK``: ``file`` appends JSON lines to
+``NOTIFICATION_FILE`` (for development and tests), ``smtp`` sends through
+``NOTIFICATION_SMTP_HOST``/``PORT`` (e.g. a local stub such as
+``python -m aiosmtpd -n -l localhost:1025``). More sinks can be added to
+``SINKS``. ``flask --app run notifications run`` processes the due jobs once,
+e.g. from cron when the in-process worker is disabled.
+"""
+import json
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from email.message import EmailMessage
+
+import pymysql.cursors
+from flask import current_app
+
+from app import database
+from app.models import db
+
+NOTIFY_STATUSES = ('delayed', 'cancelled')
+
+Message = namedtuple('Message', ['to', 'subject', 'body'])
+
+# 待处理, 或者 running 太久 (进程挂了) 的任务都可以领取
+_CLAIMABLE = """
+    ((state = 'pending' AND run_after <= NOW())
+     OR (state = 'running' AND started_at < NOW() - INTERVAL %s MINUTE))
+"""
+
+CLAIM_QUERY = f"""
+    SELECT job_id FROM notification_job
+    WHERE {_CLAIMABLE}
+    ORDER BY job_id
+    LIMIT 5
+"""
+
+HOLDERS_QUERY = """
+    SELECT p.customer_email, c.name, COUNT(*) AS tickets
+    FROM ticket t
+    JOIN purchases p ON p.ticket_id = t.ticket_id
+    JOIN customer c ON c.email = p.customer_email
+    WHERE t.airline_name = %s AND t.flight_num = %s AND p.customer_email > %s
+    GROUP BY p.customer_email, c.name
+    ORDER BY p.customer_email
+"""
+
+
+def notifies(status):
+    return (status or '').lower() in NOTIFY_STATUSES
+
+
+def enqueue(cursor, flights):
+    """Queue a job for each flight dict whose ``status`` passengers must hear about.
+
+    Runs in the caller's transaction. Returns the number of jobs queued.
+    """
+    jobs = [(flight['airline_name'], flight['flight_num'], flight['status'])
+            for flight in flights if notifies(flight['status'])]
+    if jobs:
+        cursor.executemany("""
+            INSERT INTO notification_job (airline_name, flight_num, flight_status,
+                                          run_after, created_at)
+            VALUES (%s, %s, %s, NOW(), NOW())
+        """, jobs)
+    return len(jobs)
+
+
+def queue_counts(cursor, airline_name=None):
+    """``state -> jobs`` (of one airline, or all)."""
+    query = "SELECT state, COUNT(*) AS jobs FROM notification_job"
+    params = ()
+    if airline_name is not None:
+        query += " WHERE airline_name = %s"
+        params = (airline_name,)
+    cursor.execute(query + " GROUP BY state", params)
+    return {row['state']: row['jobs'] for row in cursor.fetchall()}
+
+
+# ---- 消息 ----
+
+def render(flight, status, holder):
+    if status.lower() == 'cancelled':
+        news = 'has been cancelled. Please contact the airline to rebook or for a refund.'
+    else:
+        news = (f"is delayed. It is now scheduled to depart "
+                f"{flight['departure_time']:%Y-%m-%d %H:%M} and arrive "
+                f"{flight['arrival_time']:%Y-%m-%d %H:%M}.")
+    tickets = f" ({holder['tickets']} tickets)" if holder['tickets'] > 1 else ''
+    body = (f"Dear {holder['name']},\n\n"
+            f"Flight {flight['airline_name']} {flight['flight_num']} from "
+            f"{flight['departure_airport']} to {flight['arrival_airport']}{tickets} {news}\n")
+    return Message(holder['customer_email'],
+                   f"Flight {flight['airline_name']} {flight['flight_num']} {status.lower()}",
+                   body)
+
+
+class FileSink:
+    """Appends each message as a JSON line; for development and tests."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps(message._asdict()) + '\n')
+
+
+class SMTPSink:
+    """One SMTP connection per batch."""
+
+    def __init__(self, host, port, sender, timeout=10):
+        self.host, self.port, self.sender, self.timeout = host, port, sender, timeout
+
+    def send(self, messages):
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message.to
+                email['Subject'] = message.subject
+                email.set_content(message.body)
+                smtp.send_message(email)
+
+
+SINKS = {
+    'file': lambda config: FileSink(config.get('NOTIFICATION_FILE', 'notifications.jsonl')),
+    'smtp': lambda config: SMTPSink(config.get('NOTIFICATION_SMTP_HOST', 'localhost'),
+                                    config.get('NOTIFICATION_SMTP_PORT', 1025),
+                                    config.get('NOTIFICATION_SENDER', 'noreply@localhost'),
+                                    config.get('NOTIFICATION_SMTP_TIMEOUT', 10)),
+}
+
+
+def make_sink(config):
+    name = config.get('NOTIFICATION_SINK', 'file')
+    if name not in SINKS:
+        raise ValueError(f"unknown NOTIFICATION_SINK {name!r}; choose from {', '.join(SINKS)}")
+    return SINKS[name](config)
+
+
+class TokenBucket:
+    """``rate`` messages per second on average, bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst):
+        self.rate, self.burst = float(rate), float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """Take ``count`` tokens, sleeping as long as needed. Returns the seconds slept."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # 可以透支: 一批比 burst 大时先发, 按欠下的令牌等待
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+# ---- 后台处理 ----
+
+class Notifier:
+    def __init__(self):
+        self._app = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._bucket = None
+        self._metrics = {'jobs_done': 0, 'jobs_retried': 0, 'jobs_failed': 0,
+                         'jobs_superseded': 0, 'messages_sent': 0, 'messages_failed': 0,
+                         'send_retries': 0, 'throttled_seconds': 0.0}
+        self._last_job = None
+
+    def init_app(self, app):
+        self._app = app
+        if app.config.get('NOTIFICATION_WORKER', True):
+            app.before_request(self.start)
+
+    def start(self):
+        """Start the worker thread of this process if it is not running."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name='notifications',
+                                                daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Called after a commit that queued jobs."""
+        if self._app is not None and self._app.config.get('NOTIFICATION_WORKER', True):
+            self.start()
+            self._wakeup.set()
+
+    def _work(self):
+        # 没人唤醒时也定期查一遍: 重试时间到了的任务, 其他进程排下的任务
+        poll = self._app.config.get('NOTIFICATION_POLL_SECONDS', 30)
+        while True:
+            try:
+                with self._app.app_context():
+                    self.run_due()
+            except Exception:
+                self._app.logger.exception('Notification worker failed')
+            self._wakeup.wait(poll)
+            self._wakeup.clear()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._metrics[name] += amount
+
+    def _rate_limiter(self):
+        config = current_app.config
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = TokenBucket(config.get('NOTIFICATION_RATE_PER_SECOND', 20),
+                                           config.get('NOTIFICATION_BATCH_SIZE', 100))
+            return self._bucket
+
+    def run_due(self, limit=None):
+        """Process due jobs until none is left (or ``limit`` jobs). Returns the count."""
+        processed = 0
+        while limit is None or processed < limit:
+            job = self.claim()
+            if job is None:
+                break
+            self.process(job)
+            processed += 1
+        return processed
+
+    def claim(self):
+        """Mark the oldest claimable job ``running`` and return it, or None."""
+        stale = current_app.config.get('NOTIFICATION_STALE_MINUTES', 10)
+        cursor = database.get_db().cursor()
+        try:
+            cursor.execute(CLAIM_QUERY, (stale,))
+            for row in cursor.fetchall():
+                # 条件更新: 其他进程先领走了就 rowcount = 0
+                cursor.execute(f"""
+                    UPDATE notification_job
+                    SET state = 'running', started_at = NOW(), attempts = attempts + 1
+                    WHERE job_id = %s AND {_CLAIMABLE}
+                """, (row['job_id'], stale))
+                if cursor.rowcount == 1:
+                    cursor.execute("SELECT * FROM notification_job WHERE job_id = %s",
+                                   (row['job_id'],))
+                    job = cursor.fetchone()
+                    database.commit()
+                    return job
+            database.commit()
+            return None
+        finally:
+            cursor.close()
+
+    def process(self, job):
+        """Deliver one claimed job and record the outcome."""
+        started = time.monotonic()
+        sent = 0
+        try:
+            sent = self._deliver_job(job)
+        except Exception as e:
+            current_app.logger.exception('Notification job %s failed', job['job_id'])
+            database.get_db().rollback()
+            self._failed(job, e)
+            return
+        finally:
+            with self._lock:
+                self._last_job = {'job_id': job['job_id'], 'sent': sent,
+                                  'seconds': round(time.monotonic() - started, 3)}
+        cursor = database.get_db().cursor()
+        try:
+            cursor.execute("""
+                UPDATE notification_job
+                SET state = 'done', finished_at = NOW(), last_error = NULL
+                WHERE job_id = %s
+            """, (job['job_id'],))
+            database.commit()
+        finally:
+            cursor.close()
+        self._count('jobs_done')
+
+    def _failed(self, job, error):
+        config = current_app.config
+        give_up = job['attempts'] >= config.get('NOTIFICATION_MAX_ATTEMPTS', 5)
+        backoff = config.get('NOTIFICATION_JOB_RETRY_MINUTES', 1) * 60 * 2 ** (job['attempts'] - 1)
+        cursor = database.get_db().cursor()
+        try:
+            cursor.execute("""
+                UPDATE notification_job
+                SET state = %s, run_after = NOW() + INTERVAL %s SECOND,
+                    finished_at = IF(%s, NOW(), NULL), last_error = %s
+                WHERE job_id = %s
+            """, ('failed' if give_up else 'pending', int(backoff), give_up,
+                  str(error)[:255], job['job_id']))
+            database.commit()
+        finally:
+            cursor.close()
+        self._count('jobs_failed' if give_up else 'jobs_retried')
+
+    def _deliver_job(self, job):
+        config = current_app.config
+        cursor = database.get_db().cursor()
+        try:
+            cursor.execute("""
+                SELECT airline_name, flight_num, departure_airport, arrival_airport,
+                       departure_time, arrival_time, status
+                FROM flight
+                WHERE airline_name = %s AND flight_num = %s
+            """, (job['airline_name'], job['flight_num']))
+            flight = cursor.fetchone()
+        finally:
+            cursor.close()
+        if flight is None or flight['status'].lower() != job['flight_status'].lower():
+            # 之后状态又改了 (例如延误后恢复), 这条通知已过时
+            self._count('jobs_superseded')
+            return 0
+
+        sink = make_sink(config)
+        batch_size = config.get('NOTIFICATION_BATCH_SIZE', 100)
+        sent = 0
+        # 单独的连接做服务器端游标: 边读边发, 同时在 session 的连接上记录进度
+        connection = db.engine.raw_connection()
+        try:
+            stream = connection.cursor(pymysql.cursors.SSDictCursor)
+            try:
+                stream.execute(HOLDERS_QUERY, (job['airline_name'], job['flight_num'],
+                                               job['last_email']))
+                while True:
+                    holders = stream.fetchmany(batch_size)
+                    if not holders:
+                        break
+                    messages = [render(flight, job['flight_status'], holder)
+                                for holder in holders]
+                    self._send(sink, messages)
+                    sent += len(messages)
+                    self._checkpoint(job['job_id'], messages[-1].to, len(messages))
+            finally:
+                stream.close()
+        finally:
+            connection.close()
+        return sent
+
+    def _send(self, sink, messages):
+        config = current_app.config
+        retries = config.get('NOTIFICATION_SEND_RETRIES', 3)
+        backoff = config.get('NOTIFICATION_RETRY_SECONDS', 1)
+        bucket = self._rate_limiter()
+        for attempt in range(retries + 1):
+            self._count('throttled_seconds', bucket.acquire(len(messages)))
+            try:
+                sink.send(messages)
+            except Exception:
+                if attempt == retries:
+                    self._count('messages_failed', len(messages))
+                    raise
+                self._count('send_retries')
+                time.sleep(backoff * 2 ** attempt)
+                continue
+            self._count('messages_sent', len(messages))
+            return
+
+    def _checkpoint(self, job_id, last_email, sent):
+        # started_at 同时作心跳, 长任务不会被当成进程已挂而重复领取
+        cursor = database.get_db().cursor()
+        try:
+            cursor.execute("""
+                UPDATE notification_job
+                SET last_email = %s, sent = sent + %s, started_at = NOW()
+                WHERE job_id = %s
+            """, (last_email, sent, job_id))
+            database.commit()
+        finally:
+            cursor.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._metrics)
+            stats['throttled_seconds'] = round(stats['throttled_seconds'], 3)
+            stats['last_job'] = self._last_job
+            stats['worker_alive'] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+
+notifier = Notifier()
@@ -0,0 +1,48 @@
+"""Cached airline staff permissions.
+
+``staff_permissions`` memoizes the permission set for the rest of the
+request (on ``flask.g``) and across requests in ``permission_cache`` for
+``PERMISSION_CACHE_TTL`` seconds, so a page that checks permissions several
+times costs at most one query. ``staff.grant_permission`` drops the grantee's
+entry after its transaction commits; other worker processes see the change
+once their entry expires.
+"""
+from flask import g
+
+from config import Config
+from app.cache import TTLCache
+from app.database import get_db
+
+permission_cache = TTLCache(Config.PERMISSION_CACHE_SIZE, Config.PERMISSION_CACHE_TTL)
+
+PERMISSIONS_QUERY = """
+    SELECT permission_type
+    FROM permission
+    WHERE username = %s
+"""
+
+
+def staff_permissions(username):
+    """Permission types granted to ``username``, as a frozenset."""
+    memo = g.setdefault('_staff_permissions', {})
+    if username in memo:
+        return memo[username]
+
+    permissions = permission_cache.get(username)
+    if permissions is None:
+        cursor = get_db().cursor()
+        try:
+            cursor.execute(PERMISSIONS_QUERY, (username,))
+            permissions = frozenset(row['permission_type'] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+        permission_cache.set(username, permissions)
+
+    memo[username] = permissions
+    return permissions
+
+
+def invalidate(username):
+    """Forget the cached permissions of ``username``."""
+    permission_cache.pop(username)
+    g.get('_staff_permissions', {}).pop(username, None)
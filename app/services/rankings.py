@@ -0,0 +1,77 @@
+"""Booking agent rankings for ``staff.view_agents``.
+
+All rankings come from one query over ``agent_commission_daily``. It reads
+every agent that works for the airline once and sums tickets and commission
+for each configured window. The rankings are then sorted in Python, so
+agents without sales rank with 0 like any other agent.
+
+A ranking is ``(name, months, metric)`` with ``metric`` either
+``'tickets'`` or ``'commission'``; see ``AGENT_RANKINGS`` in ``config.py``.
+"""
+from app.services.commissions import months_ago
+
+METRIC_KEYS = {'tickets': 'ticket_count', 'commission': 'commission'}
+
+# {columns}: window_columns() 生成的各窗口求和列
+WINDOW_TOTALS_QUERY = """
+    SELECT ba.email, ba.booking_agent_id, {columns}
+    FROM booking_agent ba
+    JOIN booking_agent_work_for baw ON ba.email = baw.email
+    LEFT JOIN agent_commission_daily d
+        ON d.booking_agent_id = ba.booking_agent_id AND d.sale_date >= %s
+    WHERE baw.airline_name = %s
+    GROUP BY ba.email, ba.booking_agent_id
+"""
+
+
+def window_columns(windows):
+    """``(columns SQL, params)`` summing tickets and commission per window."""
+    columns, params = [], []
+    for months, start in sorted(windows.items()):
+        columns.append(f"COALESCE(SUM(CASE WHEN d.sale_date >= %s THEN d.tickets END), 0)"
+                       f" as tickets_{months}")
+        columns.append(f"COALESCE(SUM(CASE WHEN d.sale_date >= %s THEN d.commission END), 0)"
+                       f" as commission_{months}")
+        params += [start, start]
+    return ', '.join(columns), params
+
+
+def agent_window_totals(cursor, airline_name, windows, today):
+    """Per agent of the airline: tickets and commission since each window start.
+
+    ``windows`` maps a window (months) to its start date. Returns rows with
+    ``email``, ``booking_agent_id`` and ``tickets_<months>`` /
+    ``commission_<months>`` columns.
+    """
+    columns, params = window_columns(windows)
+    earliest = min(windows.values()) if windows else today
+    cursor.execute(WINDOW_TOTALS_QUERY.format(columns=columns),
+                   tuple(params) + (earliest, airline_name))
+    return cursor.fetchall()
+
+
+def rank(rows, value_key, k):
+    """Top ``k`` rows by ``value_key`` with SQL ``RANK()`` numbering (ties share a rank)."""
+    ordered = sorted(rows, key=lambda row: (-row[value_key], row['email']))[:k]
+    ranked, previous = [], None
+    for position, row in enumerate(ordered, 1):
+        if previous is None or row[value_key] != previous[value_key]:
+            rank_num = position
+        ranked.append(dict(row, rank_num=rank_num))
+        previous = row
+    return ranked
+
+
+def agent_rankings(cursor, airline_name, rankings, k, today):
+    """``{name: [{email, booking_agent_id, ticket_count|commission, rank_num}]}``."""
+    windows = {months: months_ago(today, months) for _, months, _ in rankings}
+    totals = agent_window_totals(cursor, airline_name, windows, today)
+
+    result = {}
+    for name, months, metric in rankings:
+        value_key = METRIC_KEYS[metric]
+        rows = [{'email': row['email'],
+                 'booking_agent_id': row['booking_agent_id'],
+                 value_key: row[f'{metric}_{months}']} for row in totals]
+        result[name] = rank(rows, value_key, k)
+    return result
@@ -0,0 +1,87 @@
+"""Daily sales rollup behind the staff reports and dashboard.
+
+``sales_daily`` has one row per (airline, purchase date, channel), where the
+channel is ``'direct'`` for customer purchases and ``'agent'`` for bookings
+made by an agent, holding the number of tickets and their revenue.
+``booking.book_ticket`` adds each sale with ``record_sale`` in the purchase
+transaction; ``flask --app run rollups rebuild sales_daily`` recomputes it
+from ``purchases``.
+"""
+
+DIRECT = 'direct'
+AGENT = 'agent'
+
+MONTHLY_SALES_QUERY = """
+    SELECT DATE_FORMAT(sale_date, '%%Y-%%m') as month,
+           CAST(SUM(tickets) AS SIGNED) as total,
+           CAST(SUM(CASE WHEN channel = 'direct' THEN tickets ELSE 0 END) AS SIGNED)
+               as direct_sales,
+           CAST(SUM(CASE WHEN channel = 'agent' THEN tickets ELSE 0 END) AS SIGNED)
+               as indirect_sales,
+           SUM(revenue) as revenue,
+           SUM(CASE WHEN channel = 'direct' THEN revenue ELSE 0 END) as direct_revenue,
+           SUM(CASE WHEN channel = 'agent' THEN revenue ELSE 0 END) as indirect_revenue
+    FROM sales_daily
+    WHERE airline_name = %s AND sale_date BETWEEN %s AND %s
+    GROUP BY DATE_FORMAT(sale_date, '%%Y-%%m')
+    ORDER BY month
+"""
+
+MONTH_TO_DATE_QUERY = """
+    SELECT COALESCE(SUM(CASE WHEN channel = 'direct' THEN revenue ELSE 0 END), 0)
+               as direct_revenue,
+           COALESCE(SUM(CASE WHEN channel = 'agent' THEN revenue ELSE 0 END), 0)
+               as indirect_revenue,
+           COALESCE(SUM(tickets), 0) as tickets_sold
+    FROM sales_daily
+    WHERE airline_name = %s
+    AND sale_date >= DATE_FORMAT(CURDATE(), '%%Y-%%m-01')
+"""
+
+
+def channel(booking_agent_id):
+    return DIRECT if booking_agent_id is None else AGENT
+
+
+def record_sale(cursor, flight, sale_date, booking_agent_id=None):
+    """Add one ticket on ``flight`` (a row with airline_name and price)."""
+    cursor.execute("""
+        INSERT INTO sales_daily (airline_name, sale_date, channel, tickets, revenue)
+        VALUES (%s, %s, %s, 1, %s)
+        ON DUPLICATE KEY UPDATE
+            tickets = tickets + 1,
+            revenue = revenue + VALUES(revenue)
+    """, (flight['airline_name'], sale_date, channel(booking_agent_id), flight['price']))
+
+
+def rebuild(cursor):
+    """Recompute ``sales_daily`` from the purchases."""
+    cursor.execute("DELETE FROM sales_daily")
+    cursor.execute("""
+        INSERT INTO sales_daily (airline_name, sale_date, channel, tickets, revenue)
+        SELECT t.airline_name, p.purchase_date,
+               CASE WHEN p.booking_agent_id IS NULL THEN 'direct' ELSE 'agent' END,
+               COUNT(*), SUM(f.price)
+        FROM purchases p
+        JOIN ticket t ON p.ticket_id = t.ticket_id
+        JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
+        GROUP BY t.airline_name, p.purchase_date,
+                 CASE WHEN p.booking_agent_id IS NULL THEN 'direct' ELSE 'agent' END
+    """)
+    return cursor.rowcount
+
+
+def monthly_sales(cursor, airline_name, start_date, end_date):
+    """Tickets and revenue per month, split by channel, oldest month first.
+
+    Ticket counts are cast back to integers (SUM of an INT column is DECIMAL)
+    so the report can ``json.dumps`` them.
+    """
+    cursor.execute(MONTHLY_SALES_QUERY, (airline_name, start_date, end_date))
+    return cursor.fetchall()
+
+
+def month_to_date(cursor, airline_name):
+    """Direct / agent revenue and tickets sold since the first of this month."""
+    cursor.execute(MONTH_TO_DATE_QUERY, (airline_name,))
+    return cursor.fetchone()
@@ -0,0 +1,215 @@
+"""Bulk flight schedule import for ``staff.import_schedule``.
+
+The uploaded file is CSV (one header row) or JSON (a list of objects, or
+``{"flights": [...]}``) with the columns ``flight_num``,
+``departure_airport``, ``departure_time``, ``arrival_airport``,
+``arrival_time``, ``price``, ``airplane_id`` and optionally ``status``
+(default ``Upcoming``). Times are ISO ``YYYY-MM-DD HH:MM``.
+
+The whole file is validated first against the airport catalog, the
+airline's fleet and its existing flight numbers, each read once, and
+against the aircraft occupancy index so no airplane is double-booked. If
+any row is invalid nothing is imported and every error is reported with
+its line (CSV) or position (JSON). Otherwise the flights are inserted with
+``executemany`` in chunks of ``SCHEDULE_IMPORT_CHUNK_SIZE``, each chunk in
+its own transaction together with its ``route_daily_fare`` rows. Before
+inserting, a chunk locks its airplanes and is checked against the database
+(``aircraft_schedule.locked_conflicts``), since the index may not have seen
+other processes' flights yet. A chunk that clashes or fails is rolled back
+and reported, and the next chunk is still tried.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from flask import current_app
+
+from app import database
+from app.services import fares
+from app.services.aircraft_schedule import aircraft_schedule, locked_conflicts
+from app.services.airports import airport_catalog
+from app.services.search_cache import invalidate_flights
+
+REQUIRED_COLUMNS = ('flight_num', 'departure_airport', 'departure_time',
+                    'arrival_airport', 'arrival_time', 'price', 'airplane_id')
+
+ImportResult = namedtuple('ImportResult', ['imported', 'errors', 'routes'])
+
+
+def read_rows(filename, data):
+    """``[(line, row dict)]`` from the uploaded bytes. Raises ValueError."""
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        try:
+            rows = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON: {e}')
+        if isinstance(rows, dict):
+            rows = rows.get('flights')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('JSON must be a list of flight objects')
+        return list(enumerate(rows, 1))
+    if filename.lower().endswith('.csv'):
+        reader = csv.DictReader(io.StringIO(text))
+        missing = set(REQUIRED_COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Missing column(s): {', '.join(sorted(missing))}")
+        return [(reader.line_num, row) for row in reader]
+    raise ValueError('Upload a .csv or .json file')
+
+
+def fleet(cursor, airline_name):
+    """``airplane_id -> seats`` of the airline."""
+    cursor.execute("SELECT airplane_id, seats FROM airplane WHERE airline_name = %s",
+                   (airline_name,))
+    return {row['airplane_id']: row['seats'] for row in cursor.fetchall()}
+
+
+def flight_numbers(cursor, airline_name):
+    cursor.execute("SELECT flight_num FROM flight WHERE airline_name = %s", (airline_name,))
+    return {row['flight_num'] for row in cursor.fetchall()}
+
+
+def _text(row, column):
+    value = row.get(column)
+    return '' if value is None else str(value).strip()
+
+
+def parse_row(row, airline_name, airports, airplanes):
+    """One validated flight dict; raises ValueError with the reason."""
+    missing = [column for column in REQUIRED_COLUMNS if not _text(row, column)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        flight_num = int(_text(row, 'flight_num'))
+        airplane_id = int(_text(row, 'airplane_id'))
+    except ValueError:
+        raise ValueError('flight_num and airplane_id must be integers')
+    try:
+        departure_time = datetime.fromisoformat(_text(row, 'departure_time'))
+        arrival_time = datetime.fromisoformat(_text(row, 'arrival_time'))
+    except ValueError:
+        raise ValueError('times must look like YYYY-MM-DD HH:MM')
+    try:
+        price = Decimal(_text(row, 'price'))
+    except InvalidOperation:
+        raise ValueError('price must be a number')
+
+    departure_airport = _text(row, 'departure_airport')
+    arrival_airport = _text(row, 'arrival_airport')
+    for airport in (departure_airport, arrival_airport):
+        if airport not in airports:
+            raise ValueError(f'unknown airport {airport}')
+    if departure_airport == arrival_airport:
+        raise ValueError('departure and arrival airport are the same')
+    if departure_time >= arrival_time:
+        raise ValueError('departure time must be before arrival time')
+    if price <= 0:
+        raise ValueError('price must be positive')
+    if airplane_id not in airplanes:
+        raise ValueError(f'airplane {airplane_id} does not belong to {airline_name}')
+
+    return {'airline_name': airline_name, 'flight_num': flight_num,
+            'departure_airport': departure_airport, 'departure_time': departure_time,
+            'arrival_airport': arrival_airport, 'arrival_time': arrival_time,
+            'price': price, 'status': _text(row, 'status') or 'Upcoming',
+            'airplane_id': airplane_id, 'remaining_seats': airplanes[airplane_id]}
+
+
+def validate(rows, airline_name, airports, airplanes, taken, check=None):
+    """``(flights, errors)`` where errors are ``(line, message)``.
+
+    ``check(flight)`` returns the flight_num the flight's airplane would be
+    double-booked with (see ``aircraft_schedule.BatchCheck``).
+    """
+    flights, errors, seen = [], [], set(taken)
+    for line, row in rows:
+        try:
+            flight = parse_row(row, airline_name, airports, airplanes)
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        if flight['flight_num'] in seen:
+            errors.append((line, f"flight number {flight['flight_num']} is already used"))
+            continue
+        seen.add(flight['flight_num'])
+        clash = check(flight) if check is not None else None
+        if clash is not None:
+            errors.append((line, f"airplane {flight['airplane_id']} is already flying "
+                                 f"flight {clash} at that time"))
+            continue
+        flights.append((line, flight))
+    return flights, errors
+
+
+def insert_flights(cursor, flights):
+    """Insert validated flight dicts and add them to ``route_daily_fare``."""
+    cursor.executemany("""
+        INSERT INTO flight (
+            airline_name, flight_num, departure_airport,
+            departure_time, arrival_airport, arrival_time,
+            price, status, airplane_id, remaining_seats
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, [(f['airline_name'], f['flight_num'], f['departure_airport'],
+           f['departure_time'], f['arrival_airport'], f['arrival_time'],
+           f['price'], f['status'], f['airplane_id'], f['remaining_seats'])
+          for f in flights])
+    fares.flights_added(cursor, flights)
+
+
+def import_schedule(filename, data, airline_name):
+    """Validate and import an uploaded schedule. Returns an ``ImportResult``."""
+    rows = read_rows(filename, data)
+    max_rows = current_app.config.get('SCHEDULE_IMPORT_MAX_ROWS', 10000)
+    if len(rows) > max_rows:
+        raise ValueError(f'At most {max_rows} flights per file')
+
+    cursor = database.get_db().cursor()
+    try:
+        airplanes = fleet(cursor, airline_name)
+        taken = flight_numbers(cursor, airline_name)
+    finally:
+        cursor.close()
+    flights, errors = validate(rows, airline_name, airport_catalog.cities(), airplanes, taken,
+                               check=aircraft_schedule.batch(airline_name).check)
+    if errors or not flights:
+        return ImportResult(0, errors, [])
+
+    # 每块一个事务: 前面已提交的块不受后面失败的影响
+    chunk_size = current_app.config.get('SCHEDULE_IMPORT_CHUNK_SIZE', 500)
+    imported, routes = 0, {}
+    for start in range(0, len(flights), chunk_size):
+        lines = [line for line, _ in flights[start:start + chunk_size]]
+        chunk = [flight for _, flight in flights[start:start + chunk_size]]
+        cursor = database.get_db().cursor()
+        try:
+            clashes = locked_conflicts(cursor, airline_name, chunk)
+            if clashes:
+                database.get_db().rollback()
+                errors.extend((line, f"airplane {flight['airplane_id']} is already flying "
+                                     f"flight {clashes[flight['flight_num']]} at that time")
+                              for line, flight in zip(lines, chunk)
+                              if flight['flight_num'] in clashes)
+                errors.append((lines[0], f'rows {lines[0]}-{lines[-1]} not imported'))
+                continue
+            insert_flights(cursor, chunk)
+            database.after_commit(lambda chunk=chunk: invalidate_flights(chunk))
+            database.after_commit(lambda chunk=chunk: aircraft_schedule.add_flights(chunk))
+            database.commit()
+        except Exception as e:
+            database.get_db().rollback()
+            current_app.logger.exception('Schedule import chunk failed')
+            errors.append((lines[0], f'rows {lines[0]}-{lines[-1]} not imported: {e}'))
+            continue
+        finally:
+            cursor.close()
+        imported += len(chunk)
+        for flight in chunk:
+            route = (flight['departure_airport'], flight['arrival_airport'])
+            routes[route] = routes.get(route, 0) + 1
+    # 航线按导入航班数排序, 供预热搜索缓存
+    return ImportResult(imported, errors, sorted(routes, key=routes.get, reverse=True))
@@ -0,0 +1,42 @@
+"""Cache of flight search results.
+
+Keys are normalized queries: ``(kind, sources, destinations, window_start,
+window_end)``. ``sources`` and ``destinations`` are the frozensets of
+airport names the search terms resolved to (None means any airport), and
+the window bounds are datetimes (None means open). Entries expire after
+``SEARCH_CACHE_TTL`` seconds and the least recently used ones are evicted
+beyond ``SEARCH_CACHE_SIZE``.
+
+When a flight is created or its status changes, only the entries whose
+route sets and window contain that flight are dropped.
+"""
+from config import Config
+from app.cache import TTLCache
+
+search_cache = TTLCache(Config.SEARCH_CACHE_SIZE, Config.SEARCH_CACHE_TTL)
+
+
+def search_key(kind, sources, destinations, window_start, window_end):
+    return (kind, sources, destinations, window_start, window_end)
+
+
+def _contains(key, departure_airport, arrival_airport, departure_time):
+    _, sources, destinations, start, end = key
+    return ((sources is None or departure_airport in sources)
+            and (destinations is None or arrival_airport in destinations)
+            and (start is None or departure_time >= start)
+            and (end is None or departure_time <= end))
+
+
+def invalidate_flight(departure_airport, arrival_airport, departure_time):
+    """Drop the cached searches that would contain this flight."""
+    return search_cache.discard_where(
+        lambda key: _contains(key, departure_airport, arrival_airport, departure_time))
+
+
+def invalidate_flights(flights):
+    """``invalidate_flight`` for many flight dicts in one pass over the cache."""
+    flights = [(flight['departure_airport'], flight['arrival_airport'],
+                flight['departure_time']) for flight in flights]
+    return search_cache.discard_where(
+        lambda key: any(_contains(key, *flight) for flight in flights))
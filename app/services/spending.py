@@ -0,0 +1,108 @@
+"""Per-customer monthly spending aggregate behind ``customer.track_spending``.
+
+``customer_spending_monthly`` has one row per customer and month (the first
+day of the month) with the tickets bought and their total price.
+``booking.book_ticket`` adds each purchase with ``record_spending``; a
+refund should call it with a negative amount and ``tickets=-1`` in the same
+transaction that removes the purchase. ``flask --app run rollups rebuild``
+recomputes the table from ``purchases``.
+
+``monthly_spending`` answers whole months from the aggregate. Only a range
+that starts or ends in the middle of a month reads that month's purchases.
+"""
+import calendar
+from datetime import date, timedelta
+
+WHOLE_MONTHS_QUERY = """
+    SELECT DATE_FORMAT(month, '%%Y-%%m') as month, total
+    FROM customer_spending_monthly
+    WHERE customer_email = %s AND month BETWEEN %s AND %s
+"""
+
+# {ranges}: 一个或多个 "p.purchase_date BETWEEN %s AND %s", 用 OR 连接
+PARTIAL_MONTHS_QUERY = """
+    SELECT DATE_FORMAT(p.purchase_date, '%%Y-%%m') as month, SUM(f.price) as total
+    FROM purchases p
+    JOIN ticket t ON p.ticket_id = t.ticket_id
+    JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
+    WHERE p.customer_email = %s AND ({ranges})
+    GROUP BY DATE_FORMAT(p.purchase_date, '%%Y-%%m')
+"""
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def record_spending(cursor, customer_email, sale_date, amount, tickets=1):
+    cursor.execute("""
+        INSERT INTO customer_spending_monthly (customer_email, month, tickets, total)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            tickets = tickets + VALUES(tickets),
+            total = total + VALUES(total)
+    """, (customer_email, month_start(sale_date), tickets, amount))
+
+
+def rebuild(cursor):
+    """Recompute ``customer_spending_monthly`` from the purchases."""
+    cursor.execute("DELETE FROM customer_spending_monthly")
+    cursor.execute("""
+        INSERT INTO customer_spending_monthly (customer_email, month, tickets, total)
+        SELECT p.customer_email, DATE_FORMAT(p.purchase_date, '%Y-%m-01'),
+               COUNT(*), SUM(f.price)
+        FROM purchases p
+        JOIN ticket t ON p.ticket_id = t.ticket_id
+        JOIN flight f ON t.airline_name = f.airline_name AND t.flight_num = f.flight_num
+        GROUP BY p.customer_email, DATE_FORMAT(p.purchase_date, '%Y-%m-01')
+    """)
+    return cursor.rowcount
+
+
+def _split(start_date, end_date, today):
+    """Split the range into whole months and partial (from, to) ranges."""
+    # 截止到今天 (或更晚) 的月份没有之后的购买, 可以按整月处理
+    def ends_month(day):
+        return day >= today or day == month_end(day)
+
+    first, last = month_start(start_date), month_start(end_date)
+    if first == last:
+        if start_date.day == 1 and ends_month(end_date):
+            return (first, last), []
+        return None, [(start_date, end_date)]
+
+    partial = []
+    if start_date.day != 1:
+        partial.append((start_date, month_end(start_date)))
+        first = month_end(start_date) + timedelta(days=1)
+    if not ends_month(end_date):
+        partial.append((last, end_date))
+        last = month_start(last - timedelta(days=1))
+    return ((first, last) if first <= last else None), partial
+
+
+def monthly_spending(cursor, customer_email, start_date, end_date, today=None):
+    """``[{month: 'YYYY-MM', total}]`` for purchases between two dates (inclusive)."""
+    if start_date > end_date:
+        return []
+    whole, partial = _split(start_date, end_date, today or date.today())
+    totals = {}
+
+    if whole:
+        cursor.execute(WHOLE_MONTHS_QUERY, (customer_email,) + whole)
+        for row in cursor.fetchall():
+            totals[row['month']] = row['total']
+
+    if partial:
+        ranges = ' OR '.join(['p.purchase_date BETWEEN %s AND %s'] * len(partial))
+        params = (customer_email,) + tuple(day for bounds in partial for day in bounds)
+        cursor.execute(PARTIAL_MONTHS_QUERY.format(ranges=ranges), params)
+        for row in cursor.fetchall():
+            totals[row['month']] = totals.get(row['month'], 0) + row['total']
+
+    return [{'month': month, 'total': totals[month]}
+            for month in sorted(totals) if totals[month]]
@@ -0,0 +1,22 @@
+"""Loading users for Flask-Login from typed ids.
+
+``User.get_id`` returns ``"<user_type>:<key>"`` (for example
+``"staff:admin"``), so ``load_user`` reads exactly one table by primary key.
+
+Login state is kept in ``session`` (``session['user']`` and
+``session['user_type']``) and ``auth.login`` does not call ``login_user``,
+so nothing calls the loader yet; it is ready for when ``current_user`` is
+used.
+"""
+from app.models import db
+from app.models.user import Customer, BookingAgent, AirlineStaff
+
+USER_MODELS = {model.user_type: model for model in (Customer, BookingAgent, AirlineStaff)}
+
+
+def load_user(user_id):
+    """The user for a Flask-Login id, or None."""
+    user_type, sep, key = user_id.partition(':')
+    if not sep or user_type not in USER_MODELS:
+        return None
+    return db.session.get(USER_MODELS[user_type], key)
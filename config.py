@@ -14,5 +14,86 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # 关闭SQLAlchemy事件系统（推荐关闭以提高性能）
 
+    # 连接池配置 (SQLAlchemy 与 get_db() 共用同一个连接池)
+    DB_POOL_SIZE = 10          # 常驻连接数
+    DB_POOL_MAX_OVERFLOW = 20  # 高峰时允许额外创建的连接数
+    DB_POOL_RECYCLE = 1800     # 秒, 需小于 MySQL 的 wait_timeout
+    DB_POOL_TIMEOUT = 30       # 连接池耗尽时等待的秒数
+    DB_POOL_PRE_PING = True    # 借出前检测连接是否存活
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_POOL_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+    # 缓存配置
+    AIRPORT_CACHE_TTL = 300  # 秒, 其他进程新增机场后最迟多久可见
+    SEARCH_CACHE_SIZE = 1024  # 航班搜索结果缓存的条目数上限
+    SEARCH_CACHE_TTL = 60     # 秒
+    PERMISSION_CACHE_SIZE = 4096
+    PERMISSION_CACHE_TTL = 30  # 秒, 其他进程授予的权限最迟多久生效
+    AGENT_AUTH_CACHE_SIZE = 4096
+    AGENT_AUTH_TTL = 60        # 秒, 代理审批/授权状态
+
+    # 转机行程搜索
+    ITINERARY_HORIZON_DAYS = 60          # 内存航班索引覆盖未来多少天
+    ITINERARY_INDEX_TTL = 600            # 秒, 定期整体重新加载索引
+    ITINERARY_MAX_LEGS = 3               # 最多几段航班
+    ITINERARY_MIN_LAYOVER_MINUTES = 45
+    ITINERARY_MAX_LAYOVER_MINUTES = 720
+
+    # 低价日历 (route_daily_fare)
+    FARE_CALENDAR_DAYS = 30              # 默认天数
+    FARE_CALENDAR_MAX_DAYS = 90
+
+    # 代理排名 (staff.view_agents): (模板变量名, 最近几个月, 'tickets' 或 'commission')
+    AGENT_RANKING_TOP_K = 5
+    AGENT_RANKINGS = [
+        ('top_monthly_sales', 1, 'tickets'),
+        ('top_yearly_sales', 12, 'tickets'),
+        ('top_yearly_commission', 12, 'commission'),
+    ]
+
+    # 热门目的地 / 常客 top-K sketch (heavy_hitters)
+    HEAVY_HITTER_CAPACITY = 64           # 每个 sketch (每天 / 每个窗口) 最多保留的项数
+    HEAVY_HITTER_WINDOW_MONTHS = 12      # 保留的最长窗口
+    HEAVY_HITTER_TTL = None              # 秒, 多个 worker 进程时定期重新加载; None 只在首次使用时加载
+
+    # 航班时刻表批量导入 (staff.import_schedule)
+    SCHEDULE_IMPORT_MAX_ROWS = 10000
+    SCHEDULE_IMPORT_CHUNK_SIZE = 500     # 每个事务插入的航班数
+    SCHEDULE_IMPORT_WARM_ROUTES = 20     # 导入后预热搜索缓存的航线数
+
+    # 飞机占用索引 (防止同一架飞机同时执飞两个航班)
+    AIRCRAFT_INDEX_TTL = 600             # 秒, 定期从数据库重新加载
+    AIRCRAFT_MIN_TURNAROUND_MINUTES = 0  # 延误顺延时, 同一飞机前后两班之间的最短过站时间
+    FLIGHT_STATUS_BULK_MAX = 500         # 批量改状态一次最多的航班数
+
+    # 周期航班模板 (flight_template), 每天由 flask schedule extend 向前生成
+    FLIGHT_TEMPLATE_HORIZON_DAYS = 60
+
+    # 航班延误/取消时通知乘客 (notification_job, 后台线程发送)
+    NOTIFICATION_WORKER = True           # False: 只由 flask notifications run 发送
+    NOTIFICATION_SINK = 'file'           # 'file' 或 'smtp'
+    NOTIFICATION_FILE = 'notifications.jsonl'
+    NOTIFICATION_SMTP_HOST = 'localhost'
+    NOTIFICATION_SMTP_PORT = 1025        # 本地 SMTP stub
+    NOTIFICATION_SMTP_TIMEOUT = 10
+    NOTIFICATION_SENDER = 'noreply@airline.local'
+    NOTIFICATION_BATCH_SIZE = 100        # 每批读取/渲染/发送的乘客数
+    NOTIFICATION_RATE_PER_SECOND = 20    # 每个进程每秒最多发送的消息数
+    NOTIFICATION_SEND_RETRIES = 3        # 一批发送失败后的重试次数
+    NOTIFICATION_RETRY_SECONDS = 1       # 批重试的初始间隔, 每次翻倍
+    NOTIFICATION_MAX_ATTEMPTS = 5        # 任务最多执行几次, 之后标记 failed
+    NOTIFICATION_JOB_RETRY_MINUTES = 1   # 任务重试的初始间隔, 每次翻倍
+    NOTIFICATION_STALE_MINUTES = 10      # running 任务多久没有进度就重新领取
+    NOTIFICATION_POLL_SECONDS = 30
+
+    # 分页配置 (可用 ?per_page= 调整, 不超过 MAX_PAGE_SIZE)
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
+
     # 其他配置
     DEBUG = True
@@ -0,0 +1,11 @@
+-- Per-flight seat inventory, decremented atomically on every sale.
+
+ALTER TABLE `flight`
+  ADD COLUMN `remaining_seats` int(11) NOT NULL DEFAULT 0;
+
+UPDATE `flight` f
+JOIN `airplane` a ON f.airline_name = a.airline_name AND f.airplane_id = a.airplane_id
+SET f.remaining_seats = a.seats - (
+  SELECT COUNT(*) FROM `ticket` t
+  WHERE t.airline_name = f.airline_name AND t.flight_num = f.flight_num
+);
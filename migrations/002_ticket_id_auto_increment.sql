@@ -0,0 +1,10 @@
+-- Ticket IDs come from AUTO_INCREMENT instead of SELECT MAX(ticket_id) + 1.
+-- purchases.ticket_id references this column, so foreign key checks are
+-- switched off while its definition changes.
+
+SET FOREIGN_KEY_CHECKS = 0;
+
+ALTER TABLE `ticket`
+  MODIFY `ticket_id` int(11) NOT NULL AUTO_INCREMENT;
+
+SET FOREIGN_KEY_CHECKS = 1;
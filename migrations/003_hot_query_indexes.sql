@@ -0,0 +1,21 @@
+-- Secondary indexes for the hot query predicates.
+-- InnoDB drops the implicit foreign key index on a column once one of these
+-- indexes can enforce the constraint instead.
+
+CREATE INDEX `idx_purchases_customer_date`
+  ON `purchases` (`customer_email`, `purchase_date`);
+
+CREATE INDEX `idx_purchases_agent_date`
+  ON `purchases` (`booking_agent_id`, `purchase_date`);
+
+CREATE INDEX `idx_flight_departure`
+  ON `flight` (`departure_airport`, `departure_time`);
+
+CREATE INDEX `idx_flight_airline_departure`
+  ON `flight` (`airline_name`, `departure_time`);
+
+CREATE INDEX `idx_ticket_flight`
+  ON `ticket` (`airline_name`, `flight_num`);
+
+CREATE INDEX `idx_booking_agent_approved`
+  ON `booking_agent` (`approved`);
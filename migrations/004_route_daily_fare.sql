@@ -0,0 +1,21 @@
+-- Per-route daily fare aggregate for the low-fare calendar
+-- (maintained by app/services/fares.py).
+
+CREATE TABLE `route_daily_fare` (
+  `departure_airport` varchar(50) NOT NULL,
+  `arrival_airport` varchar(50) NOT NULL,
+  `flight_date` date NOT NULL,
+  `min_price` decimal(10,0),
+  `seats_left` int(11) NOT NULL DEFAULT 0,
+  `flights` int(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`departure_airport`, `arrival_airport`, `flight_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+INSERT INTO `route_daily_fare`
+  (`departure_airport`, `arrival_airport`, `flight_date`, `min_price`, `seats_left`, `flights`)
+SELECT `departure_airport`, `arrival_airport`, DATE(`departure_time`),
+       MIN(CASE WHEN `remaining_seats` > 0 THEN `price` END),
+       SUM(`remaining_seats`), COUNT(*)
+FROM `flight`
+WHERE `status` <> 'cancelled'
+GROUP BY `departure_airport`, `arrival_airport`, DATE(`departure_time`);
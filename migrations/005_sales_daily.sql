@@ -0,0 +1,21 @@
+-- Daily sales rollup per airline and channel ('direct' or 'agent') for the
+-- staff reports (maintained by app/services/sales.py).
+
+CREATE TABLE `sales_daily` (
+  `airline_name` varchar(50) NOT NULL,
+  `sale_date` date NOT NULL,
+  `channel` varchar(10) NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `revenue` decimal(14,0) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`airline_name`, `sale_date`, `channel`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+INSERT INTO `sales_daily` (`airline_name`, `sale_date`, `channel`, `tickets`, `revenue`)
+SELECT t.`airline_name`, p.`purchase_date`,
+       CASE WHEN p.`booking_agent_id` IS NULL THEN 'direct' ELSE 'agent' END,
+       COUNT(*), SUM(f.`price`)
+FROM `purchases` p
+JOIN `ticket` t ON p.`ticket_id` = t.`ticket_id`
+JOIN `flight` f ON t.`airline_name` = f.`airline_name` AND t.`flight_num` = f.`flight_num`
+GROUP BY t.`airline_name`, p.`purchase_date`,
+         CASE WHEN p.`booking_agent_id` IS NULL THEN 'direct' ELSE 'agent' END;
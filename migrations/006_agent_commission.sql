@@ -0,0 +1,59 @@
+-- Per-airline agent commission rate, the commission ledger and its per-day
+-- and per-customer aggregates (maintained by app/services/commissions.py).
+
+ALTER TABLE `airline`
+  ADD COLUMN `commission_rate` decimal(5,4) NOT NULL DEFAULT 0.1000;
+
+CREATE TABLE `agent_commission` (
+  `ticket_id` int(11) NOT NULL,
+  `booking_agent_id` int(11) NOT NULL,
+  `customer_email` varchar(50) NOT NULL,
+  `airline_name` varchar(50) NOT NULL,
+  `sale_date` date NOT NULL,
+  `price` decimal(10,0) NOT NULL,
+  `rate` decimal(5,4) NOT NULL,
+  `commission` decimal(12,2) NOT NULL,
+  PRIMARY KEY(`ticket_id`),
+  KEY `idx_agent_commission_agent_date` (`booking_agent_id`, `sale_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `agent_commission_daily` (
+  `booking_agent_id` int(11) NOT NULL,
+  `sale_date` date NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `commission` decimal(14,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`booking_agent_id`, `sale_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `agent_customer_daily` (
+  `booking_agent_id` int(11) NOT NULL,
+  `customer_email` varchar(50) NOT NULL,
+  `sale_date` date NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `commission` decimal(14,2) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`booking_agent_id`, `customer_email`, `sale_date`),
+  KEY `idx_agent_customer_daily_date` (`booking_agent_id`, `sale_date`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+INSERT INTO `agent_commission`
+  (`ticket_id`, `booking_agent_id`, `customer_email`, `airline_name`,
+   `sale_date`, `price`, `rate`, `commission`)
+SELECT p.`ticket_id`, p.`booking_agent_id`, p.`customer_email`, t.`airline_name`,
+       p.`purchase_date`, f.`price`, a.`commission_rate`,
+       ROUND(f.`price` * a.`commission_rate`, 2)
+FROM `purchases` p
+JOIN `ticket` t ON p.`ticket_id` = t.`ticket_id`
+JOIN `flight` f ON t.`airline_name` = f.`airline_name` AND t.`flight_num` = f.`flight_num`
+JOIN `airline` a ON a.`airline_name` = t.`airline_name`
+WHERE p.`booking_agent_id` IS NOT NULL;
+
+INSERT INTO `agent_commission_daily` (`booking_agent_id`, `sale_date`, `tickets`, `commission`)
+SELECT `booking_agent_id`, `sale_date`, COUNT(*), SUM(`commission`)
+FROM `agent_commission`
+GROUP BY `booking_agent_id`, `sale_date`;
+
+INSERT INTO `agent_customer_daily`
+  (`booking_agent_id`, `customer_email`, `sale_date`, `tickets`, `commission`)
+SELECT `booking_agent_id`, `customer_email`, `sale_date`, COUNT(*), SUM(`commission`)
+FROM `agent_commission`
+GROUP BY `booking_agent_id`, `customer_email`, `sale_date`;
@@ -0,0 +1,18 @@
+-- Per-customer monthly spending for customer.track_spending
+-- (maintained by app/services/spending.py).
+
+CREATE TABLE `customer_spending_monthly` (
+  `customer_email` varchar(50) NOT NULL,
+  `month` date NOT NULL,
+  `tickets` int(11) NOT NULL DEFAULT 0,
+  `total` decimal(14,0) NOT NULL DEFAULT 0,
+  PRIMARY KEY(`customer_email`, `month`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+INSERT INTO `customer_spending_monthly` (`customer_email`, `month`, `tickets`, `total`)
+SELECT p.`customer_email`, DATE_FORMAT(p.`purchase_date`, '%Y-%m-01'),
+       COUNT(*), SUM(f.`price`)
+FROM `purchases` p
+JOIN `ticket` t ON p.`ticket_id` = t.`ticket_id`
+JOIN `flight` f ON t.`airline_name` = f.`airline_name` AND t.`flight_num` = f.`flight_num`
+GROUP BY p.`customer_email`, DATE_FORMAT(p.`purchase_date`, '%Y-%m-01');
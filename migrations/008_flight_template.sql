@@ -0,0 +1,33 @@
+-- Recurring flight templates and the dated flights generated from them
+-- (maintained by app/services/flight_templates.py).
+
+CREATE TABLE `flight_template` (
+  `template_id` int(11) NOT NULL AUTO_INCREMENT,
+  `airline_name` varchar(50) NOT NULL,
+  `departure_airport` varchar(50) NOT NULL,
+  `arrival_airport` varchar(50) NOT NULL,
+  `weekdays` tinyint(4) NOT NULL,
+  `departure_clock` time NOT NULL,
+  `duration_minutes` int(11) NOT NULL,
+  `valid_from` date NOT NULL,
+  `valid_until` date NOT NULL,
+  `airplane_id` int(11) NOT NULL,
+  `price` decimal(10,0) NOT NULL,
+  `generated_until` date DEFAULT NULL,
+  PRIMARY KEY(`template_id`),
+  KEY `idx_flight_template_airline` (`airline_name`, `valid_until`),
+  FOREIGN KEY(`airline_name`, `airplane_id`) REFERENCES `airplane`(`airline_name`, `airplane_id`),
+  FOREIGN KEY(`departure_airport`) REFERENCES `airport`(`airport_name`),
+  FOREIGN KEY(`arrival_airport`) REFERENCES `airport`(`airport_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `flight_template_instance` (
+  `template_id` int(11) NOT NULL,
+  `flight_date` date NOT NULL,
+  `airline_name` varchar(50) NOT NULL,
+  `flight_num` int(11) NOT NULL,
+  PRIMARY KEY(`template_id`, `flight_date`),
+  UNIQUE KEY `uq_flight_template_instance_flight` (`airline_name`, `flight_num`),
+  FOREIGN KEY(`template_id`) REFERENCES `flight_template`(`template_id`),
+  FOREIGN KEY(`airline_name`, `flight_num`) REFERENCES `flight`(`airline_name`, `flight_num`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
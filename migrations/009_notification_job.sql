@@ -0,0 +1,21 @@
+-- Queue of passenger notification jobs, one per flight status change
+-- (processed by app/services/notifications.py).
+
+CREATE TABLE `notification_job` (
+  `job_id` int(11) NOT NULL AUTO_INCREMENT,
+  `airline_name` varchar(50) NOT NULL,
+  `flight_num` int(11) NOT NULL,
+  `flight_status` varchar(50) NOT NULL,
+  `state` varchar(10) NOT NULL DEFAULT 'pending',
+  `attempts` int(11) NOT NULL DEFAULT 0,
+  `run_after` datetime NOT NULL,
+  `created_at` datetime NOT NULL,
+  `started_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  `last_email` varchar(50) NOT NULL DEFAULT '',
+  `sent` int(11) NOT NULL DEFAULT 0,
+  `last_error` varchar(255) DEFAULT NULL,
+  PRIMARY KEY(`job_id`),
+  KEY `idx_notification_job_state` (`state`, `run_after`),
+  FOREIGN KEY(`airline_name`, `flight_num`) REFERENCES `flight`(`airline_name`, `flight_num`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;